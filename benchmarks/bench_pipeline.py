@@ -0,0 +1,113 @@
+"""
+Micro-benchmarks of the CPU-bound pipeline stages, without the web server or the model
+
+    python -m benchmarks.bench_pipeline [--pages 1,10,100,500] [--repeat 5] [--json results.json]
+
+Times PDF text extraction on generated PDFs, Markdown rendering of study
+guides, and both ReportLab exporters.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from .common import isolate_environment, make_pdf, print_table
+from .fake_gemini import fake_markdown, fake_quiz
+
+# Study guide sizes (tokens) and quiz lengths (questions) rendered by the benchmarks
+STUDY_GUIDE_TOKENS = (500, 2000, 8000, 32000)
+QUIZ_QUESTIONS = (5, 20, 100)
+
+
+def measure(fn, repeat):
+    """
+    Run fn once to warm up, then repeat times
+
+    Returns:
+        dict: Fastest, median and slowest run in milliseconds
+    """
+    fn()
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return {
+        "min_ms": min(durations) * 1000,
+        "median_ms": statistics.median(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def bench_extraction(workdir, page_counts, repeat):
+    from study_buddy.utils.pdf_processor import extract_text_from_pdf
+
+    rows = []
+    for pages in page_counts:
+        path = make_pdf(os.path.join(workdir, f"extract_{pages}.pdf"), pages)
+        result = measure(lambda: extract_text_from_pdf(path), repeat)
+        result.update(benchmark="extract_text_from_pdf", size=f"{pages} pages",
+                      per_second=pages / (result["median_ms"] / 1000))
+        rows.append(result)
+    return rows
+
+
+def bench_markdown(repeat):
+    import markdown
+
+    rows = []
+    for tokens in STUDY_GUIDE_TOKENS:
+        text = fake_markdown(tokens)
+        result = measure(lambda: markdown.markdown(text, extensions=["tables"]), repeat)
+        result.update(benchmark="markdown_render", size=f"{tokens} tokens",
+                      per_second=tokens / (result["median_ms"] / 1000))
+        rows.append(result)
+    return rows
+
+
+def bench_exports(repeat):
+    from study_buddy.utils.pdf_export import render_quiz_pdf, render_study_guide_pdf
+
+    rows = []
+    for tokens in STUDY_GUIDE_TOKENS:
+        text = fake_markdown(tokens)
+        result = measure(lambda: render_study_guide_pdf(text, "Study Guide for bench.pdf"), repeat)
+        result.update(benchmark="render_study_guide_pdf", size=f"{tokens} tokens",
+                      per_second=tokens / (result["median_ms"] / 1000))
+        rows.append(result)
+    for count in QUIZ_QUESTIONS:
+        quiz = json.loads(fake_quiz(count))
+        result = measure(lambda: render_quiz_pdf(quiz, "Quiz for bench.pdf"), repeat)
+        result.update(benchmark="render_quiz_pdf", size=f"{count} questions",
+                      per_second=count / (result["median_ms"] / 1000))
+        rows.append(result)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", default="1,10,100,500", help="Page counts of the extracted PDFs")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--only", choices=["extract", "markdown", "export"], help="Run one group of benchmarks")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    workdir = isolate_environment()
+    rows = []
+    if args.only in (None, "extract"):
+        rows += bench_extraction(workdir, [int(pages) for pages in args.pages.split(",")], args.repeat)
+    if args.only in (None, "markdown"):
+        rows += bench_markdown(args.repeat)
+    if args.only in (None, "export"):
+        rows += bench_exports(args.repeat)
+
+    # per_second counts pages, tokens or questions, matching the size column
+    print_table(rows, ["benchmark", "size", "min_ms", "median_ms", "max_ms", "per_second"])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
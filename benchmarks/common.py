@@ -0,0 +1,134 @@
+"""
+Helpers shared by the benchmarks: isolated app state, sample PDFs and latency statistics
+"""
+import os
+import random
+import tempfile
+
+from .fake_gemini import WORDS
+
+
+def isolate_environment(workdir=None):
+    """
+    Point every store of the app (database, uploads, caches, locks, jobs) at a scratch directory
+
+    Must run before study_buddy is imported, since its configuration is read
+    at import time. Variables already set are left alone, so a benchmark can
+    still be run against e.g. Redis.
+
+    Args:
+        workdir (str): Scratch directory (a new temporary directory by default)
+
+    Returns:
+        str: The scratch directory
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="study_buddy_bench_")
+    defaults = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(os.path.abspath(workdir), 'bench.sqlite3')}",
+        "STORAGE_DIR": os.path.join(workdir, "storage"),
+        "RESULT_CACHE_DIR": os.path.join(workdir, "cache"),
+        "SINGLEFLIGHT_LOCK_DIR": os.path.join(workdir, "locks"),
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles"),
+        "LOG_LEVEL": "WARNING",
+        "GEMINI_API_KEY": "offline",
+        # Every simulated user connects from the same address
+        "ADMISSION_IP_CONCURRENCY": "0",
+        "ADMISSION_IP_TPM": "0",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    return workdir
+
+
+def make_pdf(path, pages, seed=0):
+    """
+    Write a text PDF with the given number of pages
+
+    The output only depends on pages and seed, so identical calls produce
+    identical files (and hit the app's upload deduplication and result cache).
+
+    Args:
+        path (str): Output file
+        pages (int): Number of pages
+        seed: Varies the text
+
+    Returns:
+        str: path
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    rng = random.Random(f"{pages}-{seed}")
+    pdf = canvas.Canvas(path, pagesize=letter, invariant=1)
+    width, height = letter
+    for page in range(1, pages + 1):
+        text = pdf.beginText(72, height - 72)
+        text.setFont("Helvetica-Bold", 14)
+        text.textLine(f"Chapter {page}: {' '.join(rng.choices(WORDS, k=3)).title()}")
+        text.setFont("Helvetica", 10)
+        for _ in range(45):
+            text.textLine(" ".join(rng.choices(WORDS, k=12)))
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+    return path
+
+
+def percentile(sorted_values, p):
+    """
+    Percentile of already sorted values, interpolating between the closest ranks
+
+    Args:
+        sorted_values (list): Values in ascending order
+        p (float): Percentile between 0 and 100
+
+    Returns:
+        float: The percentile, or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(seconds):
+    """
+    Latency statistics of a list of durations
+
+    Returns:
+        dict: count, mean, p50, p95, p99 and max, in milliseconds
+    """
+    values = sorted(seconds)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * 1000,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def print_table(rows, columns):
+    """
+    Print dicts as an aligned text table
+
+    Args:
+        rows (list): One dict per row
+        columns (list): Keys to show, in order
+    """
+    def cell(value):
+        if isinstance(value, float):
+            return f"{value:.1f}"
+        return "-" if value is None else str(value)
+
+    cells = [[cell(row.get(column)) for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(line[i]) for line in cells]) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(value.ljust(width) for value, width in zip(line, widths)))
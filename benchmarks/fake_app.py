@@ -0,0 +1,21 @@
+"""
+The app with its Gemini model replaced by a local stand-in, for load tests
+
+    BENCH_GEMINI=fake gunicorn -c deploy/gunicorn.conf.py benchmarks.fake_app:app
+    python -m benchmarks.load_test --url http://localhost:5000
+
+State is kept under BENCH_DIR, shared by every worker; see fake_gemini for
+the variables configuring the stand-in.
+"""
+import os
+import tempfile
+
+from .common import isolate_environment
+
+isolate_environment(os.environ.get("BENCH_DIR", os.path.join(tempfile.gettempdir(), "study_buddy_bench")))
+
+from study_buddy.app import create_app  # noqa: E402
+from .fake_gemini import install_from_environment  # noqa: E402
+
+install_from_environment()
+app = create_app()
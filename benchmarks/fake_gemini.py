@@ -0,0 +1,339 @@
+"""
+Local stand-ins for the Gemini model, so benchmarks run offline
+
+FakeModel writes plausible study notes and quiz JSON with a configurable
+latency and output size. RecordingModel wraps the real model and saves every
+response as a fixture; ReplayModel serves those fixtures again with the
+timings they were recorded with.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+# Stand-in used by install_from_environment: "fake", "replay" or "record" (the real API, saving fixtures)
+BENCH_GEMINI = os.environ.get("BENCH_GEMINI", "fake")
+BENCH_FIXTURES_DIR = os.environ.get("BENCH_FIXTURES_DIR", os.path.join(os.path.dirname(__file__), "fixtures"))
+# Fake model behaviour
+BENCH_FIRST_TOKEN_SECONDS = float(os.environ.get("BENCH_FIRST_TOKEN_SECONDS", 0.5))
+BENCH_TOKENS_PER_SECOND = float(os.environ.get("BENCH_TOKENS_PER_SECOND", 200))  # 0 streams instantly
+BENCH_OUTPUT_TOKENS = int(os.environ.get("BENCH_OUTPUT_TOKENS", 1500))
+BENCH_ERROR_RATE = float(os.environ.get("BENCH_ERROR_RATE", 0))  # Share of calls failing with a 429
+# Replayed responses take their recorded time multiplied by this (0 replays instantly)
+BENCH_REPLAY_SPEED = float(os.environ.get("BENCH_REPLAY_SPEED", 1.0))
+
+# Roughly four characters per token, as in utils.compression
+CHARS_PER_TOKEN = 4
+# Tokens per streamed chunk
+CHUNK_TOKENS = 20
+
+WORDS = (
+    "algorithm analysis array binary cache compiler concurrency data database distributed entropy function graph "
+    "hash heap index kernel latency memory network object operating parallel pointer process protocol queue "
+    "recursion register scheduler semaphore stack system thread throughput transaction tree variable virtual"
+).split()
+
+
+class _Usage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class _Response:
+    """The parts of a google.generativeai response the app reads"""
+
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+def wants_json(generation_config):
+    if isinstance(generation_config, dict):
+        return generation_config.get("response_mime_type") == "application/json"
+    return getattr(generation_config, "response_mime_type", None) == "application/json"
+
+
+def prompt_key(prompt, generation_config=None):
+    """Fixture key of a call: the prompt and whether a JSON response was requested"""
+    kind = "json" if wants_json(generation_config) else "text"
+    return hashlib.sha256(f"{kind}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def split_chunks(text, chunk_chars=CHUNK_TOKENS * CHARS_PER_TOKEN):
+    return [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+
+
+def fake_markdown(tokens, seed=0):
+    """
+    Study-guide-like Markdown (headings, bullets, a table, code) of about the given size
+
+    Args:
+        tokens (int): Approximate size in tokens
+        seed: Makes the text deterministic
+
+    Returns:
+        str: Markdown text
+    """
+    rng = random.Random(seed)
+    target = tokens * CHARS_PER_TOKEN
+    parts = ["# Study Guide\n"]
+    size = len(parts[0])
+    section = 0
+    while size < target:
+        section += 1
+        block = [f"\n## {section}. {' '.join(rng.choices(WORDS, k=3)).title()}\n"]
+        for _ in range(rng.randint(3, 6)):
+            term = rng.choice(WORDS)
+            block.append(f"- **{term.title()}**: {' '.join(rng.choices(WORDS, k=rng.randint(8, 20)))}.\n")
+        if section % 3 == 0:
+            block.append("\n| Concept | Description |\n|---|---|\n")
+            for _ in range(3):
+                block.append(f"| {rng.choice(WORDS)} | {' '.join(rng.choices(WORDS, k=6))} |\n")
+        if section % 4 == 0:
+            block.append(f"\n```python\ndef {rng.choice(WORDS)}(x):\n    return x * {rng.randint(2, 9)}\n```\n")
+        text = "".join(block)
+        parts.append(text)
+        size += len(text)
+    parts.append("\n## Glossary\n")
+    parts.extend(f"- **{word.title()}**: {' '.join(rng.choices(WORDS, k=8))}.\n" for word in WORDS[:10])
+    return "".join(parts)
+
+
+def fake_quiz(num_questions, seed=0):
+    """
+    Quiz JSON as returned for the quiz response schema
+
+    Args:
+        num_questions (int): Number of questions
+        seed: Makes the questions deterministic and distinct from other seeds'
+
+    Returns:
+        str: JSON array of questions
+    """
+    rng = random.Random(seed)
+    questions = []
+    for i in range(num_questions):
+        options = rng.sample(WORDS, 4)
+        questions.append({
+            "question": f"Question {seed}-{i}: which term best describes {' '.join(rng.choices(WORDS, k=6))}?",
+            "options": options,
+            "answer": rng.choice(options),
+        })
+    return json.dumps(questions, indent=2)
+
+
+class FakeModel:
+    """
+    Stands in for genai.GenerativeModel with a simple latency model
+
+    A call takes first_token_seconds, then streams output_tokens at
+    tokens_per_second. Quiz calls (JSON responses) return as many questions as
+    the prompt asks for; other calls return Markdown study notes. Responses
+    depend only on the prompt, so repeated runs produce the same output.
+    """
+
+    def __init__(self, first_token_seconds=BENCH_FIRST_TOKEN_SECONDS, tokens_per_second=BENCH_TOKENS_PER_SECOND,
+                 output_tokens=BENCH_OUTPUT_TOKENS, error_rate=BENCH_ERROR_RATE):
+        self.first_token_seconds = first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(0)
+
+    def _respond(self, prompt, generation_config):
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise google_exceptions.ResourceExhausted("Fake quota exceeded")
+        seed = prompt_key(prompt, generation_config)[:12]
+        if wants_json(generation_config):
+            match = re.search(r"with (\d+) questions", prompt)
+            return fake_quiz(int(match.group(1)) if match else 5, seed)
+        return fake_markdown(self.output_tokens, seed)
+
+    def _usage(self, prompt, text):
+        return _Usage(len(prompt) // CHARS_PER_TOKEN, len(text) // CHARS_PER_TOKEN)
+
+    def _chunk_seconds(self, chunk):
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return len(chunk) / CHARS_PER_TOKEN / self.tokens_per_second
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        text = self._respond(prompt, generation_config)
+        if stream:
+            return self._stream(prompt, text)
+        time.sleep(self.first_token_seconds + self._chunk_seconds(text))
+        return _Response(text, self._usage(prompt, text))
+
+    def _stream(self, prompt, text):
+        time.sleep(self.first_token_seconds)
+        chunks = split_chunks(text)
+        for i, chunk in enumerate(chunks):
+            time.sleep(self._chunk_seconds(chunk))
+            yield _Response(chunk, self._usage(prompt, text) if i == len(chunks) - 1 else None)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        text = self._respond(prompt, generation_config)
+        await asyncio.sleep(self.first_token_seconds + self._chunk_seconds(text))
+        return _Response(text, self._usage(prompt, text))
+
+
+class RecordingModel:
+    """
+    Wraps the real model and saves each response as a fixture for ReplayModel
+
+    Fixtures are JSON files named after prompt_key(), holding the response
+    chunks, the token counts and how long the call took.
+    """
+
+    def __init__(self, model, fixtures_dir=BENCH_FIXTURES_DIR):
+        self.model = model
+        self.fixtures_dir = fixtures_dir
+        os.makedirs(fixtures_dir, exist_ok=True)
+
+    def _save(self, prompt, generation_config, chunks, usage, first_chunk_seconds, total_seconds):
+        fixture = {
+            "prompt_start": prompt.strip()[:200],
+            "json": wants_json(generation_config),
+            "chunks": chunks,
+            "prompt_tokens": getattr(usage, "prompt_token_count", None),
+            "output_tokens": getattr(usage, "candidates_token_count", None),
+            "first_chunk_seconds": first_chunk_seconds,
+            "total_seconds": total_seconds,
+        }
+        path = os.path.join(self.fixtures_dir, f"{prompt_key(prompt, generation_config)}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(fixture, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        if stream:
+            return self._stream(prompt, generation_config)
+        started = time.perf_counter()
+        response = self.model.generate_content(prompt, generation_config=generation_config)
+        elapsed = time.perf_counter() - started
+        self._save(prompt, generation_config, [response.text], response.usage_metadata, elapsed, elapsed)
+        return response
+
+    def _stream(self, prompt, generation_config):
+        started = time.perf_counter()
+        first_chunk_seconds = None
+        chunks = []
+        usage = None
+        for chunk in self.model.generate_content(prompt, generation_config=generation_config, stream=True):
+            if first_chunk_seconds is None:
+                first_chunk_seconds = time.perf_counter() - started
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            chunks.append(chunk.text)
+            yield chunk
+        self._save(prompt, generation_config, chunks, usage, first_chunk_seconds or 0.0,
+                   time.perf_counter() - started)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        started = time.perf_counter()
+        response = await self.model.generate_content_async(prompt, generation_config=generation_config)
+        elapsed = time.perf_counter() - started
+        self._save(prompt, generation_config, [response.text], response.usage_metadata, elapsed, elapsed)
+        return response
+
+
+class ReplayModel:
+    """
+    Serves responses saved by RecordingModel, with their recorded timings
+
+    Args:
+        fixtures_dir (str): Directory of recorded fixtures
+        speed (float): Multiplies recorded durations (0 replays instantly)
+        fallback: Model answering prompts that were never recorded (e.g. a
+            FakeModel); by default they raise KeyError
+    """
+
+    def __init__(self, fixtures_dir=BENCH_FIXTURES_DIR, speed=BENCH_REPLAY_SPEED, fallback=None):
+        self.fixtures_dir = fixtures_dir
+        self.speed = speed
+        self.fallback = fallback
+
+    def _load(self, prompt, generation_config):
+        path = os.path.join(self.fixtures_dir, f"{prompt_key(prompt, generation_config)}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            if self.fallback is not None:
+                return None
+            raise KeyError(f"No recorded response for prompt {prompt.strip()[:80]!r}; record it with BENCH_GEMINI=record")
+
+    @staticmethod
+    def _usage(fixture):
+        return _Usage(fixture["prompt_tokens"], fixture["output_tokens"])
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        fixture = self._load(prompt, generation_config)
+        if fixture is None:
+            return self.fallback.generate_content(prompt, generation_config=generation_config, stream=stream)
+        if stream:
+            return self._stream(fixture)
+        time.sleep(fixture["total_seconds"] * self.speed)
+        return _Response("".join(fixture["chunks"]), self._usage(fixture))
+
+    def _stream(self, fixture):
+        chunks = fixture["chunks"]
+        time.sleep(fixture["first_chunk_seconds"] * self.speed)
+        # Spread the rest of the recorded time evenly over the remaining chunks
+        gap = max(0.0, fixture["total_seconds"] - fixture["first_chunk_seconds"]) / max(1, len(chunks) - 1)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(gap * self.speed)
+            yield _Response(chunk, self._usage(fixture) if i == len(chunks) - 1 else None)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        fixture = self._load(prompt, generation_config)
+        if fixture is None:
+            return await self.fallback.generate_content_async(prompt, generation_config=generation_config)
+        await asyncio.sleep(fixture["total_seconds"] * self.speed)
+        return _Response("".join(fixture["chunks"]), self._usage(fixture))
+
+
+def install(model, rate_limits=False):
+    """
+    Make the app's shared Gemini client use the given model
+
+    Args:
+        model: FakeModel, ReplayModel or RecordingModel
+        rate_limits (bool): Keep the client's requests/tokens per minute limits
+            (off by default, so benchmarks measure the app rather than the quota)
+    """
+    from study_buddy.utils import gemini_client
+    from study_buddy.utils.rate_limit import TokenBucket
+
+    gemini_client.client._model = model
+    if not rate_limits:
+        gemini_client.client.requests = TokenBucket(0)
+        gemini_client.client.tokens = TokenBucket(0)
+
+
+def install_from_environment():
+    """
+    Install the stand-in selected by BENCH_GEMINI
+
+    Returns:
+        The installed model
+    """
+    if BENCH_GEMINI == "fake":
+        model = FakeModel()
+    elif BENCH_GEMINI == "replay":
+        model = ReplayModel()
+    elif BENCH_GEMINI == "record":
+        from study_buddy.utils import gemini_client
+        model = RecordingModel(gemini_client.get_gemini_model())
+        install(model, rate_limits=True)  # Real calls still count against the quota
+        return model
+    else:
+        raise ValueError(f"Unknown Gemini stand-in: {BENCH_GEMINI}")
+    install(model)
+    return model
@@ -0,0 +1,220 @@
+"""
+Drive the Flask routes with concurrent simulated users and report latency percentiles
+
+    python -m benchmarks.load_test [--users 8] [--iterations 3] [--pages 10] [--shared]
+    python -m benchmarks.load_test --url http://localhost:5000   # a server started from benchmarks.fake_app
+
+Each user uploads a generated PDF, generates a study guide and a quiz
+through the background job routes, polls them, views and downloads both.
+By default the app runs in this process on a threaded Werkzeug server, with
+the Gemini stand-in selected by BENCH_GEMINI (see fake_gemini).
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+from .common import isolate_environment, make_pdf, print_table, summarize
+
+# Seconds between job status polls, and before a job is given up on
+POLL_INTERVAL = 0.1
+JOB_TIMEOUT = 300
+
+
+class LoadTestError(Exception):
+    """A step of a simulated user's scenario got an unexpected response"""
+
+
+class Recorder:
+    """Collects the latency of every request, by step, from all users"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, step, seconds, ok=True):
+        with self._lock:
+            if ok:
+                self.latencies[step].append(seconds)
+            else:
+                self.errors[step] += 1
+
+
+class User:
+    """
+    One simulated browser session
+
+    Redirects are not followed, so each request is timed on its own. Every
+    request uses a new connection, like a browser without keep-alive.
+    """
+
+    def __init__(self, base_url, recorder):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.recorder = recorder
+        self.cookies = SimpleCookie()
+
+    def request(self, step, method, path, body=None, headers=None, expect=(200,)):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{name}={morsel.value}" for name, morsel in self.cookies.items())
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=JOB_TIMEOUT)
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except OSError as e:
+            self.recorder.add(step, 0, ok=False)
+            raise LoadTestError(f"{step}: {e}")
+        finally:
+            connection.close()
+        elapsed = time.perf_counter() - started
+
+        for cookie in response.headers.get_all("Set-Cookie") or []:
+            self.cookies.load(cookie)
+        ok = response.status in expect
+        self.recorder.add(step, elapsed, ok)
+        if not ok:
+            raise LoadTestError(f"{step}: HTTP {response.status} for {method} {path}")
+        return response, data
+
+    def upload(self, pdf_name, pdf_bytes):
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="pdf_file"; filename="{pdf_name}"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+        ).encode("utf-8") + pdf_bytes + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.request("upload", "POST", "/upload", body,
+                     {"Content-Type": f"multipart/form-data; boundary={boundary}"}, expect=(302,))
+
+    def run_job(self, name, path, form):
+        """Submit a generation job, wait for it and view its result"""
+        started = time.perf_counter()
+        _, data = self.request(f"{name}_submit", "POST", path, form,
+                               {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"},
+                               expect=(202,))
+        job = json.loads(data)
+        while True:
+            _, data = self.request("job_status", "GET", job["status_url"], headers={"Accept": "application/json"})
+            status = json.loads(data)
+            if status["status"] == "finished":
+                break
+            if status["status"] in ("failed", "cancelled"):
+                raise LoadTestError(f"{name} job {status['status']}: {status['error']}")
+            if time.perf_counter() - started > JOB_TIMEOUT:
+                raise LoadTestError(f"{name} job did not finish within {JOB_TIMEOUT}s")
+            time.sleep(POLL_INTERVAL)
+        # Time from submitting the job to its result being available
+        self.recorder.add(f"{name}_job", time.perf_counter() - started)
+
+        response, _ = self.request("job_result", "GET", job["result_url"], expect=(302,))
+        self.request(f"{name}_view", "GET", urlsplit(response.headers["Location"]).path)
+
+    def scenario(self, pdf_name, pdf_bytes):
+        started = time.perf_counter()
+        self.request("index", "GET", "/")
+        self.upload(pdf_name, pdf_bytes)
+        self.run_job("study_guide", "/generate_study_guide", b"")
+        self.request("study_guide_download", "GET", "/download_study_guide")
+        self.run_job("quiz", "/generate_quiz", b"num_questions=5")
+        self.request("quiz_download", "GET", "/download_quiz")
+        self.recorder.add("scenario", time.perf_counter() - started)
+
+
+def start_server():
+    """
+    Serve the app (with the Gemini stand-in) from this process
+
+    Returns:
+        str: Base URL of the server
+    """
+    from werkzeug.serving import make_server
+    from .fake_app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # One line per request would drown the report
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="load-test-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Test a running server instead of starting one in this process")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=3, help="Scenarios run by each user")
+    parser.add_argument("--pages", type=int, default=10, help="Pages of the uploaded PDFs")
+    parser.add_argument("--shared", action="store_true",
+                        help="Every user uploads the same PDF (exercises deduplication, caching and coalescing)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.url:
+        workdir = isolate_environment()  # Only for the generated PDFs
+        base_url = args.url
+    else:
+        workdir = os.environ.setdefault("BENCH_DIR", isolate_environment())
+        base_url = start_server()
+
+    # Distinct PDFs per scenario unless --shared, so each upload needs its own generations
+    pdfs = {}
+    for user in range(args.users):
+        for iteration in range(args.iterations):
+            seed = 0 if args.shared else f"{user}-{iteration}"
+            path = os.path.join(workdir, f"load_{args.pages}_{seed}.pdf")
+            if not os.path.exists(path):
+                make_pdf(path, args.pages, seed)
+            with open(path, "rb") as f:
+                pdfs[user, iteration] = (os.path.basename(path), f.read())
+
+    recorder = Recorder()
+    failures = []
+
+    def run_user(user):
+        client = User(base_url, recorder)
+        for iteration in range(args.iterations):
+            try:
+                client.scenario(*pdfs[user, iteration])
+            except LoadTestError as e:
+                failures.append(str(e))
+                recorder.add("scenario", 0, ok=False)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        list(executor.map(run_user, range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    rows = []
+    for step in sorted(set(recorder.latencies) | set(recorder.errors)):
+        row = summarize(recorder.latencies[step])
+        row.update(step=step, count=len(recorder.latencies[step]), errors=recorder.errors[step])
+        rows.append(row)
+    print_table(rows, ["step", "count", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+
+    requests = sum(len(latencies) for step, latencies in recorder.latencies.items()
+                   if step != "scenario" and not step.endswith("_job"))
+    scenarios = len(recorder.latencies["scenario"])
+    print(f"\n{scenarios} scenarios, {requests} requests in {elapsed:.1f}s: "
+          f"{requests / elapsed:.1f} requests/s, {scenarios / elapsed * 60:.1f} scenarios/min")
+    for failure in failures[:10]:
+        print(f"failed: {failure}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"elapsed_seconds": elapsed, "requests": requests, "scenarios": scenarios,
+                       "steps": rows, "failures": failures}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
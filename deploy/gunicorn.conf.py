@@ -0,0 +1,57 @@
+# Gunicorn settings for running several workers per node:
+#
+#   gunicorn -c deploy/gunicorn.conf.py
+#
+# Load one of the profiles in this directory first (e.g. `set -a; . deploy/multi-node.env; set +a`)
+# so every worker shares its sessions, uploads, jobs and cached results.
+import multiprocessing
+import os
+
+wsgi_app = "study_buddy.app:create_app()"
+
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+# Jobs of the default "thread" backend live in the memory of the worker that queued them, so polling them
+# from any other worker fails: several workers need a shared job backend (one of the profiles above)
+shared_jobs = os.environ.get("JOB_BACKEND", "thread") != "thread"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1 if shared_jobs else 1))
+if workers > 1 and not shared_jobs:
+    raise RuntimeError(f"{workers} workers need a shared job backend: load deploy/single-node.env or "
+                       "deploy/multi-node.env (JOB_BACKEND=sqlite or redis), or set WEB_CONCURRENCY=1")
+
+# Threaded workers, so streamed study guides and job polling do not block a whole process
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Generation runs in background jobs; requests themselves should be short
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+
+# Create the app once in the master and fork the workers from it, so they share its
+# memory (see warm_up) and start serving without importing anything themselves
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from study_buddy.app import warm_up
+        warm_up(server.app.wsgi())
+
+
+# With PROMETHEUS_MULTIPROC_DIR set, /metrics aggregates the metrics of every worker.
+# The directory must exist before the app is loaded, which with preload_app happens before on_starting
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def on_starting(server):
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            os.remove(os.path.join(metrics_dir, name))
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,390 @@
+"""
+Versioned JSON API, for integrations (e.g. an LMS) that cannot scrape the HTML pages.
+
+Documents are identified by the SHA-256 of the uploaded PDF, study guides
+and quizzes by their IDs. No session is used. Every read carries a strong
+ETag and Cache-Control headers and answers If-None-Match with 304 before
+rendering anything, so clients and a CDN can serve repeat reads themselves.
+"""
+import json
+import logging
+import os
+
+from flask import Blueprint, Response, jsonify, request, send_file, url_for
+from werkzeug.exceptions import HTTPException
+
+from .app import (upload_store, blob_store, job_queue, find_or_extract_document, parse_quiz_options,
+                  quiz_source_text, study_guide_pdf, quiz_pdf, admit_generation, submit_generation, generation_cost)
+from .utils import document_store
+from .utils.admission import AdmissionRejected, estimate_cost
+from .utils.artifacts import content_hash, cached_file
+from .utils.gemini_client import generate_study_guide, generate_quiz
+from .utils.jobs import FINISHED
+from .utils.metrics import span, lazy_import
+
+logger = logging.getLogger(__name__)
+
+# Seconds clients and CDNs may reuse immutable responses (documents, study guides) without revalidating
+API_CACHE_MAX_AGE = int(os.environ.get("API_CACHE_MAX_AGE", 86400))
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+
+class ApiError(Exception):
+    """Error returned to the client as a JSON body with the given status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@api.errorhandler(ApiError)
+def api_error(error):
+    return jsonify({'error': error.message}), error.status
+
+
+@api.errorhandler(AdmissionRejected)
+def too_many_requests(error):
+    response = jsonify({'error': error.message, 'retry_after': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+    # JSON instead of the HTML pages and flash redirects of the web routes (404, 405, 413, ...)
+    return jsonify({'error': error.description}), error.code
+
+
+# Handlers for a status code take precedence over handlers for an exception class, so the
+# app-wide 413 handler of the web routes would otherwise answer API requests
+api.register_error_handler(413, http_error)
+
+
+def cache_headers(response, etag, immutable):
+    """
+    Mark a response as cacheable
+
+    Args:
+        response (Response): Response to a GET request
+        etag (str): Strong ETag of the representation
+        immutable (bool): Whether the resource can never change (otherwise caches must revalidate)
+
+    Returns:
+        Response: The response, or a 304 if the client already has this representation
+    """
+    response.set_etag(etag)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = API_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def not_modified(etag, immutable):
+    """A 304 response if the client sent a matching If-None-Match, so the body need not be built"""
+    # Weak comparison, since compressed responses carry the weak form of the ETag (see app.compress_response)
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return cache_headers(Response(status=304), etag, immutable)
+
+
+def json_body():
+    """The request's JSON object, or None when the body is not JSON"""
+    body = request.get_json(silent=True)
+    if body is not None and not isinstance(body, dict):
+        raise ApiError('The request body must be a JSON object')
+    return body
+
+
+def wants_to_wait():
+    """Whether the client asked for generation to complete within the request (?wait=true)"""
+    body = json_body() or {}
+    return str(request.args.get('wait', body.get('wait', ''))).lower() in ('1', 'true', 'yes')
+
+
+def get_document_or_404(digest):
+    document = document_store.find_document(digest)
+    if document is None:
+        raise ApiError('Document not found', 404)
+    return document
+
+
+def document_json(document):
+    return {
+        'id': document.content_hash,
+        'pages': len(document.pages),
+        'created_at': document.created_at.isoformat(),
+        'links': {
+            'self': url_for('api_v1.get_document', digest=document.content_hash),
+            'study_guides': url_for('api_v1.create_study_guide', digest=document.content_hash),
+            'quizzes': url_for('api_v1.create_quiz', digest=document.content_hash),
+        },
+    }
+
+
+def study_guide_json(study_guide, digest):
+    return {
+        'id': study_guide.id,
+        'document_id': digest,
+        'created_at': study_guide.created_at.isoformat(),
+        'markdown': study_guide.markdown,
+        'links': {
+            'self': url_for('api_v1.get_study_guide', study_guide_id=study_guide.id),
+            'markdown': url_for('api_v1.get_study_guide_markdown', study_guide_id=study_guide.id),
+            'html': url_for('api_v1.get_study_guide_html', study_guide_id=study_guide.id),
+            'pdf': url_for('api_v1.get_study_guide_pdf', study_guide_id=study_guide.id),
+        },
+    }
+
+
+def quiz_json(quiz, digest):
+    return {
+        'id': quiz.id,
+        'document_id': digest,
+        'created_at': quiz.created_at.isoformat(),
+        'questions': json.loads(quiz.questions),
+        'links': {
+            'self': url_for('api_v1.get_quiz', quiz_id=quiz.id),
+            'pdf': url_for('api_v1.get_quiz_pdf', quiz_id=quiz.id),
+        },
+    }
+
+
+def document_hash(document_id):
+    document = document_store.get_document(document_id)
+    return document.content_hash if document else None
+
+
+def job_json(job_id, job):
+    result = {
+        'job_id': job_id,
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'links': {'self': url_for('api_v1.get_job', job_id=job_id)},
+    }
+    if job['status'] == FINISHED:
+        if 'study_guide_id' in job['result']:
+            result['links']['study_guide'] = url_for('api_v1.get_study_guide',
+                                                     study_guide_id=job['result']['study_guide_id'])
+        if 'quiz_id' in job['result']:
+            result['links']['quiz'] = url_for('api_v1.get_quiz', quiz_id=job['result']['quiz_id'])
+    return result
+
+
+def job_created(job_id):
+    response = jsonify(job_json(job_id, job_queue.get(job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api_v1.get_job', job_id=job_id)
+    return response
+
+
+def created(body, location):
+    response = jsonify(body)
+    response.status_code = 201
+    response.headers['Location'] = location
+    return response
+
+
+@api.route('/documents', methods=['POST'])
+def upload_document():
+    # Either a multipart form with a "file" field or the raw PDF as the body
+    file = request.files.get('file')
+    if file is None and request.mimetype != 'application/pdf':
+        raise ApiError('Send a PDF as the request body (Content-Type: application/pdf) or as the "file" form field')
+
+    with span('upload_save'):
+        digest = upload_store.save(file.stream if file is not None else request.stream)
+
+    try:
+        document = find_or_extract_document(digest)
+    except Exception as e:
+        logger.error(f"Error processing PDF: {str(e)}")
+        if document_store.find_document(digest) is None:
+            upload_store.remove(digest)
+        raise ApiError(f'Could not process the PDF: {str(e)}', 422)
+    if document is None:
+        raise ApiError('No text could be extracted from the PDF (it may be scanned or image-based)', 422)
+
+    # The document stays until this upload's reference is released, or until unused for DOCUMENT_TTL.
+    # Only the uploader gets the token that releases it.
+    body = document_json(document)
+    body['reference'] = document_store.add_reference(document.id)
+    return created(body, url_for('api_v1.get_document', digest=digest))
+
+
+@api.route('/documents/<digest>', methods=['GET'])
+def get_document(digest):
+    document = get_document_or_404(digest)
+    # The hash identifies the PDF, whose extraction never changes; created_at changes if the
+    # document is deleted and uploaded again
+    etag = f"document-{digest}-{document.created_at:%Y%m%d%H%M%S%f}"
+    response = not_modified(etag, immutable=True)
+    if response is not None:
+        return response
+    return cache_headers(jsonify(document_json(document)), etag, immutable=True)
+
+
+@api.route('/documents/<digest>', methods=['DELETE'])
+def delete_document(digest):
+    # Drops the reference taken by one upload, given its token; generated study guides and quizzes
+    # go with the document once nothing else references it
+    document = get_document_or_404(digest)
+    token = request.headers.get('X-Document-Reference', '')
+    if not token or not document_store.drop_reference(document.id, token):
+        raise ApiError('Send the reference returned by the upload in the X-Document-Reference header', 403)
+    removed_hash = document_store.release_document(document.id)
+    if removed_hash:
+        upload_store.remove(removed_hash)
+    return Response(status=204)
+
+
+@api.route('/documents/<digest>/study_guides', methods=['POST'])
+def create_study_guide(digest):
+    document = get_document_or_404(digest)
+    if not wants_to_wait():
+        return job_created(submit_generation('study_guide', generation_cost(document), use_session=False,
+                                             document_id=document.id))
+
+    with admit_generation(estimate_cost(len(document.text)), in_request=True, use_session=False):
+        try:
+            study_guide_id = document_store.save_study_guide(document.id, generate_study_guide(document.text))
+        except Exception as e:
+            raise ApiError(str(e), 502)
+    study_guide = document_store.get_study_guide(study_guide_id)
+    return created(study_guide_json(study_guide, digest),
+                   url_for('api_v1.get_study_guide', study_guide_id=study_guide_id))
+
+
+@api.route('/documents/<digest>/quizzes', methods=['POST'])
+def create_quiz(digest):
+    document = get_document_or_404(digest)
+    try:
+        options = parse_quiz_options(json_body() or request.form)
+    except (ValueError, TypeError, AttributeError):
+        raise ApiError('Invalid number of questions or page range')
+
+    num_questions = options['num_questions']
+    if not wants_to_wait():
+        selected = bool(options['topic'] or options['first_page'] or options['last_page'])
+        return job_created(submit_generation('quiz', generation_cost(document, num_questions, selected),
+                                             use_session=False, document_id=document.id, **options))
+
+    try:
+        text = quiz_source_text(document, options['topic'], options['first_page'], options['last_page'])
+    except Exception as e:
+        raise ApiError(str(e), 502)
+    with admit_generation(estimate_cost(len(text), num_questions), in_request=True, use_session=False):
+        try:
+            quiz_id = document_store.save_quiz(document.id, num_questions, json.loads(generate_quiz(text, num_questions)))
+        except Exception as e:
+            raise ApiError(str(e), 502)
+    quiz = document_store.get_quiz(quiz_id)
+    return created(quiz_json(quiz, digest), url_for('api_v1.get_quiz', quiz_id=quiz_id))
+
+
+@api.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise ApiError('Job not found', 404)
+    response = jsonify(job_json(job_id, job))
+    response.cache_control.no_store = True
+    return response
+
+
+def get_study_guide_or_404(study_guide_id):
+    study_guide = document_store.get_study_guide(study_guide_id)
+    if study_guide is None:
+        raise ApiError('Study guide not found', 404)
+    return study_guide
+
+
+# Study guides never change once generated; quizzes can grow (see /quiz/<id>/more)
+
+@api.route('/study_guides/<study_guide_id>')
+def get_study_guide(study_guide_id):
+    study_guide = get_study_guide_or_404(study_guide_id)
+    etag = content_hash('json', study_guide.markdown)
+    response = not_modified(etag, immutable=True)
+    if response is not None:
+        return response
+    body = jsonify(study_guide_json(study_guide, document_hash(study_guide.document_id)))
+    return cache_headers(body, etag, immutable=True)
+
+
+@api.route('/study_guides/<study_guide_id>/markdown')
+def get_study_guide_markdown(study_guide_id):
+    study_guide = get_study_guide_or_404(study_guide_id)
+    etag = content_hash('markdown', study_guide.markdown)
+    response = not_modified(etag, immutable=True)
+    if response is not None:
+        return response
+    body = Response(study_guide.markdown, content_type='text/markdown; charset=utf-8')
+    return cache_headers(body, etag, immutable=True)
+
+
+@api.route('/study_guides/<study_guide_id>/html')
+def get_study_guide_html(study_guide_id):
+    study_guide = get_study_guide_or_404(study_guide_id)
+    etag = content_hash('html', study_guide.markdown)
+    response = not_modified(etag, immutable=True)
+    if response is not None:
+        return response
+
+    # An HTML fragment (no page layout) for embedding; rendered once and cached like the PDFs
+    def render():
+        with span('markdown_render'):
+            return lazy_import('markdown').markdown(study_guide.markdown, extensions=['tables']).encode('utf-8')
+
+    html_path = cached_file(blob_store, f"{study_guide.id}_{etag}.html", render)
+    body = send_file(html_path, mimetype='text/html', etag=False)
+    return cache_headers(body, etag, immutable=True)
+
+
+@api.route('/study_guides/<study_guide_id>/pdf')
+def get_study_guide_pdf(study_guide_id):
+    study_guide = get_study_guide_or_404(study_guide_id)
+    title = request.args.get('title', 'Study Guide')[:200]
+    etag = content_hash(study_guide.markdown, title)
+    response = not_modified(etag, immutable=True)
+    if response is not None:
+        return response
+    body = send_file(study_guide_pdf(study_guide, title), mimetype='application/pdf', etag=False,
+                     download_name=f"study_guide_{study_guide.id}.pdf")
+    return cache_headers(body, etag, immutable=True)
+
+
+def get_quiz_or_404(quiz_id):
+    quiz = document_store.get_quiz(quiz_id)
+    if quiz is None:
+        raise ApiError('Quiz not found', 404)
+    return quiz
+
+
+@api.route('/quizzes/<quiz_id>')
+def get_quiz(quiz_id):
+    quiz = get_quiz_or_404(quiz_id)
+    etag = content_hash('json', quiz.questions)
+    response = not_modified(etag, immutable=False)
+    if response is not None:
+        return response
+    return cache_headers(jsonify(quiz_json(quiz, document_hash(quiz.document_id))), etag, immutable=False)
+
+
+@api.route('/quizzes/<quiz_id>/pdf')
+def get_quiz_pdf(quiz_id):
+    quiz = get_quiz_or_404(quiz_id)
+    title = request.args.get('title', 'Quiz')[:200]
+    etag = content_hash(quiz.questions, title)
+    response = not_modified(etag, immutable=False)
+    if response is not None:
+        return response
+    body = send_file(quiz_pdf(quiz, title), mimetype='application/pdf', etag=False,
+                     download_name=f"quiz_{quiz.id}.pdf")
+    return cache_headers(body, etag, immutable=False)
@@ -1,44 +1,185 @@
+import time
+_import_started = time.perf_counter()  # For the import-time report (see utils.metrics.IMPORT_SECONDS)
+
+import gc
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, session, send_file, send_from_directory, jsonify, abort, make_response, Response, stream_with_context, g
+from markupsafe import Markup
 from werkzeug.utils import secure_filename
+from dotenv import load_dotenv
 import uuid
-import tempfile
 import json
-from .utils.pdf_processor import extract_text_from_pdf
-from .utils.gemini_client import generate_study_guide, generate_quiz
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from flask_session import Session
-import tempfile
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import markdown  # Add this import
+
+# Load environment variables from .env file, before the modules below read their settings
+load_dotenv()
+
+from .utils.pdf_processor import extract_document, EXTRACTION_WORKERS
+from .utils.gemini_client import generate_study_guide, generate_quiz, stream_study_guide, flight, client
+from .utils.cache import result_cache
+from .utils.chunking import PROMPT_TOKEN_BUDGET
+from .utils.jobs import create_job_queue, task, JobCancelled, QUEUED, RUNNING, FINISHED, FAILED, CANCELLED, PRIORITY_LOW
+from .utils.upload_store import UploadStore
+from .utils.storage import STORAGE_BACKEND, STORAGE_DIR, create_blob_store, get_redis
+from .utils.janitor import StorageJanitor, SESSION_TTL_SECONDS
+from .utils import document_store, metrics, assets
+from .utils.metrics import span, lazy_import
+from .utils.artifacts import content_hash, cached_file, NAMESPACE as ARTIFACTS
+from .utils.batch import BATCH_CONCURRENCY, BATCH_MAX_UPLOAD_BYTES, save_batch_upload, archive_name, write_archive
+from .utils.admission import (AdmissionController, AdmissionRejected, estimate_cost, weight_of, CHARS_PER_TOKEN,
+                              BATCH_DOCUMENT_CHARS)
+from .models import db, add_missing_columns
+from flask_session import Session
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG"))
 logger = logging.getLogger(__name__)
 
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-development")
+# Uploaded PDFs and rendered downloads, in the storage backend shared by every worker
+blob_store = create_blob_store()
+
+# Uploaded PDFs, stored by content hash so identical uploads are saved once
+upload_store = UploadStore(blob_store)
+
+# Background worker pool for LLM generation; its threads start with the first request (see start_background_workers)
+job_queue = create_job_queue()
+
+# Per-session and per-IP limits on generation requests, and their fair ordering in the job queue
+admission_control = AdmissionController(job_queue, client)
+
+# Gauges computed when /metrics is scraped
+metrics.gauge('study_buddy_jobs', 'Background jobs by status (queued or running)', ['status'],
+              lambda: {(status,): count for status, count in job_queue.counts().items()})
+metrics.gauge('study_buddy_gemini_concurrency_limit', 'Current adaptive limit on concurrent Gemini calls (this process)', [],
+              lambda: {(): client.concurrency.limit})
+metrics.gauge('study_buddy_gemini_in_flight', 'Gemini calls in progress (this process)', [],
+              lambda: {(): client.concurrency.in_flight})
+metrics.gauge('study_buddy_result_cache_memory_entries', 'Entries in the in-memory result cache tier (this process)', [],
+              lambda: {(): result_cache.stats()['memory_entries']})
+metrics.gauge('study_buddy_storage_bytes', 'Bytes stored on this host, by namespace', ['namespace'],
+              lambda: {(namespace,): usage['bytes'] for namespace, usage in storage_janitor().usage().items()
+                       if isinstance(usage, dict) and 'bytes' in usage})
+metrics.gauge('study_buddy_storage_quota_bytes', 'Storage quota, by namespace', ['namespace'],
+              lambda: {(namespace,): usage['quota_bytes'] for namespace, usage in storage_janitor().usage().items()
+                       if isinstance(usage, dict) and 'quota_bytes' in usage})
+
+# Pages, uploads and downloads; the JSON API is in api.py
+web = Blueprint('web', __name__)
+
+# Modules imported on first use, so starting a worker does not pay for them; warm_up() loads them ahead of time
+DEFERRED_IMPORTS = ('.utils.pdf_export', 'markdown', 'google.generativeai', 'google.api_core.exceptions')
+
+def create_app(config=None):
+    """
+    Create and configure the app
+    
+    Heavy modules (see DEFERRED_IMPORTS) are imported on first use, and the
+    job workers and storage janitor start with the first request each process
+    serves, so creating the app is cheap and safe to do before forking
+    (gunicorn --preload, see deploy/gunicorn.conf.py).
+    
+    Args:
+        config (dict): Settings overriding the defaults (e.g. another DATABASE_URL)
+    
+    Returns:
+        Flask: The app
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-development")
+    
+    # Configure Flask-Session; sessions live in the shared storage backend so any worker can serve any request
+    if STORAGE_BACKEND == 'redis':
+        app.config['SESSION_TYPE'] = 'redis'  # Store sessions in Redis, shared by every node
+        app.config['SESSION_REDIS'] = get_redis()
+    else:
+        app.config['SESSION_TYPE'] = 'filesystem'  # Store sessions in the filesystem
+        app.config['SESSION_FILE_DIR'] = os.path.join(STORAGE_DIR, 'sessions')  # Shared by every worker on the host
+    app.config['SESSION_PERMANENT'] = False  # Sessions are not permanent
+    app.config['PERMANENT_SESSION_LIFETIME'] = SESSION_TTL_SECONDS  # Server-side expiry of stored sessions
+    app.config['SESSION_USE_SIGNER'] = True  # Sign session cookies for security
+    
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit file size to 16MB
+    app.config['STREAM_STUDY_GUIDES'] = os.environ.get("STREAM_STUDY_GUIDES", "0") == "1"  # Stream study guides as they are generated
+    app.config['SPECULATIVE_STUDY_GUIDE'] = os.environ.get("SPECULATIVE_STUDY_GUIDE", "0") == "1"  # Start a study guide right after upload
+    app.config['SPECULATIVE_QUIZ'] = os.environ.get("SPECULATIVE_QUIZ", "0") == "1"  # Start a default quiz right after upload
+    
+    # Configure the document store (SQLite in the instance folder by default)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL", "sqlite:///study_buddy.sqlite3")
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+    
+    app.config.update(config or {})
+    
+    # Initialize Flask-Session
+    Session(app)
+    
+    # Initialize the database
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        add_missing_columns()
+        # Workers forked from this process must not share its connections; each opens its own
+        db.engine.dispose()
+    
+    # Expires unused uploads, downloads, sessions and documents, and keeps storage within its quotas
+    app.extensions['storage_janitor'] = StorageJanitor(app, blob_store, flight.locks,
+                                                       session_dir=app.config.get('SESSION_FILE_DIR'))
+    
+    # Static files are linked to and served from their fingerprinted, precompressed build copies (see utils.assets)
+    app.extensions['assets'] = assets.load_manifest(app.static_folder)
+    app.view_functions['static'] = send_static_file
+    
+    app.register_blueprint(web)
+    
+    # Versioned JSON API; imported here since it uses this module's stores and helpers
+    from .api import api as api_v1
+    app.register_blueprint(api_v1)
+    
+    logger.info(f"Created the app in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return app
+
+def warm_up(app):
+    """
+    Load everything a worker would otherwise load on first use
+    
+    Run by the gunicorn master with --preload before it forks the workers, so
+    they share these modules and compiled templates instead of each importing
+    them on its first download or model call. Nothing holding threads or
+    sockets (the Gemini model, database connections) is created here, since
+    those do not survive a fork.
+    
+    Args:
+        app (Flask): App returned by create_app
+    """
+    started = time.perf_counter()
+    for name in DEFERRED_IMPORTS:
+        lazy_import(name, __package__)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # Objects allocated so far are never collected, so garbage collection in the
+    # workers does not write to (and copy) the memory they share with the master
+    gc.freeze()
+    logger.info(f"Warmed up in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+def storage_janitor():
+    """The storage janitor of the current app"""
+    return current_app.extensions['storage_janitor']
+
+# Process whose job workers and storage janitor are running; threads do not survive a fork
+_background_pid = None
+_background_lock = threading.Lock()
 
-# Configure Flask-Session
-app.config['SESSION_TYPE'] = 'filesystem'  # Store sessions in the filesystem
-app.config['SESSION_FILE_DIR'] = tempfile.mkdtemp()  # Temporary directory for session files
-app.config['SESSION_PERMANENT'] = False  # Sessions are not permanent
-app.config['SESSION_USE_SIGNER'] = True  # Sign session cookies for security
+# Names of the generation jobs shown in error messages
+JOB_LABELS = {'study_guide': 'study guide', 'quiz': 'quiz', 'quiz_more': 'more quiz questions', 'batch': 'batch'}
 
-# Initialize Flask-Session
-Session(app)
+# Most questions a quiz request may ask for, as the forms' num_questions inputs allow
+MAX_QUIZ_QUESTIONS = 20
 
-# Create temporary directories to store uploaded PDFs and generated content
-UPLOAD_FOLDER = tempfile.mkdtemp()
-OUTPUT_FOLDER = tempfile.mkdtemp()
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit file size to 16MB
+# Options of the quiz generated speculatively after upload
+DEFAULT_QUIZ_OPTIONS = {'num_questions': 5, 'topic': None, 'first_page': None, 'last_page': None}
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'pdf'}
@@ -46,16 +187,534 @@ ALLOWED_EXTENSIONS = {'pdf'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+def wants_json():
+    """Check whether the client (e.g. main.js) asked for a JSON response"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def job_accepted(job_id):
+    """Respond to a generation request that was queued as a background job"""
+    if wants_json():
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('web.job_status', job_id=job_id),
+            'result_url': url_for('web.job_result', job_id=job_id),
+        }), 202
+    return redirect(url_for('web.job_result', job_id=job_id))
+
+def admit_generation(cost, in_request=False, use_session=True, speculative=False):
+    """
+    Pass a generation request through the admission controller
+    
+    Args:
+        cost (int): Estimated tokens (see generation_cost)
+        in_request (bool): The generation runs within this request instead of as a job
+        use_session (bool): Limit the session as well as the client IP (the API has no sessions)
+        speculative (bool): A job started without being requested, counted separately from requested work
+    
+    Returns:
+        Admission: Attach the job to it, or release it once the generation is done
+    
+    Raises:
+        AdmissionRejected: If a limit is reached (answered with 429, see too_many_requests)
+    """
+    clients = [f"ip:{request.remote_addr}"]
+    if use_session:
+        clients.insert(0, f"session:{session.sid}")
+    if speculative:
+        clients = [f"speculative:{key}" for key in clients]
+    return admission_control.admit(clients, cost, weight=weight_of(request.remote_addr), in_request=in_request)
+
+def submit_generation(name, cost, use_session=True, **kwargs):
+    """Queue a generation job once the admission controller lets it in (raises AdmissionRejected otherwise)"""
+    admission = admit_generation(cost, use_session=use_session)
+    try:
+        job_id = job_queue.submit(name, rank=admission.rank, **kwargs)
+    except Exception:
+        admission.release()
+        raise
+    admission.attach(job_id)
+    return job_id
+
+def generation_cost(document, num_questions=None, selected=False):
+    """
+    Estimate the tokens of a generation from a document, without loading its text
+    
+    Args:
+        document (Document): Source document; its size is read from its page offsets
+        num_questions (int): Questions of a quiz, or None for a study guide
+        selected (bool): Only passages selected from its index are sent (topic, page range, more questions)
+    
+    Returns:
+        int: Estimated tokens (see utils.admission.estimate_cost)
+    """
+    chars = document.pages[-1].end_offset if document.pages else 0
+    if selected:
+        chars = min(chars, PROMPT_TOKEN_BUDGET * CHARS_PER_TOKEN)
+    return estimate_cost(chars, num_questions)
+
+def start_speculative_jobs(document):
+    """
+    Queue low-priority generation right after upload, so the result is often ready before it is requested
+    
+    Speculative jobs are admitted against limits of their own, so a client
+    uploading over and over cannot spend more on them than on requested work;
+    those the limits refuse are not started.
+    """
+    if admission_control.saturated():
+        # Requested work comes first when the queue is full
+        return
+    speculative = []
+    if current_app.config['SPECULATIVE_STUDY_GUIDE']:
+        speculative.append(('study_guide', generation_cost(document), {}))
+    if current_app.config['SPECULATIVE_QUIZ']:
+        speculative.append(('quiz', generation_cost(document, DEFAULT_QUIZ_OPTIONS['num_questions']), DEFAULT_QUIZ_OPTIONS))
+    
+    jobs = {}
+    for name, cost, options in speculative:
+        try:
+            admission = admit_generation(cost, speculative=True)
+        except AdmissionRejected as e:
+            logger.info(f"Not starting a speculative {name} ({e.reason})")
+            continue
+        try:
+            jobs[name] = job_queue.submit(name, priority=PRIORITY_LOW, rank=admission.rank, document_id=document.id,
+                                          **options)
+        except Exception:
+            admission.release()
+            raise
+        admission.attach(jobs[name])
+    if jobs:
+        session['speculative_jobs'] = jobs
+
+def cancel_speculative_jobs():
+    """Cancel this session's speculative jobs that were never requested"""
+    for job_id in session.pop('speculative_jobs', {}).values():
+        job_queue.cancel(job_id)
+
+def attach_speculative_job(name, cost):
+    """
+    Take over this session's speculative job of the given kind, if it is still usable
+    
+    The job is charged to the session and client IP as if it had been
+    requested now.
+    
+    Args:
+        name (str): Kind of job ("study_guide" or "quiz")
+        cost (int): Estimated tokens of the generation (see generation_cost)
+    
+    Returns:
+        str: ID of the queued, running or finished job, or None
+    
+    Raises:
+        AdmissionRejected: If the session or IP cannot afford it; the job is kept for a later attempt
+    """
+    jobs = session.get('speculative_jobs', {})
+    job_id = jobs.get(name)
+    if job_id is None:
+        return None
+    
+    job = job_queue.get(job_id)
+    usable = job is not None and job['status'] in (QUEUED, RUNNING, FINISHED)
+    if usable:
+        # Refused before the job leaves the session, so a later request can still take it over
+        admit_generation(cost).attach(job_id)
+    jobs.pop(name)
+    session['speculative_jobs'] = jobs
+    if not usable:
+        return None
+    # The user is now waiting on it, so it runs ahead of other speculative work
+    job_queue.promote(job_id)
+    logger.info(f"Attached to speculative {name} job {job_id} ({job['status']})")
+    return job_id
+
+def find_or_extract_document(digest, in_pool=False):
+    """
+    Get the document of a stored upload, extracting its text unless an identical PDF was uploaded before
+    
+    Args:
+        digest (str): Content hash returned by upload_store.save
+        in_pool (bool): Extract small documents in the process pool too (see pdf_processor.iter_page_texts)
+    
+    Returns:
+        Document: The stored document, or None if the PDF has no text (its upload is then removed)
+    """
+    document = document_store.find_document(digest)
+    if document is not None:
+        logger.info(f"Reusing extracted text for upload {digest[:12]}")
+        return document
+    
+    pdf_path = upload_store.pdf_path(digest)
+    if pdf_path is None:
+        raise Exception("The uploaded file is no longer available.")
+    extracted = extract_document(pdf_path, in_pool=in_pool)
+    if not extracted:
+        upload_store.remove(digest)
+        return None
+    return document_store.add_document(digest, extracted)
+
+def current_document():
+    """Get the document uploaded in this session, if any"""
+    document_id = session.get('document_id')
+    return document_store.get_document(document_id) if document_id else None
+
+def parse_num_questions(value):
+    """
+    Read a requested number of quiz questions
+    
+    Raises:
+        ValueError: If it is malformed or not between 1 and MAX_QUIZ_QUESTIONS
+    """
+    try:
+        num_questions = int(value)
+    except TypeError:
+        raise ValueError("Invalid number of questions")
+    if not 1 <= num_questions <= MAX_QUIZ_QUESTIONS:
+        raise ValueError("Invalid number of questions")
+    return num_questions
+
+def parse_quiz_options(form):
+    """
+    Read the quiz options from a submitted form
+    
+    Raises:
+        ValueError: If a number is malformed or out of range
+    """
+    num_questions = parse_num_questions(form.get('num_questions', 5))
+    first_page = int(form['first_page']) if form.get('first_page') else None
+    last_page = int(form['last_page']) if form.get('last_page') else None
+    if (first_page is not None and first_page < 1) or (last_page is not None and last_page < 1) \
+            or (first_page and last_page and last_page < first_page):
+        raise ValueError("Invalid page range")
+    return {
+        'num_questions': num_questions,
+        'topic': form.get('topic', '').strip()[:200] or None,
+        'first_page': first_page,
+        'last_page': last_page,
+    }
+
+def quiz_source_text(document, topic=None, first_page=None, last_page=None, covered=()):
+    """
+    Select the part of a document to generate quiz questions from
+    
+    Without a topic, page range or existing questions the whole document is
+    used; otherwise only the matching passages from its index are sent.
+    
+    Returns:
+        str: Document text to send to the model
+    """
+    if not (topic or first_page or last_page or covered):
+        return document.text
+    
+    index = document_store.get_passage_index(document)
+    text = index.select(document.text, PROMPT_TOKEN_BUDGET, topic=topic, covered=covered,
+                        first_page=first_page, last_page=last_page)
+    if not text:
+        raise Exception("The selected pages contain no text.")
+    return text
+
+def question_progress(progress, num_questions):
+    """Build an on_question callback reporting how many questions are ready"""
+    ready = []
+    
+    def on_question(question):
+        ready.append(question)
+        progress(f'{min(len(ready), num_questions)} of {num_questions} quiz questions ready...')
+    
+    return on_question
+
+@task('study_guide')
+def study_guide_task(document_id, progress):
+    document = document_store.get_document(document_id)
+    if document is None:
+        raise Exception("The uploaded PDF is no longer available. Please upload it again.")
+    
+    progress('Generating study guide...')
+    study_guide_markdown = generate_study_guide(document.text)
+    progress('Saving study guide...')
+    return {'study_guide_id': document_store.save_study_guide(document_id, study_guide_markdown)}
+
+@task('quiz')
+def quiz_task(document_id, num_questions, progress, topic=None, first_page=None, last_page=None):
+    document = document_store.get_document(document_id)
+    if document is None:
+        raise Exception("The uploaded PDF is no longer available. Please upload it again.")
+    
+    progress(f'Generating {num_questions} quiz questions...')
+    text = quiz_source_text(document, topic, first_page, last_page)
+    quiz_data = json.loads(generate_quiz(text, num_questions, on_question=question_progress(progress, num_questions)))
+    progress('Saving quiz...')
+    return {'quiz_id': document_store.save_quiz(document_id, num_questions, quiz_data)}
+
+@task('quiz_more')
+def quiz_more_task(quiz_id, num_questions, progress):
+    quiz = document_store.get_quiz(quiz_id)
+    document = document_store.get_document(quiz.document_id) if quiz else None
+    if document is None:
+        raise Exception("The quiz or its PDF is no longer available. Please upload it again.")
+    
+    progress(f'Generating {num_questions} more quiz questions...')
+    asked = [question['question'] for question in json.loads(quiz.questions)]
+    
+    # Ask about the passages the existing questions cover least, and never repeat them
+    text = quiz_source_text(document, covered=asked)
+    new_questions = json.loads(generate_quiz(text, num_questions, exclude=asked,
+                                             on_question=question_progress(progress, num_questions)))
+    document_store.append_quiz_questions(quiz_id, new_questions)
+    return {'quiz_id': quiz_id}
+
+def study_guide_pdf(study_guide, title):
+    """Local path of a study guide's PDF, rendered once per study guide and title"""
+    return cached_file(
+        blob_store, f"{study_guide.id}_{content_hash(study_guide.markdown, title)}.pdf",
+        lambda: lazy_import('.utils.pdf_export', __package__).render_study_guide_pdf(study_guide.markdown, title)
+    )
+
+def quiz_pdf(quiz, title):
+    """Local path of a quiz's PDF, rendered once per quiz and title"""
+    return cached_file(
+        blob_store, f"{quiz.id}_{content_hash(quiz.questions, title)}.pdf",
+        lambda: lazy_import('.utils.pdf_export', __package__).render_quiz_pdf(json.loads(quiz.questions), title)
+    )
+
+@task('batch')
+def batch_task(batch_id, progress):
+    """
+    Extract every PDF of a batch, generate a study guide and quiz for each, and archive the PDFs
+    
+    Extraction of all files starts at once, in the extraction process pool.
+    Each extracted file then waits for one of BATCH_CONCURRENCY generation
+    slots. A file that fails is reported in the batch and skipped; the
+    archive holds the results of the others.
+    """
+    # Each phase, and each file's thread, uses its own app context (and database session)
+    app = current_app._get_current_object()
+    with app.app_context():
+        batch = document_store.get_batch(batch_id)
+        if batch is None:
+            raise Exception("The batch is no longer available. Please upload it again.")
+        num_questions = batch.num_questions
+        total = len(batch.files)
+        files = [(file.id, file.position, file.filename, file.content_hash) for file in batch.files]
+        failed = sum(1 for file in batch.files if file.status == 'failed')
+    
+    counts = {'finished': 0, 'failed': failed}
+    lock = threading.Lock()
+    
+    def report(file_id=None, **fields):
+        # Progress calls raise JobCancelled once the batch is cancelled, stopping every file
+        with lock:
+            if fields.get('status') in counts:
+                counts[fields['status']] += 1
+            progress(f"{counts['finished'] + counts['failed']} of {total} PDFs processed"
+                     f"{' (' + str(counts['failed']) + ' failed)' if counts['failed'] else ''}...")
+        if file_id is not None:
+            document_store.update_batch_file(file_id, **fields)
+    
+    def extract(file_id, filename, digest):
+        with app.app_context():
+            report(file_id, status='extracting')
+            try:
+                document = find_or_extract_document(digest, in_pool=True)
+                if document is None:
+                    raise Exception("Could not extract text from the PDF.")
+                # The batch holds a reference to each of its documents until it expires (see delete_old_batches)
+                document_store.acquire_document(document.id)
+                document_store.update_batch_file(file_id, document_id=document.id)
+                return document.id
+            except Exception as e:
+                logger.error(f"Error processing {filename} in batch {batch_id}: {str(e)}")
+                report(file_id, status='failed', error=str(e))
+                return None
+    
+    def generate(file_id, position, filename, document_id):
+        with app.app_context():
+            report(file_id, status='generating')
+            try:
+                document = document_store.get_document(document_id)
+                study_guide_id = document_store.save_study_guide(document_id, generate_study_guide(document.text))
+                quiz_data = json.loads(generate_quiz(document.text, num_questions))
+                quiz_id = document_store.save_quiz(document_id, num_questions, quiz_data)
+                
+                # Render the PDFs here, so rendering overlaps with other files' generation
+                name = archive_name(position, total, filename)
+                entries = [
+                    (f"study_guides/{name}.pdf",
+                     study_guide_pdf(document_store.get_study_guide(study_guide_id), f"Study Guide for {filename}")),
+                    (f"quizzes/{name}.pdf", quiz_pdf(document_store.get_quiz(quiz_id), f"Quiz for {filename}")),
+                ]
+                report(file_id, status='finished', study_guide_id=study_guide_id, quiz_id=quiz_id)
+                return entries
+            except JobCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"Error generating materials for {filename} in batch {batch_id}: {str(e)}")
+                report(file_id, status='failed', error=str(e))
+                return []
+    
+    report()
+    entries = []
+    queued = [(file_id, position, filename, digest) for file_id, position, filename, digest in files if digest]
+    with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_WORKERS, len(queued)))) as extractors, \
+            ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as generators:
+        extractions = {extractors.submit(extract, file_id, filename, digest): (file_id, position, filename)
+                       for file_id, position, filename, digest in queued}
+        generations = []
+        for future in as_completed(extractions):
+            document_id = future.result()
+            if document_id is not None:
+                generations.append(generators.submit(generate, *extractions[future], document_id))
+        for future in generations:
+            entries.extend(future.result())
+    
+    progress('Building the archive...')
+    with app.app_context():
+        batch = document_store.get_batch(batch_id)
+        status = {'batch_id': batch_id, 'files': [batch_file_status(file) for file in batch.files]}
+        document_store.update_batch(batch_id, archive=write_archive(blob_store, batch_id, sorted(entries), status))
+    return {'batch_id': batch_id}
+
+def batch_file_status(file):
+    """Status of one file of a batch, as reported to clients and in the archive"""
+    return {
+        'filename': file.filename,
+        'status': file.status,
+        'error': file.error,
+        'study_guide_id': file.study_guide_id,
+        'quiz_id': file.quiz_id,
+    }
+
+def render_study_guide(study_guide_markdown):
+    # Convert Markdown to HTML with the tables extension
+    with span('markdown_render'):
+        study_guide_html = lazy_import('markdown').markdown(study_guide_markdown, extensions=['tables'])
+    
+    # Pass the rendered HTML to the template
+    return render_template('study_guide.html', study_guide=study_guide_html, pdf_filename=session.get('pdf_filename'))
+
+def render_quiz_questions(quiz_data):
+    with span('quiz_render'):
+        return render_template('_quiz_questions.html', quiz=quiz_data).encode('utf-8')
+
+def render_quiz(quiz):
+    quiz_data = json.loads(quiz.questions)
+    
+    # The question markup is rendered once per quiz and cached; revisits only read the file
+    fragment_path = cached_file(
+        blob_store, f"{quiz.id}_{content_hash(quiz.questions)}.html",
+        lambda: render_quiz_questions(quiz_data)
+    )
+    with open(fragment_path, 'r', encoding='utf-8') as f:
+        quiz_html = Markup(f.read())
+    
+    return render_template('quiz.html', quiz=quiz, quiz_html=quiz_html, pdf_filename=session.get('pdf_filename'))
+
+def release_session_document():
+    """Drop this session's reference to its document, deleting the upload once unreferenced"""
+    document_id = session.pop('document_id', None)
+    if document_id:
+        removed_hash = document_store.release_document(document_id)
+        if removed_hash:
+            upload_store.remove(removed_hash)
+
+@web.before_app_request
+def start_background_workers():
+    """Start this process's job workers and storage janitor, with the first request it serves"""
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid != os.getpid():
+            job_queue.start(current_app._get_current_object())
+            storage_janitor().start()
+            _background_pid = os.getpid()
+
+@web.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+    # With PROFILE_REQUESTS=1, add ?profile=1 to any URL to profile that request
+    g.profiler = metrics.start_profile() if request.args.get('profile') == '1' else None
+
+@web.after_app_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_started
+    metrics.REQUEST_SECONDS.labels(request.endpoint or 'unmatched', request.method, response.status_code).observe(elapsed)
+    
+    # Per-stage timings of this request, shown in the browser's network panel
+    stages = metrics.finish_request()
+    response.headers['Server-Timing'] = f"{stages + ', ' if stages else ''}total;dur={elapsed * 1000:.1f}"
+    
+    if g.profiler is not None:
+        response.headers['X-Profile'] = os.path.basename(metrics.finish_profile(g.profiler, request.endpoint or 'unmatched'))
+    return response
+
+@web.after_app_request
+def compress_response(response):
+    # Rendered pages and JSON; files have precompressed variants instead (see send_static_file)
+    if (not assets.COMPRESS_RESPONSES or response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in assets.COMPRESSIBLE_TYPES
+            or response.calculate_content_length() < assets.COMPRESS_MIN_BYTES):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = assets.choose_encoding(request.accept_encodings, assets.available_encodings())
+    if encoding is None:
+        return response
+    with span('response_compress'):
+        response.set_data(assets.compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ, so a strong ETag no longer applies; a weak one still matches If-None-Match
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+@web.app_url_defaults
+def fingerprint_static_urls(endpoint, values):
+    # url_for('static', filename='css/style.css') links to the build copy, e.g. build/css/style.<hash>.css
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = current_app.extensions['assets']['files'].get(values['filename'], values['filename'])
+
+def send_static_file(filename):
+    """
+    Serve a static file, or its precompressed variant if the client accepts one
+    
+    Build copies are named after their content, so browsers may cache them
+    for good; other files are revalidated as usual.
+    """
+    manifest = current_app.extensions['assets']
+    encodings = manifest['encodings'].get(filename)
+    encoding = assets.choose_encoding(request.accept_encodings, encodings) if encodings else None
+    path = filename + assets.SUFFIXES[encoding] if encoding else filename
+    
+    response = send_from_directory(current_app.static_folder, path, mimetype=mimetypes.guess_type(filename)[0])
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if filename.startswith(f"{assets.BUILD_DIR}/"):
+        response.cache_control.public = True
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+@web.route('/metrics')
+def prometheus_metrics():
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+@web.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
+@web.route('/upload', methods=['POST'])
 def upload_file():
     # Check if the post request has the file part
     if 'pdf_file' not in request.files:
         flash('No file part', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('web.index'))
     
     file = request.files['pdf_file']
     
@@ -63,368 +722,404 @@ def upload_file():
     # submit an empty part without filename
     if file.filename == '':
         flash('No selected file', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('web.index'))
     
     if file and allowed_file(file.filename):
-        # Generate a unique filename to avoid collisions
         filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
         
-        # Extract text from PDF
+        # Hash the file while saving it; identical uploads share one stored copy
+        with span('upload_save'):
+            digest = upload_store.save(file.stream)
+        
+        # Extract text from PDF, reusing the extraction of an identical earlier upload
         try:
-            extracted_text = extract_text_from_pdf(filepath)
-            if not extracted_text:
+            document = find_or_extract_document(digest)
+            if document is None:
                 flash('Could not extract text from PDF. Please try another file.', 'danger')
-                return redirect(url_for('index'))
+                return redirect(url_for('web.index'))
+            
+            document_store.acquire_document(document.id)
+            cancel_speculative_jobs()
+            release_session_document()
             
-            # Store the text and file path in session
-            session['extracted_text'] = extracted_text
+            # Store only the document ID and file name in session
+            session['document_id'] = document.id
             session['pdf_filename'] = filename
+            start_speculative_jobs(document)
             
             flash('PDF uploaded and processed successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('web.index'))
         
         except Exception as e:
             logger.error(f"Error processing PDF: {str(e)}")
             flash(f'Error processing PDF: {str(e)}', 'danger')
-            return redirect(url_for('index'))
+            return redirect(url_for('web.index'))
     else:
         flash('Invalid file type. Please upload a PDF file.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('web.index'))
 
-@app.route('/generate_study_guide', methods=['POST'])
+@web.route('/generate_study_guide', methods=['POST'])
 def create_study_guide():
-    extracted_text = session.get('extracted_text')
+    document = current_document()
     
-    if not extracted_text:
+    if document is None:
         flash('No PDF text found. Please upload a PDF first.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('web.index'))
     
-    try:
-        # Generate study guide using Gemini API
-        study_guide_markdown = generate_study_guide(extracted_text)
-        
-        # Generate a unique ID for this study guide
-        study_guide_id = str(uuid.uuid4())
-        
-        # Save the study guide to a file instead of the session
-        study_guide_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{study_guide_id}_study_guide.md")
-        with open(study_guide_file, 'w', encoding='utf-8') as f:  # Specify UTF-8 encoding
-            f.write(study_guide_markdown)
-        
-        # Convert Markdown to HTML with the tables extension
-        study_guide_html = markdown.markdown(study_guide_markdown, extensions=['tables'])
+    # Generate the study guide in the background so the worker is not blocked on Gemini,
+    # reusing the one started speculatively after upload if there is one
+    cost = generation_cost(document)
+    job_id = attach_speculative_job('study_guide', cost) or submit_generation('study_guide', cost, document_id=document.id)
+    return job_accepted(job_id)
+
+@web.route('/stream_study_guide', methods=['POST'])
+def create_streaming_study_guide():
+    if not session.get('document_id'):
+        flash('No PDF text found. Please upload a PDF first.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    # Render the page shell right away; the content arrives through the event stream
+    return render_template('study_guide.html', study_guide='', stream_url=url_for('web.study_guide_events'),
+                           pdf_filename=session.get('pdf_filename'))
+
+@web.route('/stream_study_guide/events')
+def study_guide_events():
+    document = current_document()
+    
+    if document is None:
+        return Response("event: failed\ndata: " + json.dumps('No PDF text found. Please upload a PDF first.') + "\n\n",
+                        mimetype='text/event-stream')
+    
+    # The session is saved before the body is streamed, so assign the ID up front
+    study_guide_id = str(uuid.uuid4())
+    session['study_guide_id'] = study_guide_id
+    document_id, extracted_text = document.id, document.text
+    
+    def events():
+        # Admitted once the body is being sent, so a response that is never read cannot hold an admission
+        try:
+            admission = admit_generation(estimate_cost(len(extracted_text)), in_request=True)
+        except AdmissionRejected as e:
+            yield f"event: failed\ndata: {json.dumps(f'{e.message} (retry in {e.retry_after}s)')}\n\n"
+            return
         
-        # Store only the ID in the session
-        session['study_guide_id'] = study_guide_id
+        chunks = []
+        try:
+            for chunk in stream_study_guide(extracted_text):
+                chunks.append(chunk)
+                yield f"data: {json.dumps(chunk)}\n\n"
+            
+            # Save the complete study guide once the stream ends
+            document_store.save_study_guide(document_id, "".join(chunks), study_guide_id)
+            yield "event: done\ndata: {}\n\n"
         
-        # Pass the rendered HTML to the template
-        return render_template('study_guide.html', study_guide=study_guide_html, pdf_filename=session.get('pdf_filename'))
+        except Exception as e:
+            logger.error(f"Error streaming study guide: {str(e)}")
+            yield f"event: failed\ndata: {json.dumps(f'Error generating study guide: {str(e)}')}\n\n"
+        finally:
+            admission.release()
     
-    except Exception as e:
-        logger.error(f"Error generating study guide: {str(e)}")
-        flash(f'Error generating study guide: {str(e)}', 'danger')
-        return redirect(url_for('index'))
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering so chunks are sent immediately
+    return response
 
-@app.route('/generate_quiz', methods=['POST'])
+@web.route('/generate_quiz', methods=['POST'])
 def create_quiz():
-    extracted_text = session.get('extracted_text')
+    document = current_document()
     
-    if not extracted_text:
+    if document is None:
         flash('No PDF text found. Please upload a PDF first.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('web.index'))
     
     try:
-        # Get number of questions from form
-        num_questions = int(request.form.get('num_questions', 5))
-        
-        # Generate quiz using Gemini API
-        quiz = generate_quiz(extracted_text, num_questions)
-        
-        # Parse the JSON string into a Python object
-        quiz_data = json.loads(quiz)
-        
-        # Convert quiz JSON into Markdown format
-        markdown_content = ""
-        for i, question in enumerate(quiz_data, 1):
-            markdown_content += f"### Question {i}: {question['question']}\n"
-            for j, option in enumerate(question['options'], 1):
-                markdown_content += f"- {option}\n"
-            markdown_content += f"**Answer:** {question['answer']}\n\n"
-        
-        # Convert Markdown to HTML with the tables extension
-        html_content = markdown.markdown(markdown_content, extensions=['tables'])
-        
-        return render_template('quiz.html', quiz_html=html_content, pdf_filename=session.get('pdf_filename'))
+        # Get the number of questions and the optional focus from the form
+        options = parse_quiz_options(request.form)
+    except ValueError:
+        flash('Invalid number of questions or page range.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    # Generate the quiz in the background so the worker is not blocked on Gemini
+    job_id = None
+    if options == DEFAULT_QUIZ_OPTIONS:
+        job_id = attach_speculative_job('quiz', generation_cost(document, options['num_questions']))
+    if job_id is None:
+        selected = bool(options['topic'] or options['first_page'] or options['last_page'])
+        job_id = submit_generation('quiz', generation_cost(document, options['num_questions'], selected),
+                                   document_id=document.id, **options)
+    return job_accepted(job_id)
+
+@web.route('/quiz/<quiz_id>/more', methods=['POST'])
+def add_quiz_questions(quiz_id):
+    quiz = document_store.get_quiz(quiz_id)
+    document = document_store.get_document(quiz.document_id) if quiz else None
+    if document is None:
+        flash('Quiz not found. Please generate a new quiz.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    try:
+        num_questions = parse_num_questions(request.form.get('num_questions', 5))
+    except ValueError:
+        if wants_json():
+            return jsonify({'error': 'Invalid number of questions.'}), 400
+        flash('Invalid number of questions.', 'danger')
+        return redirect(url_for('web.view_quiz', quiz_id=quiz_id))
+    
+    job_id = submit_generation('quiz_more', generation_cost(document, num_questions, selected=True),
+                               quiz_id=quiz_id, num_questions=num_questions)
+    return job_accepted(job_id)
+
+@web.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'result_url': url_for('web.job_result', job_id=job_id),
+    })
+
+@web.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    
+    if job['status'] == FAILED:
+        flash(f"Error generating {JOB_LABELS.get(job['name'], job['name'])}: {job['error']}", 'danger')
+        return redirect(url_for('web.index'))
+    
+    if job['status'] == CANCELLED:
+        flash(f"Generating the {JOB_LABELS.get(job['name'], job['name'])} was cancelled.", 'info')
+        return redirect(url_for('web.index'))
+    
+    if job['status'] != FINISHED:
+        # Fallback for clients without JavaScript: show a page that refreshes until the job is done
+        return render_template('job_pending.html', job=job)
+    
+    if job['name'] == 'study_guide':
+        return redirect(url_for('web.view_study_guide', study_guide_id=job['result']['study_guide_id']))
+    
+    if job['name'] == 'batch':
+        return redirect(url_for('web.view_batch', batch_id=job['result']['batch_id']))
     
-    except Exception as e:
-        logger.error(f"Error generating quiz: {str(e)}")
-        flash(f'Error generating quiz: {str(e)}', 'danger')
-        return redirect(url_for('index'))
+    return redirect(url_for('web.view_quiz', quiz_id=job['result']['quiz_id']))
 
-@app.route('/download_study_guide')
+@web.route('/study_guide/<study_guide_id>')
+def view_study_guide(study_guide_id):
+    study_guide = document_store.get_study_guide(study_guide_id)
+    
+    if study_guide is None:
+        flash('Study guide not found. Please generate a new study guide.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    # Store only the ID in the session
+    session['study_guide_id'] = study_guide.id
+    return render_study_guide(study_guide.markdown)
+
+@web.route('/download_study_guide')
 def download_study_guide():
     study_guide_id = session.get('study_guide_id')
     
     if not study_guide_id:
         flash('No study guide found. Please generate a study guide first.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('web.index'))
     
-    # Get the study guide file path
-    study_guide_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{study_guide_id}_study_guide.md")
+    # Load the study guide from the document store
+    study_guide = document_store.get_study_guide(study_guide_id)
     
-    # Check if the file exists
-    if not os.path.exists(study_guide_file):
-        flash('Study guide file not found. Please generate a new study guide.', 'danger')
-        return redirect(url_for('index'))
+    if study_guide is None:
+        flash('Study guide not found. Please generate a new study guide.', 'danger')
+        return redirect(url_for('web.index'))
     
-    # Read the original study guide
-    with open(study_guide_file, 'r', encoding='utf-8') as source:
-        study_guide_markdown = source.read()
+    title = f"Study Guide for {session.get('pdf_filename', 'Uploaded PDF')}"
     
-    # Convert Markdown to HTML with the tables extension
-    study_guide_html = markdown.markdown(study_guide_markdown, extensions=['tables'])
-    
-    # Create a PDF file
-    pdf_filename = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf').name
-    
-    # Set up the PDF document
-    doc = SimpleDocTemplate(
-        pdf_filename,
-        pagesize=letter,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=72
-    )
+    # The PDF is rendered once per study guide and title; repeat downloads are a file read (or a 304)
+    etag = content_hash(study_guide.markdown, title)
+    pdf_path = study_guide_pdf(study_guide, title)
     
-    # Define styles
-    styles = getSampleStyleSheet()
-    title_style = styles["Heading1"]
-    title_style.alignment = 1  # Center alignment
-    
-    normal_style = styles["Normal"]
-    normal_style.fontName = "Helvetica"
-    normal_style.fontSize = 11
-    normal_style.leading = 14
-    
-    bullet_style = ParagraphStyle(
-        name="Bullet",
-        fontName="Helvetica",
-        fontSize=11,
-        leading=14,
-        leftIndent=20,
-        bulletFontName="Helvetica",
-        bulletFontSize=11,
-        bulletIndent=10
-    )
+    return send_file(pdf_path, as_attachment=True, etag=etag, conditional=True,
+                     download_name=f"study_guide_{session.get('pdf_filename', 'document').replace('.pdf', '')}.pdf")
+
+@web.route('/quiz/<quiz_id>')
+def view_quiz(quiz_id):
+    # Revisiting a quiz reads the stored artifact; the model is not called again
+    quiz = document_store.get_quiz(quiz_id)
     
-    # Create the content for the PDF
-    story = []
+    if quiz is None:
+        flash('Quiz not found. Please generate a new quiz.', 'danger')
+        return redirect(url_for('web.index'))
     
-    # Add title
-    title = f"Study Guide for {session.get('pdf_filename', 'Uploaded PDF')}"
-    story.append(Paragraph(title, title_style))
-    story.append(Spacer(1, 0.25 * inch))
-    
-    # Add the rendered HTML content
-    from bs4 import BeautifulSoup
-    from reportlab.platypus import Table, TableStyle
-    from reportlab.lib import colors
-
-    soup = BeautifulSoup(study_guide_html, 'html.parser')
-    
-    for element in soup.find_all(['h1', 'h2', 'h3', 'p', 'ul', 'li', 'code', 'table', 'tr', 'th', 'td']):
-        if element.name in ['h1', 'h2', 'h3']:
-            style = ParagraphStyle(
-                name=element.name,
-                fontName="Helvetica-Bold",
-                fontSize=14 if element.name == 'h1' else 12,
-                leading=16,
-                spaceAfter=10
-            )
-            story.append(Paragraph(element.get_text(), style))
-        elif element.name == 'p':
-            story.append(Paragraph(element.get_text(), normal_style))
-        elif element.name == 'ul':
-            for li in element.find_all('li'):
-                story.append(Paragraph(f"- {li.get_text()}", normal_style))
-        elif element.name == 'code':
-            code_style = ParagraphStyle(
-                name="Code",
-                fontName="Courier",
-                fontSize=10,
-                leading=12,
-                backColor="#f0f0f0",
-                leftIndent=10
-            )
-            story.append(Paragraph(element.get_text(), code_style))
-        elif element.name == 'table':
-            # Handle tables
-            table_data = []
-            for row in element.find_all('tr'):
-                table_row = [cell.get_text() for cell in row.find_all(['th', 'td'])]
-                table_data.append(table_row)
-            
-            # Create a table with gridlines
-            table = Table(table_data)
-            table.setStyle(TableStyle([
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),  # Add gridlines
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),  # Header background
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),  # Center align all cells
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),  # Vertically align all cells
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),  # Bold font for header
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),  # Regular font for body
-                ('FONTSIZE', (0, 0), (-1, -1), 10),  # Font size
-            ]))
-            story.append(table)
-        story.append(Spacer(1, 0.1 * inch))
-    
-    # Build the PDF
-    doc.build(story)
-    
-    return send_file(pdf_filename, as_attachment=True, download_name=f"study_guide_{session.get('pdf_filename', 'document').replace('.pdf', '')}.pdf")
-
-@app.route('/download_quiz')
+    session['quiz_id'] = quiz.id
+    return render_quiz(quiz)
+
+@web.route('/download_quiz')
 def download_quiz():
     quiz_id = session.get('quiz_id')
     
     if not quiz_id:
         flash('No quiz found. Please generate a quiz first.', 'danger')
-        return redirect(url_for('index'))
-    
-    # Get the quiz file path
-    quiz_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{quiz_id}_quiz.json")
-    
-    # Check if the file exists
-    if not os.path.exists(quiz_file):
-        flash('Quiz file not found. Please generate a new quiz.', 'danger')
-        return redirect(url_for('index'))
-    
-    # Read the quiz JSON
-    with open(quiz_file, 'r') as source:
-        quiz_json = source.read()
-    
-    # Parse the JSON 
-    quiz_data = json.loads(quiz_json)
-    
-    # Create a PDF file
-    pdf_filename = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf').name
-    
-    # Set up the PDF document
-    doc = SimpleDocTemplate(
-        pdf_filename,
-        pagesize=letter,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=72
-    )
+        return redirect(url_for('web.index'))
     
-    # Define styles
-    styles = getSampleStyleSheet()
-    title_style = styles["Heading1"]
-    title_style.alignment = 1  # Center alignment
-    
-    normal_style = styles["Normal"]
-    normal_style.fontName = "Helvetica"
-    normal_style.fontSize = 11
-    normal_style.leading = 14
-    
-    question_style = ParagraphStyle(
-        name="Question",
-        fontName="Helvetica-Bold",
-        fontSize=12,
-        leading=16,
-        spaceAfter=6,
-        textColor=colors.darkblue
-    )
-    
-    option_style = ParagraphStyle(
-        name="Option",
-        fontName="Helvetica",
-        fontSize=11,
-        leading=14,
-        leftIndent=20
-    )
+    # Load the quiz from the document store
+    quiz = document_store.get_quiz(quiz_id)
     
-    answer_style = ParagraphStyle(
-        name="Answer",
-        fontName="Helvetica-Bold",
-        fontSize=11,
-        leading=14,
-        leftIndent=10,
-        textColor=colors.darkgreen
-    )
-    
-    # Create the content for the PDF
-    story = []
+    if quiz is None:
+        flash('Quiz not found. Please generate a new quiz.', 'danger')
+        return redirect(url_for('web.index'))
     
-    # Add title
     title = f"Quiz for {session.get('pdf_filename', 'Uploaded PDF')}"
-    story.append(Paragraph(title, title_style))
-    story.append(Spacer(1, 0.25 * inch))
-    
-    # Format the quiz questions
-    for i, question in enumerate(quiz_data, 1):
-        # Add the question
-        question_text = f"Question {i}: {question['question']}"
-        story.append(Paragraph(question_text, question_style))
-        story.append(Spacer(1, 0.1 * inch))
-        
-        # Add the options
-        for j, option in enumerate(question['options'], 1):
-            option_text = f"{j}. {option}"
-            story.append(Paragraph(option_text, option_style))
-        
-        # Add the answer
-        answer_text = f"Answer: {question['answer']}"
-        story.append(Spacer(1, 0.1 * inch))
-        story.append(Paragraph(answer_text, answer_style))
-        story.append(Spacer(1, 0.25 * inch))
     
-    # Build the PDF
-    doc.build(story)
+    # The PDF is rendered once per quiz and title; repeat downloads are a file read (or a 304)
+    etag = content_hash(quiz.questions, title)
+    pdf_path = quiz_pdf(quiz, title)
     
-    return send_file(pdf_filename, as_attachment=True, download_name=f"quiz_{session.get('pdf_filename', 'document').replace('.pdf', '')}.pdf")
+    return send_file(pdf_path, as_attachment=True, etag=etag, conditional=True,
+                     download_name=f"quiz_{session.get('pdf_filename', 'document').replace('.pdf', '')}.pdf")
 
-@app.route('/clear')
+@web.route('/clear')
 def clear_session():
-    # Clean up any files associated with this session
-    if session.get('study_guide_id'):
-        study_guide_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{session.get('study_guide_id')}_study_guide.txt")
-        if os.path.exists(study_guide_file):
-            try:
-                os.remove(study_guide_file)
-            except:
-                logger.warning(f"Could not remove study guide file: {study_guide_file}")
+    # Clean up the study materials associated with this session, and their rendered downloads
+    document_store.delete_artifacts(session.get('study_guide_id'), session.get('quiz_id'))
+    for artifact_id in (session.get('study_guide_id'), session.get('quiz_id')):
+        if artifact_id:
+            blob_store.delete_owned('artifacts', artifact_id)
     
-    if session.get('quiz_id'):
-        quiz_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{session.get('quiz_id')}_quiz.json")
-        if os.path.exists(quiz_file):
-            try:
-                os.remove(quiz_file)
-            except:
-                logger.warning(f"Could not remove quiz file: {quiz_file}")
+    # Stop speculative generation nobody asked for, and release this session's reference to the uploaded PDF
+    cancel_speculative_jobs()
+    release_session_document()
     
     # Clear the session
     session.clear()
     flash('Session cleared. You can upload a new PDF.', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('web.index'))
+
+@web.route('/batch', methods=['POST'])
+def upload_batch():
+    # A batch may be much larger than a single upload
+    request.max_content_length = BATCH_MAX_UPLOAD_BYTES
+    
+    try:
+        num_questions = parse_num_questions(request.form.get('num_questions', 5))
+    except ValueError:
+        flash('Invalid number of questions.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    # PDFs, and the PDFs inside zip archives, are stored like single uploads
+    try:
+        with span('upload_save'):
+            files = save_batch_upload(request.files.getlist('pdf_files'), upload_store)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('web.index'))
+    
+    if not files:
+        flash('No PDF files found in the upload.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    # Admitted on an assumed size per PDF; refused uploads are kept, so a retry does not store them again
+    per_file = estimate_cost(BATCH_DOCUMENT_CHARS) + estimate_cost(BATCH_DOCUMENT_CHARS, num_questions)
+    admission = admit_generation(per_file * sum(1 for _, digest, _ in files if digest))
+    
+    # Extraction and generation run in one background job; the batch page reports each file's progress
+    try:
+        batch_id = document_store.create_batch(num_questions, files)
+        job_id = job_queue.submit('batch', rank=admission.rank, batch_id=batch_id)
+    except Exception:
+        admission.release()
+        raise
+    admission.attach(job_id)
+    document_store.update_batch(batch_id, job_id=job_id)
+    
+    if wants_json():
+        return jsonify({
+            'batch_id': batch_id,
+            'job_id': job_id,
+            'status_url': url_for('web.job_status', job_id=job_id),
+            'batch_url': url_for('web.view_batch', batch_id=batch_id),
+        }), 202
+    return redirect(url_for('web.view_batch', batch_id=batch_id))
+
+@web.route('/batch/<batch_id>')
+def view_batch(batch_id):
+    batch = document_store.get_batch(batch_id)
+    if batch is None:
+        if wants_json():
+            return jsonify({'error': 'Batch not found'}), 404
+        flash('Batch not found. Please upload it again.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    job = job_queue.get(batch.job_id) if batch.job_id else None
+    if batch.archive:
+        status = FINISHED
+    elif job is not None:
+        status = job['status']
+    else:
+        # No job yet (just submitted), or its record expired before the archive was built
+        status = FAILED if batch.job_id else QUEUED
+    
+    files = [batch_file_status(file) for file in batch.files]
+    archive_url = url_for('web.download_batch', batch_id=batch_id) if batch.archive else None
+    if wants_json():
+        return jsonify({
+            'batch_id': batch_id,
+            'status': status,
+            'progress': job['progress'] if job else None,
+            'error': job['error'] if job else None,
+            'files': files,
+            'archive_url': archive_url,
+        })
+    return render_template('batch.html', batch_id=batch_id, status=status, job=job, files=files,
+                           archive_url=archive_url, pending=status in (QUEUED, RUNNING))
+
+@web.route('/batch/<batch_id>/download')
+def download_batch(batch_id):
+    batch = document_store.get_batch(batch_id)
+    archive_path = blob_store.local_path(ARTIFACTS, batch.archive) if batch and batch.archive else None
+    if archive_path is None:
+        flash('The results of this batch are no longer available. Please upload it again.', 'danger')
+        return redirect(url_for('web.index'))
+    
+    return send_file(archive_path, as_attachment=True, conditional=True,
+                     download_name=f"study_buddy_batch_{batch_id[:8]}.zip")
+
+@web.route('/storage/usage')
+def storage_usage():
+    # Gauges for monitoring: stored files and bytes against their quotas
+    return jsonify(storage_janitor().usage())
 
 # Error handlers
-@app.errorhandler(413)
+@web.app_errorhandler(AdmissionRejected)
+def too_many_requests(error):
+    # Refused by admission control: answer right away, saying when to try again
+    if wants_json():
+        response = jsonify({'error': error.message, 'retry_after': error.retry_after})
+    else:
+        flash(error.message, 'warning')
+        response = make_response(render_template('index.html'))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@web.app_errorhandler(413)
 def request_entity_too_large(error):
-    flash('File too large! Maximum size is 16MB.', 'danger')
-    return redirect(url_for('index')), 413
+    if request.endpoint == 'web.upload_batch':
+        flash(f'Batch too large! Maximum size is {BATCH_MAX_UPLOAD_BYTES // (1024 * 1024)}MB.', 'danger')
+    else:
+        flash('File too large! Maximum size is 16MB.', 'danger')
+    return redirect(url_for('web.index')), 413
 
-@app.errorhandler(500)
+@web.app_errorhandler(500)
 def internal_server_error(error):
     flash('An unexpected error occurred. Please try again.', 'danger')
-    return redirect(url_for('index')), 500
+    return redirect(url_for('web.index')), 500
+
+metrics.record_import(__name__, time.perf_counter() - _import_started)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))  # Use Railway's PORT or default to 8080
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=port)
@@ -0,0 +1,345 @@
+"""
+Async serving mode.
+
+Run with an ASGI server, e.g.:
+
+    uvicorn study_buddy.asgi:app --host 0.0.0.0 --port 5000
+
+The generation routes are handled natively on the event loop and await
+Gemini without holding a thread, so one process can hold hundreds of
+in-flight generations. Every other route (uploads, PDF downloads, pages) is
+the regular Flask app, run on a thread pool so PDF extraction and ReportLab
+rendering never block the loop. The sync (gunicorn) mode is unchanged.
+"""
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request, flash, redirect, url_for, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from .app import (create_app, current_document, wants_json, job_accepted, attach_speculative_job,
+                  parse_quiz_options, quiz_source_text, admit_generation, generation_cost, too_many_requests,
+                  DEFAULT_QUIZ_OPTIONS)
+from .utils import document_store
+from .utils.admission import AdmissionRejected, estimate_cost
+from .utils.batch import BATCH_MAX_UPLOAD_BYTES
+from .utils.gemini_client import generate_study_guide_async, generate_quiz_async
+
+logger = logging.getLogger(__name__)
+
+# Threads running the Flask app and the blocking parts of the async routes
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 32))
+
+flask_app = create_app()
+
+
+def build_environ(scope, body):
+    """Build a WSGI environ from an ASGI HTTP scope and the request body"""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name == "CONTENT_LENGTH":
+            continue
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def body_limit(path):
+    """Largest request body the app accepts at a path, the same limits Flask enforces"""
+    return BATCH_MAX_UPLOAD_BYTES if path == "/batch" else flask_app.config["MAX_CONTENT_LENGTH"]
+
+
+def declared_length(scope):
+    """The request's Content-Length, or None if it has none (or an invalid one)"""
+    for name, value in scope["headers"]:
+        if name.lower() == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its request was answered"""
+
+
+async def read_body(receive, limit=None):
+    """
+    Read the whole request body
+
+    Returns:
+        bytes: The body, or None as soon as it grows past limit (the rest is not read)
+
+    Raises:
+        ClientDisconnected: If the client disconnects before sending all of it
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    """Return once the client disconnects (call after the body was read)"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def finalize(rv):
+    """Turn a view return value into a response, saving the session (call inside a request context)"""
+    response = flask_app.make_response(rv)
+    return flask_app.process_response(response)
+
+
+class StudyBuddyASGI:
+    """ASGI application wrapping the Flask app with async generation routes"""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+        self.async_routes = {
+            ("POST", "/generate_study_guide"): self.generate_study_guide,
+            ("POST", "/generate_quiz"): self.generate_quiz,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        # Bodies over the limit are refused without buffering them, as Flask would refuse them after
+        limit = body_limit(scope["path"])
+        length = declared_length(scope)
+        try:
+            body = None if limit is not None and length is not None and length > limit else await read_body(receive, limit)
+        except ClientDisconnected:
+            return
+        if body is None:
+            await self.send_response(await self.too_large(build_environ(scope, b"")), send)
+            return
+
+        environ = build_environ(scope, body)
+        handler = self.async_routes.get((scope["method"], scope["path"]))
+        if handler is not None:
+            response = await handler(environ, receive)
+            if response is not None:
+                await self.send_response(response, send)
+        else:
+            await self.call_wsgi(environ, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def run_sync(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def in_request_context(self, environ, fn):
+        """Run fn inside a Flask request context on the thread pool"""
+        def run():
+            with flask_app.request_context(environ):
+                # The before_request hooks (job workers, request metrics) that finalize's after_request hooks rely on
+                flask_app.preprocess_request()
+                return fn()
+        return self.run_sync(run)
+
+    def too_large(self, environ):
+        """The app's 413 response (a flash and redirect, or JSON for the API) for a request whose body was refused"""
+        return self.in_request_context(
+            environ, lambda: finalize(flask_app.handle_user_exception(RequestEntityTooLarge()))
+        )
+
+    async def call_wsgi(self, environ, send):
+        """Run the Flask app on the thread pool, streaming its response body"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+        iterable = await self.run_sync(self.wsgi_app, environ, start_response)
+        iterator = iter(iterable)
+        done = object()
+        try:
+            await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+            while True:
+                chunk = await self.run_sync(next, iterator, done)
+                if chunk is done:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(iterable, "close"):
+                await self.run_sync(iterable.close)
+
+    async def send_response(self, response, send):
+        headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": response.get_data()})
+
+    async def generate(self, environ, receive, parse_params, attach, source_text, generate_fn, save_fn):
+        """
+        Shared flow of the async generation routes
+
+        The session, form and database are handled on the thread pool; only the
+        model calls run on the event loop. Every phase runs in the same request
+        context, so session changes are saved and the request metrics cover
+        the whole request. A matching speculative job started at upload is
+        reused instead of generating again; otherwise the generation must be
+        let in by the admission controller. It is skipped if the client
+        disconnected meanwhile.
+
+        Returns:
+            Response: The response, or None if the client has gone
+        """
+        # Flask's context variables (the request context, the timed spans) carry over from one phase to the next
+        context = contextvars.Context()
+        request_context = flask_app.request_context(environ)
+
+        def run(fn, *args):
+            return self.run_sync(context.run, fn, *args)
+
+        def prepare():
+            document = current_document()
+            if document is None:
+                flash('No PDF text found. Please upload a PDF first.', 'danger')
+                return None, redirect(url_for('web.index'))
+            try:
+                params = parse_params()
+            except ValueError:
+                flash('Invalid number of questions or page range.', 'danger')
+                return None, redirect(url_for('web.index'))
+            try:
+                job_id = attach(document, params)
+            except AdmissionRejected as e:
+                return None, too_many_requests(e)
+            if job_id is not None:
+                return None, job_accepted(job_id)
+            try:
+                text = source_text(document, params)
+            except Exception as e:
+                flash(str(e), 'danger')
+                return None, redirect(url_for('web.index'))
+            try:
+                admission = admit_generation(estimate_cost(len(text), params.get('num_questions')), in_request=True)
+            except AdmissionRejected as e:
+                return None, too_many_requests(e)
+            return (document.id, text, params, admission), None
+
+        def fail(message):
+            if wants_json():
+                return jsonify({'error': message}), 500
+            flash(message, 'danger')
+            return redirect(url_for('web.index'))
+
+        def finish(document_id, params, result):
+            result_url = save_fn(document_id, params, result)
+            if wants_json():
+                return jsonify({'status': 'finished', 'result_url': result_url})
+            return redirect(result_url)
+
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        await run(request_context.push)
+        try:
+            # The before_request hooks (job workers, request metrics) that finalize's after_request hooks rely on
+            await run(flask_app.preprocess_request)
+            prepared, rv = await run(prepare)
+            if prepared is not None:
+                document_id, text, params, admission = prepared
+                with admission:
+                    if disconnected.done():
+                        logger.info("Client disconnected before its generation started; skipping it")
+                        return None
+                    try:
+                        result = await asyncio.create_task(generate_fn(text, params), context=context)
+                    except Exception as e:
+                        rv = await run(fail, str(e))
+                    else:
+                        rv = await run(finish, document_id, params, result)
+            return await run(finalize, rv)
+        finally:
+            disconnected.cancel()
+            await run(request_context.pop)
+
+    async def generate_study_guide(self, environ, receive):
+        def save(document_id, params, study_guide_markdown):
+            study_guide_id = document_store.save_study_guide(document_id, study_guide_markdown)
+            return url_for('web.view_study_guide', study_guide_id=study_guide_id)
+
+        def attach(document, params):
+            return attach_speculative_job('study_guide', generation_cost(document))
+
+        return await self.generate(environ, receive, lambda: {}, attach, lambda document, params: document.text,
+                                   lambda text, params: generate_study_guide_async(text), save)
+
+    async def generate_quiz(self, environ, receive):
+        def parse_params():
+            return parse_quiz_options(request.form)
+
+        def attach(document, params):
+            if params != DEFAULT_QUIZ_OPTIONS:
+                return None
+            return attach_speculative_job('quiz', generation_cost(document, params['num_questions']))
+
+        def source_text(document, params):
+            return quiz_source_text(document, params['topic'], params['first_page'], params['last_page'])
+
+        def generate(text, params):
+            return generate_quiz_async(text, params['num_questions'])
+
+        def save(document_id, params, quiz_text):
+            quiz_id = document_store.save_quiz(document_id, params['num_questions'], json.loads(quiz_text))
+            return url_for('web.view_quiz', quiz_id=quiz_id)
+
+        return await self.generate(environ, receive, parse_params, attach, source_text, generate, save)
+
+
+app = StudyBuddyASGI(flask_app)
@@ -1,3 +1,133 @@
-# This file is used for database models if needed in the future.
-# Currently, we're using session storage for simplicity.
-# If the application scales, we can implement database models here.
+# Database models for documents and the study materials generated from them.
+# The session only holds the IDs of these rows, so it stays small no matter
+# how large the uploaded PDF is.
+from datetime import datetime, timezone
+
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def add_missing_columns():
+    """
+    Add columns introduced after a table was created
+
+    db.create_all() only creates missing tables. New columns must be nullable
+    or have a server default, so existing rows stay valid.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    db.session.commit()
+
+
+class Document(db.Model):
+    """An uploaded PDF, identified by the SHA-256 of its bytes"""
+    __tablename__ = 'documents'
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    text = db.deferred(db.Column(db.Text, nullable=False))  # Only loaded when accessed
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+    last_used_at = db.Column(db.DateTime(timezone=True), default=utcnow, index=True)  # Upload or generation
+
+    pages = db.relationship('Page', order_by='Page.number', cascade='all, delete-orphan', lazy='selectin')
+    passage_index = db.relationship('DocumentIndex', uselist=False, cascade='all, delete-orphan')
+    study_guides = db.relationship('StudyGuide', cascade='all, delete-orphan')
+    quizzes = db.relationship('Quiz', cascade='all, delete-orphan')
+    references = db.relationship('DocumentReference', cascade='all, delete-orphan')
+
+    @property
+    def page_offsets(self):
+        return [page.start_offset for page in self.pages]
+
+
+class Page(db.Model):
+    """Location of one page within its document's text"""
+    __tablename__ = 'pages'
+    __table_args__ = (db.UniqueConstraint('document_id', 'number'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    number = db.Column(db.Integer, nullable=False)  # 1-based page number
+    start_offset = db.Column(db.Integer, nullable=False)
+    end_offset = db.Column(db.Integer, nullable=False)
+
+
+class DocumentReference(db.Model):
+    """A reference to a document taken by an API upload, released with the token given to its uploader"""
+    __tablename__ = 'document_references'
+
+    id = db.Column(db.String(64), primary_key=True)  # SHA-256 of the token; the token itself is not stored
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+
+
+class DocumentIndex(db.Model):
+    """Serialized passage index of a document, built once at upload"""
+    __tablename__ = 'document_indexes'
+
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class StudyGuide(db.Model):
+    """A generated study guide, in Markdown"""
+    __tablename__ = 'study_guides'
+
+    id = db.Column(db.String(36), primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    markdown = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+
+
+class Quiz(db.Model):
+    """A generated multiple-choice quiz, stored as the JSON list of questions"""
+    __tablename__ = 'quizzes'
+
+    id = db.Column(db.String(36), primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    num_questions = db.Column(db.Integer, nullable=False)
+    questions = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+
+
+class Batch(db.Model):
+    """PDFs uploaded together, whose study guides and quizzes are generated by one background job"""
+    __tablename__ = 'batches'
+
+    id = db.Column(db.String(36), primary_key=True)
+    job_id = db.Column(db.String(36))
+    num_questions = db.Column(db.Integer, nullable=False)
+    archive = db.Column(db.String(255))  # Blob name of the archive of results, once built
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, index=True)
+
+    files = db.relationship('BatchFile', order_by='BatchFile.position', cascade='all, delete-orphan', lazy='selectin')
+
+
+class BatchFile(db.Model):
+    """One PDF of a batch and how far its processing got"""
+    __tablename__ = 'batch_files'
+
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(36), db.ForeignKey('batches.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(db.String(64))  # None if the file was rejected
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    error = db.Column(db.Text)
+    # Not foreign keys: documents and their materials may expire before the batch
+    document_id = db.Column(db.Integer)
+    study_guide_id = db.Column(db.String(36))
+    quiz_id = db.Column(db.String(36))
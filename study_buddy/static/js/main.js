@@ -128,6 +128,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 const value = parseInt(numQuestions.value);
                 if (isNaN(value) || value < 1 || value > 20) {
                     event.preventDefault();
+                    event.stopImmediatePropagation();
+                    spinner.classList.add('d-none');
                     showAlert('Please enter a number between 1 and 20.', 'danger');
                     return false;
                 }
@@ -136,6 +138,63 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Generation forms: queue a background job and poll it while the spinner is shown
+    const generationForms = document.querySelectorAll('.generation-form');
+    const processingStatus = document.getElementById('processing-status');
+    
+    generationForms.forEach(form => {
+        form.addEventListener('submit', function(event) {
+            event.preventDefault();
+            spinner.classList.remove('d-none');
+            
+            fetch(form.action, {
+                method: 'POST',
+                body: new FormData(form),
+                headers: { 'Accept': 'application/json' }
+            })
+                .then(response => {
+                    if (response.status === 429) {
+                        // Refused by admission control, which says when to try again
+                        return response.json().then(body => {
+                            throw new Error(`${body.error} (retry in ${body.retry_after}s)`);
+                        });
+                    }
+                    if (!response.ok) {
+                        throw new Error('Could not start generation. Please try again.');
+                    }
+                    return response.json();
+                })
+                .then(job => {
+                    // In async serving mode the result is ready as soon as the request returns
+                    if (job.status === 'finished') {
+                        window.location.href = job.result_url;
+                        return;
+                    }
+                    pollJob(job);
+                })
+                .catch(error => {
+                    spinner.classList.add('d-none');
+                    processingStatus.textContent = '';
+                    showAlert(error.message, 'danger');
+                });
+        });
+    });
+    
+    function pollJob(job) {
+        fetch(job.status_url, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(status => {
+                if (['finished', 'failed', 'cancelled'].includes(status.status)) {
+                    // The result page renders the output (or flashes the error)
+                    window.location.href = status.result_url;
+                    return;
+                }
+                processingStatus.textContent = status.progress || 'Waiting for a free worker...';
+                setTimeout(() => pollJob(job), 1000);
+            })
+            .catch(() => setTimeout(() => pollJob(job), 2000));
+    }
+    
     // Handle quiz submission
     const quizSubmitBtn = document.getElementById('quiz-submit');
     const checkAnswersBtn = document.getElementById('check-answers');
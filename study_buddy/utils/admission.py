@@ -0,0 +1,489 @@
+"""
+Admission control for generation requests
+
+Every request that would call Gemini (a background job, a streamed or an
+in-request generation) is admitted here first, on behalf of its session and
+its client IP:
+
+- concurrency: each session and IP has a limit on generations in progress;
+- quota: an estimate of the tokens the generation will use (prompt and
+  response, from the document size and number of questions) is taken from
+  per-session and per-IP buckets;
+- saturation: when the job queue is full, or an in-request generation would
+  wait too long for Gemini quota, nothing more is accepted.
+
+A refused request is answered at once with 429 and Retry-After, rather than
+holding a worker until gunicorn's timeout kills it. Admitted jobs are ranked
+by start-time fair queueing: each client's jobs are spaced out by the Gemini
+quota they use (their tokens over the token rate, or their calls over the
+request rate, whichever is slower), so a client that queues many large jobs
+does not delay the next job of anyone else.
+
+With the sqlite and redis job backends, the budgets, generations in progress
+and fair-queueing state of every client are kept next to the jobs, so every
+worker process (and node) enforces the same limits. With the thread backend,
+whose jobs only this process knows, they are kept in memory.
+"""
+import copy
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from .chunking import PROMPT_TOKEN_BUDGET
+from .jobs import QUEUED, RUNNING, SqliteJobBackend, RedisJobBackend
+from .metrics import ADMISSION_DECISIONS
+from .storage import REDIS_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Admission configuration (can be overridden with environment variables)
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "1") == "1"
+# Generations in progress, and estimated tokens per minute, per session and per client IP; 0 disables a limit
+ADMISSION_SESSION_CONCURRENCY = int(os.environ.get("ADMISSION_SESSION_CONCURRENCY", 2))
+ADMISSION_IP_CONCURRENCY = int(os.environ.get("ADMISSION_IP_CONCURRENCY", 8))
+ADMISSION_SESSION_TPM = int(os.environ.get("ADMISSION_SESSION_TPM", 200000))
+ADMISSION_IP_TPM = int(os.environ.get("ADMISSION_IP_TPM", 500000))
+ADMISSION_MAX_QUEUED = int(os.environ.get("ADMISSION_MAX_QUEUED", 100))  # Queued jobs (or calls waiting for Gemini) before refusing more
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 30))  # Seconds an in-request generation may wait for Gemini quota
+# Fair-queueing weights of client IPs, e.g. "10.0.0.5=4,10.0.0.6=2" (an LMS integration); others weigh 1
+ADMISSION_IP_WEIGHTS = {
+    address.strip(): float(weight)
+    for address, _, weight in (item.partition("=") for item in os.environ.get("ADMISSION_IP_WEIGHTS", "").split(","))
+    if address.strip() and weight
+}
+
+# Cost model: tokens of a document's text, and of the model's response
+CHARS_PER_TOKEN = 4
+STUDY_GUIDE_OUTPUT_TOKENS = 2000
+QUIZ_QUESTION_OUTPUT_TOKENS = 150
+BATCH_DOCUMENT_CHARS = 80000  # Assumed per file of a batch, whose text is not extracted yet when it is admitted
+
+# Retry-After when it cannot be computed (a slot frees up when some generation finishes)
+RETRY_AFTER_SECONDS = 5
+
+# Token rate used to space out fair-queueing ranks when the Gemini limits are disabled
+DEFAULT_SERVICE_TOKENS_PER_SECOND = 1000000 / 60.0
+
+# Idle clients are forgotten after this long
+CLIENT_IDLE_SECONDS = 3600
+
+# A generation not yet attached to a job (or run within a request) stops counting as in progress after this
+# long, in case the process holding it died
+UNATTACHED_SECONDS = 600
+
+
+class AdmissionRejected(Exception):
+    """Raised when a generation request is refused; retry it after retry_after seconds"""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+def estimate_cost(document_chars, num_questions=None):
+    """
+    Estimate the tokens a generation will use, prompt and response
+
+    Args:
+        document_chars (int): Characters of the text sent to the model
+        num_questions (int): Questions of a quiz, or None for a study guide
+
+    Returns:
+        int: Estimated tokens
+    """
+    output = STUDY_GUIDE_OUTPUT_TOKENS if num_questions is None else num_questions * QUIZ_QUESTION_OUTPUT_TOKENS
+    return document_chars // CHARS_PER_TOKEN + output
+
+
+def estimate_calls(cost):
+    """Estimate the Gemini calls a generation of the given cost makes (one per prompt budget of tokens)"""
+    return max(1, math.ceil(cost / PROMPT_TOKEN_BUDGET))
+
+
+def weight_of(address):
+    """Fair-queueing weight of a client IP (see ADMISSION_IP_WEIGHTS)"""
+    return ADMISSION_IP_WEIGHTS.get(address, 1.0)
+
+
+class Admission:
+    """A generation let in by the controller; attach its job, or release it when done"""
+
+    def __init__(self, controller, clients, cost, rank):
+        self.id = str(uuid.uuid4())
+        self.controller = controller
+        self.clients = clients
+        self.cost = cost
+        self.rank = rank
+
+    def attach(self, job_id):
+        """Count the generation as in progress until its job ends"""
+        self.controller._attach(self, job_id)
+
+    def release(self):
+        """End a generation that ran within the request"""
+        self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+# Admission state of a client, stored as JSON by the shared stores:
+#   tokens, updated: its token budget and when it was last refilled (wall-clock time)
+#   finish: virtual finish time of its last admitted job
+#   active: admission ID -> [job ID or None, time it stops counting unless attached to a job]
+#   seen: last time it was admitted or refused
+
+def _new_client(capacity, now):
+    return {"tokens": float(capacity), "updated": now, "finish": 0.0, "active": {}, "seen": now}
+
+
+def _refill(client, per_minute, now):
+    """Bring a client's budget up to date; returns the tokens available"""
+    if per_minute > 0:
+        elapsed = max(0.0, now - client["updated"])
+        client["tokens"] = min(float(per_minute), client["tokens"] + elapsed * per_minute / 60.0)
+    client["updated"] = now
+    return client["tokens"]
+
+
+class MemoryAdmissionState:
+    """Client states kept in this process"""
+
+    def __init__(self):
+        self._clients = {}
+        self._pruned = time.time()
+        self._lock = threading.Lock()
+
+    def read(self, keys):
+        """Copies of the states of the given clients (None for unknown ones)"""
+        with self._lock:
+            return {key: copy.deepcopy(self._clients.get(key)) for key in keys}
+
+    def update(self, keys, fn):
+        """
+        Update the states of the given clients atomically
+
+        Args:
+            keys (list): Client keys
+            fn (callable): Called with a dict of key -> state (None for unknown clients) and the current
+                time; changes the states in place (or adds new ones) and returns the result of update
+
+        Returns:
+            The result of fn
+        """
+        with self._lock:
+            now = time.time()
+            if now - self._pruned > CLIENT_IDLE_SECONDS / 10:
+                self._pruned = now
+                for key, client in list(self._clients.items()):
+                    if now - client["seen"] > CLIENT_IDLE_SECONDS:
+                        del self._clients[key]
+            clients = {key: self._clients.get(key) for key in keys}
+            result = fn(clients, now)
+            self._clients.update((key, client) for key, client in clients.items() if client is not None)
+            return result
+
+
+class SqliteAdmissionState:
+    """Client states kept in the SQLite database of the job queue, shared by the processes on this host"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._pruned = 0.0
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS admission_clients (
+                    key TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    seen REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS admission_clients_seen ON admission_clients (seen)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _load(conn, keys):
+        rows = conn.execute(f"SELECT key, state FROM admission_clients WHERE key IN ({', '.join('?' * len(keys))})",
+                            keys).fetchall()
+        clients = {key: None for key in keys}
+        clients.update((key, json.loads(state)) for key, state in rows)
+        return clients
+
+    def read(self, keys):
+        with closing(self._connect()) as conn:
+            return self._load(conn, keys)
+
+    def update(self, keys, fn):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                if now - self._pruned > CLIENT_IDLE_SECONDS / 10:
+                    self._pruned = now
+                    conn.execute("DELETE FROM admission_clients WHERE seen < ?", (now - CLIENT_IDLE_SECONDS,))
+                clients = self._load(conn, keys)
+                result = fn(clients, now)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO admission_clients (key, state, seen) VALUES (?, ?, ?)",
+                    [(key, json.dumps(client), client["seen"]) for key, client in clients.items() if client is not None],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+
+class RedisAdmissionState:
+    """
+    Client states kept in Redis, shared by every node
+
+    Updates are optimistic transactions (WATCH), retried when another process
+    changed one of the clients meanwhile. Idle clients expire.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, key):
+        return f"{REDIS_KEY_PREFIX}admission:{key}"
+
+    def read(self, keys):
+        states = self.client.mget([self._key(key) for key in keys])
+        return {key: json.loads(state) if state is not None else None for key, state in zip(keys, states)}
+
+    def update(self, keys, fn):
+        from redis.exceptions import WatchError
+        names = [self._key(key) for key in keys]
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(*names)
+                    states = pipe.mget(names)
+                    clients = {key: json.loads(state) if state is not None else None for key, state in zip(keys, states)}
+                    result = fn(clients, time.time())
+                    pipe.multi()
+                    for key, client in clients.items():
+                        if client is not None:
+                            pipe.set(self._key(key), json.dumps(client), ex=CLIENT_IDLE_SECONDS)
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+
+def create_admission_state(job_queue):
+    """
+    Create the store of client states matching a job queue
+
+    Returns:
+        Admission state store: shared with the other processes when the job queue is
+    """
+    if isinstance(job_queue, SqliteJobBackend):
+        return SqliteAdmissionState(job_queue.db_path)
+    if isinstance(job_queue, RedisJobBackend):
+        return RedisAdmissionState(job_queue.client)
+    return MemoryAdmissionState()
+
+
+class AdmissionController:
+    """
+    Admit or refuse generation requests
+
+    Clients are keys such as "session:<id>" and "ip:<address>"; the first one
+    given is the one fair queueing is done for. Jobs started speculatively
+    use keys such as "speculative:session:<id>", which have the same limits
+    as the client's own keys but separate counters.
+    """
+
+    def __init__(self, job_queue, gemini_client, enabled=ADMISSION_CONTROL, state=None):
+        self.job_queue = job_queue
+        self.gemini_client = gemini_client
+        self.enabled = enabled
+        self.state = state if state is not None else create_admission_state(job_queue)
+
+    @staticmethod
+    def _limits(key):
+        """(tokens per minute, generations in progress) allowed to a client; 0 disables a limit"""
+        if key.removeprefix("speculative:").startswith("session:"):
+            return ADMISSION_SESSION_TPM, ADMISSION_SESSION_CONCURRENCY
+        return ADMISSION_IP_TPM, ADMISSION_IP_CONCURRENCY
+
+    def _ended(self, clients):
+        """
+        Find which of the clients' jobs are no longer queued or running
+
+        Called outside the state's transaction, since the sqlite and redis job
+        queues are looked up over a connection.
+
+        Args:
+            clients (dict): Client states, as returned by the state's read()
+
+        Returns:
+            set: IDs of the jobs that ended or are gone
+        """
+        job_ids = {job_id for client in clients.values() if client is not None
+                   for job_id, _ in client["active"].values() if job_id is not None}
+        ended = set()
+        for job_id in job_ids:
+            job = self.job_queue.get(job_id)
+            if job is None or job["status"] not in (QUEUED, RUNNING):
+                ended.add(job_id)
+        return ended
+
+    @staticmethod
+    def _in_progress(client, ended, now):
+        """Forget the client's generations that ended; returns the number still in progress"""
+        for admission_id, (job_id, expires) in list(client["active"].items()):
+            if job_id in ended or (job_id is None and expires < now):
+                del client["active"][admission_id]
+        return len(client["active"])
+
+    def _spacing(self, cost):
+        """
+        Seconds of Gemini quota a generation uses, to space out a client's fair-queueing ranks
+
+        Whichever of the token and request limits binds sets the pace; with the
+        free tier's 15 requests per minute, that is usually the request limit.
+        """
+        token_rate = self.gemini_client.tokens.rate
+        request_rate = self.gemini_client.requests.rate
+        if token_rate <= 0 and request_rate <= 0:
+            return cost / DEFAULT_SERVICE_TOKENS_PER_SECOND
+        spacing = cost / token_rate if token_rate > 0 else 0.0
+        if request_rate > 0:
+            spacing = max(spacing, estimate_calls(cost) / request_rate)
+        return spacing
+
+    def saturated(self, in_request=False, cost=1):
+        """
+        Check whether the service is too busy to take more generations
+
+        Args:
+            in_request (bool): For a generation run within the request rather than as a job
+            cost (int): Its estimated tokens
+
+        Returns:
+            float: Seconds to wait before retrying, or 0 if there is capacity
+        """
+        if not self.enabled:
+            return 0.0
+        if in_request:
+            if self.gemini_client.concurrency.waiting >= ADMISSION_MAX_QUEUED:
+                return RETRY_AFTER_SECONDS
+            tokens = self.gemini_client.tokens
+            wait = max(self.gemini_client.requests.delay(), tokens.delay(min(cost, tokens.capacity)))
+            return wait if wait > ADMISSION_MAX_WAIT else 0.0
+        return RETRY_AFTER_SECONDS if self.job_queue.counts()[QUEUED] >= ADMISSION_MAX_QUEUED else 0.0
+
+    def _reject(self, message, retry_after, reason, clients):
+        ADMISSION_DECISIONS.labels(reason).inc()
+        logger.info(f"Refused generation for {clients[0]} ({reason}), retry after {math.ceil(retry_after)}s")
+        raise AdmissionRejected(message, retry_after, reason)
+
+    def admit(self, clients, cost, weight=1.0, in_request=False):
+        """
+        Let a generation in, or refuse it
+
+        Nothing is counted or taken from the quotas when a request is refused.
+
+        Args:
+            clients (list): Keys of the client, most specific first (e.g. ["session:<id>", "ip:<address>"])
+            cost (int): Estimated tokens (see estimate_cost)
+            weight (float): Fair-queueing weight; a client of weight 2 gets twice the share of one of weight 1
+            in_request (bool): The generation runs within the request instead of as a job
+
+        Returns:
+            Admission: Attach the job to it, or release it once the generation is done
+
+        Raises:
+            AdmissionRejected: If a limit is reached, with the seconds after which to retry
+        """
+        if not self.enabled:
+            return Admission(self, [], cost, None)
+
+        retry_after = self.saturated(in_request, cost)
+        if retry_after:
+            self._reject("The service is busy. Please try again shortly.", retry_after, "saturated", clients)
+
+        # The statuses of the clients' jobs are looked up before the state is locked
+        ended = self._ended(self.state.read(clients))
+        admission = Admission(self, clients, cost, None)
+        spacing = self._spacing(cost) / weight
+
+        def decide(states, now):
+            for key in clients:
+                per_minute, concurrency = self._limits(key)
+                if states[key] is None:
+                    states[key] = _new_client(per_minute, now)
+                states[key]["seen"] = now
+                if concurrency and self._in_progress(states[key], ended, now) >= concurrency:
+                    return "concurrency", RETRY_AFTER_SECONDS
+
+            wait = 0.0
+            for key in clients:
+                per_minute, _ = self._limits(key)
+                tokens = _refill(states[key], per_minute, now)
+                needed = min(cost, per_minute)
+                if per_minute > 0 and tokens < needed:
+                    wait = max(wait, (needed - tokens) * 60.0 / per_minute)
+            if wait > 0:
+                return "quota", wait
+
+            for key in clients:
+                per_minute, _ = self._limits(key)
+                if per_minute > 0:
+                    states[key]["tokens"] -= cost
+                states[key]["active"][admission.id] = [None, now + UNATTACHED_SECONDS]
+
+            # Start-time fair queueing, in wall-clock time so ranks compare with those of other jobs
+            fair = states[clients[0]]
+            start = max(now, fair["finish"])
+            fair["finish"] = start + spacing
+            return None, start
+
+        reason, value = self.state.update(clients, decide)
+        if reason == "concurrency":
+            self._reject("Too many generations in progress. Please wait for one to finish.", value, reason, clients)
+        if reason == "quota":
+            self._reject("Generation quota exceeded. Please try again later.", value, reason, clients)
+        admission.rank = value
+        ADMISSION_DECISIONS.labels("admitted").inc()
+        return admission
+
+    def _attach(self, admission, job_id):
+        if not admission.clients:
+            return
+
+        def attach(states, now):
+            for client in states.values():
+                if client is not None and admission.id in client["active"]:
+                    client["active"][admission.id] = [job_id, None]
+
+        self.state.update(admission.clients, attach)
+
+    def _release(self, admission):
+        if not admission.clients:
+            return
+
+        def release(states, now):
+            for client in states.values():
+                if client is not None:
+                    client["active"].pop(admission.id, None)
+
+        self.state.update(admission.clients, release)
@@ -0,0 +1,51 @@
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(*parts):
+    """
+    Hash the inputs of a rendered artifact, for cache keys and ETags
+
+    Returns:
+        str: Short hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+# Blob store namespace of rendered artifacts
+NAMESPACE = "artifacts"
+
+
+def cached_file(store, filename, render):
+    """
+    Get the path of a rendered artifact, rendering it only if it is not cached yet
+
+    Cache file names should include a content hash, so a changed input never
+    serves a stale file.
+
+    Args:
+        store: Blob store holding rendered artifacts (see utils.storage)
+        filename (str): Cache file name (e.g. "<id>_<hash>.pdf")
+        render (callable): Returns the artifact as bytes on a cache miss
+
+    Returns:
+        str: Local path of the cached file
+    """
+    path = store.local_path(NAMESPACE, filename)
+    if path is not None:
+        return path
+
+    logger.info(f"Rendering {filename}")
+    data = render()
+    fd, tmp_path = store.temp_file(NAMESPACE)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    store.put_file(NAMESPACE, filename, tmp_path)
+    return store.local_path(NAMESPACE, filename)
@@ -0,0 +1,166 @@
+"""
+Fingerprinted, precompressed static files, and compression of responses
+
+Build the static files before deploying (from the repository root):
+
+    python -m study_buddy.utils.assets
+
+Every file in static/ is copied to static/build/ under a name containing a
+hash of its content (css/style.css -> build/css/style.<hash>.css), with
+gzip and, when the brotli package is installed, brotli variants next to
+it. build/manifest.json maps each file to its copy; the app links to the
+copies, which never change and are cached by browsers for a year.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:  # Optional; without it only gzip is used
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Response compression configuration (can be overridden with environment variables)
+COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "1") == "1"  # Disable when a proxy compresses instead
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))  # Smaller responses are not worth compressing
+
+# Levels used on the fly, trading some size for speed; build-time variants use the maximum
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Content types compressed on the fly and at build time
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/plain", "text/markdown", "text/javascript", "application/javascript",
+    "application/json", "image/svg+xml",
+}
+PRECOMPRESSED_EXTENSIONS = {".css", ".js", ".json", ".svg", ".txt", ".html", ".map"}
+
+# Directory of the built files, under the static folder
+BUILD_DIR = "build"
+MANIFEST_NAME = "manifest.json"
+
+# File name suffix of each precompressed variant
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+
+
+def compress(data, encoding, build=False):
+    """
+    Compress data with a content coding
+
+    Args:
+        data (bytes): Data to compress
+        encoding (str): "br" or "gzip"
+        build (bool): Use the maximum level (slow), for files compressed once at build time
+
+    Returns:
+        bytes: Compressed data
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if build else BROTLI_QUALITY)
+    # mtime=0 so that building the same file twice gives the same bytes
+    return gzip.compress(data, compresslevel=9 if build else GZIP_LEVEL, mtime=0)
+
+
+def available_encodings():
+    """Content codings this process can produce, preferred first"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def choose_encoding(accept_encodings, encodings):
+    """
+    Pick the content coding to send
+
+    Args:
+        accept_encodings (MIMEAccept): The request's Accept-Encoding header (request.accept_encodings)
+        encodings (list): Codings available for this response, preferred first
+
+    Returns:
+        str: The coding, or None to send the response uncompressed
+    """
+    for encoding in encodings:
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def fingerprinted_name(path, data):
+    """Name of a file's build copy, e.g. css/style.css -> css/style.3f2a9c1d0b.css"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def build_assets(static_dir=STATIC_DIR):
+    """
+    Fingerprint and precompress every static file
+
+    The previous build is replaced. Compressed variants are only kept when
+    they are smaller than the file.
+
+    Args:
+        static_dir (str): The app's static folder
+
+    Returns:
+        dict: The manifest written to the build directory
+    """
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+    manifest = {"files": {}, "encodings": {}}
+    for root, dirs, names in os.walk(static_dir):
+        if root == static_dir:
+            dirs[:] = [name for name in dirs if name != BUILD_DIR]
+        for name in sorted(names):
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                data = f.read()
+
+            built = f"{BUILD_DIR}/{fingerprinted_name(path, data)}"
+            target = os.path.join(static_dir, *built.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            manifest["files"][path] = built
+
+            if os.path.splitext(name)[1].lower() not in PRECOMPRESSED_EXTENSIONS:
+                continue
+            encodings = []
+            for encoding in available_encodings():
+                compressed = compress(data, encoding, build=True)
+                if len(compressed) < len(data):
+                    with open(target + SUFFIXES[encoding], "wb") as f:
+                        f.write(compressed)
+                    encodings.append(encoding)
+            manifest["encodings"][built] = encodings
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir=STATIC_DIR):
+    """
+    Read the manifest of the last build
+
+    Returns:
+        dict: Build copy of each static file ("files") and its precompressed
+            variants ("encodings"); empty if the files were never built
+    """
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.info("Static files have not been built; serving them without fingerprints")
+        return {"files": {}, "encodings": {}}
+
+
+if __name__ == "__main__":
+    built = build_assets()
+    for path, copy in sorted(built["files"].items()):
+        print(f"{path} -> {copy} {' '.join(built['encodings'].get(copy, []))}")
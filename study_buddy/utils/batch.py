@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+from . import document_store
+from .artifacts import NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+# Batch upload configuration (can be overridden with environment variables)
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 50))
+BATCH_MAX_UPLOAD_BYTES = int(os.environ.get("BATCH_MAX_UPLOAD_MB", 200)) * 1024 * 1024
+# PDFs of a batch generated at the same time; model calls are also bounded by the Gemini client's limits
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+
+# Largest PDF accepted inside a zip, the same as a single upload
+MAX_PDF_BYTES = 16 * 1024 * 1024
+
+
+def _save(upload_store, name, stream):
+    try:
+        return name, upload_store.save(stream), None
+    except Exception as e:
+        logger.error(f"Error storing {name}: {str(e)}")
+        return name, None, f"Could not store the file: {str(e)}"
+
+
+def _pdf_members(archive):
+    """PDF members of a zip archive, skipping folders and macOS metadata"""
+    return [info for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/") and info.filename.lower().endswith(".pdf")]
+
+
+def _open_zip(stream):
+    try:
+        return zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        return None
+
+
+def _save_zip(upload_store, archive):
+    """Store the PDFs inside an uploaded zip archive"""
+    saved = []
+    for info in _pdf_members(archive):
+        name = secure_filename(os.path.basename(info.filename)) or "document.pdf"
+        if info.file_size > MAX_PDF_BYTES:
+            saved.append((name, None, "File too large (maximum 16MB)"))
+            continue
+        # Members are read up to their declared size, so a crafted archive cannot expand further
+        with archive.open(info) as member:
+            saved.append(_save(upload_store, name, member))
+    return saved
+
+
+def _discard(upload_store, saved):
+    """Remove the stored PDFs of a batch that failed, unless a document already uses them"""
+    for _, digest, _ in saved:
+        if digest and document_store.find_document(digest) is None:
+            upload_store.remove(digest)
+
+
+def save_batch_upload(files, upload_store, max_files=BATCH_MAX_FILES, max_bytes=BATCH_MAX_UPLOAD_BYTES):
+    """
+    Store every PDF of a batch upload, including those inside zip archives
+
+    Files that cannot be used (not a PDF, too large, a corrupt archive) are
+    reported rather than failing the whole batch. The number of PDFs and the
+    size of the zips' contents are checked before anything is stored.
+
+    Args:
+        files (list): Uploaded files (werkzeug FileStorage)
+        upload_store (UploadStore): Store for the PDFs
+        max_files (int): Most PDFs accepted in one batch
+        max_bytes (int): Most bytes the zip archives may extract to, by the sizes their members declare
+
+    Returns:
+        list: (file name, content hash or None, error or None) of each PDF, in upload order
+
+    Raises:
+        ValueError: If the batch holds more than max_files PDFs, or its zips more than max_bytes
+    """
+    uploads = []
+    for file in files:
+        if not file or not file.filename:
+            continue
+        name = secure_filename(file.filename) or "upload"
+        archive = _open_zip(file.stream) if name.lower().endswith(".zip") else None
+        uploads.append((name, file, archive))
+
+    try:
+        members = [info for _, _, archive in uploads if archive is not None for info in _pdf_members(archive)]
+        if len(members) + sum(1 for _, _, archive in uploads if archive is None) > max_files:
+            raise ValueError(f"A batch can hold at most {max_files} PDFs.")
+        if sum(info.file_size for info in members if info.file_size <= MAX_PDF_BYTES) > max_bytes:
+            raise ValueError(f"The PDFs in a batch's zip files can total at most {max_bytes // (1024 * 1024)}MB.")
+
+        saved = []
+        try:
+            for name, file, archive in uploads:
+                if archive is not None:
+                    saved.extend(_save_zip(upload_store, archive))
+                elif name.lower().endswith(".zip"):
+                    saved.append((name, None, "Not a valid zip file"))
+                elif name.lower().endswith(".pdf"):
+                    saved.append(_save(upload_store, name, file.stream))
+                else:
+                    saved.append((name, None, "Not a PDF or zip file"))
+        except Exception:
+            _discard(upload_store, saved)
+            raise
+        return saved
+    finally:
+        for _, _, archive in uploads:
+            if archive is not None:
+                archive.close()
+
+
+def archive_name(position, total, filename):
+    """
+    Name of a file's results in the batch archive
+
+    Names are prefixed with the file's position in the batch, so PDFs of the
+    same name (e.g. from different folders of a zip) do not collide.
+    """
+    stem = os.path.splitext(filename)[0] or "document"
+    return f"{position:0{len(str(total))}d}_{stem}"
+
+
+def write_archive(store, batch_id, entries, report):
+    """
+    Store the archive of a batch's results
+
+    Args:
+        store: Blob store (see utils.storage)
+        batch_id (str): Batch ID, which owns the archive
+        entries (list): (name in the archive, local path) of each file to include
+        report (dict): Per-file status, written to the archive as status.json
+
+    Returns:
+        str: Blob name of the archive
+    """
+    name = f"{batch_id}_results.zip"
+    fd, tmp_path = store.temp_file(NAMESPACE)
+    with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w") as archive:
+        for arcname, path in entries:
+            archive.write(path, arcname, compress_type=zipfile.ZIP_STORED)  # PDFs are already compressed
+        archive.writestr("status.json", json.dumps(report, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+    store.put_file(NAMESPACE, name, tmp_path)
+    return name
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import CACHE_EVICTIONS, CACHE_LOOKUPS
+from .storage import REDIS_KEY_PREFIX, STORAGE_BACKEND, get_redis
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration (can be overridden with environment variables)
+CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "study_buddy_cache"))
+CACHE_MEMORY_ENTRIES = int(os.environ.get("RESULT_CACHE_MEMORY_ENTRIES", 128))
+CACHE_DISK_MAX_BYTES = int(os.environ.get("RESULT_CACHE_DISK_MB", 256)) * 1024 * 1024
+CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 3600))
+
+
+def make_cache_key(kind, prompt_version, model_name, text, **params):
+    """
+    Build a content-addressed cache key for a generation request
+
+    Args:
+        kind (str): Type of artifact (e.g. "study_guide" or "quiz")
+        prompt_version (str): Version of the prompt template used
+        model_name (str): Name of the model used for generation
+        text (str): Text extracted from the PDF
+        **params: Extra generation parameters (e.g. num_questions)
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    digest = hashlib.sha256()
+    header = json.dumps([kind, prompt_version, model_name, sorted(params.items())], default=str)
+    digest.update(header.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for generated results.
+
+    The first tier is an in-memory LRU; the second is a directory of JSON files
+    shared by every worker on the host, bounded by total size and entry age.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_entries=CACHE_MEMORY_ENTRIES,
+                 disk_max_bytes=CACHE_DISK_MAX_BYTES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+        if name == "evictions":
+            CACHE_EVICTIONS.inc()
+        else:
+            CACHE_LOOKUPS.labels({"disk_hits": "disk_hit", "misses": "miss"}[name]).inc()
+
+    def get(self, key):
+        """
+        Look up a cached result
+
+        Args:
+            key (str): Key returned by make_cache_key
+
+        Returns:
+            str: Cached value, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    CACHE_LOOKUPS.labels("memory_hit").inc()
+                    logger.debug(f"Result cache memory hit: {key[:12]}")
+                    return value
+                del self._memory[key]
+
+        entry = self._load(key)
+        if entry is None:
+            self._count("misses")
+            logger.debug(f"Result cache miss: {key[:12]}")
+            return None
+
+        if now - entry["created"] > self.ttl_seconds:
+            self._discard(key)
+            self._count("misses")
+            logger.debug(f"Result cache expired: {key[:12]}")
+            return None
+
+        self._remember(key, entry["created"], entry["value"])
+        self._count("disk_hits")
+        logger.debug(f"Result cache disk hit: {key[:12]}")
+        return entry["value"]
+
+    def set(self, key, value):
+        """
+        Store a result in both tiers
+
+        Args:
+            key (str): Key returned by make_cache_key
+            value (str): Value to cache (must be JSON serialisable)
+        """
+        created = time.time()
+        self._remember(key, created, value)
+        self._store(key, {"created": created, "value": value})
+
+    def _load(self, key):
+        """Read an entry from the shared tier, or None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Touch the file so disk eviction is least-recently-used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _discard(self, key):
+        """Drop an expired entry from the shared tier"""
+        self._remove_file(self._path(key))
+
+    def _store(self, key, entry):
+        """Write an entry to the shared tier"""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write result cache entry: {str(e)}")
+            return
+
+        self._evict_disk()
+
+    def _remember(self, key, created, value):
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """Drop expired entries, then the least recently used ones until under the size limit"""
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                self._remove_file(path)
+                self._count("evictions")
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.disk_max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            self._remove_file(path)
+            total -= size
+            self._count("evictions")
+
+    def stats(self):
+        """
+        Get hit/miss counters for this process
+
+        Returns:
+            dict: Counters plus the overall hit rate
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+class RedisResultCache(ResultCache):
+    """
+    Result cache whose second tier is Redis, shared by every node
+
+    Entries expire through Redis; size is bounded by the server's maxmemory
+    policy (allkeys-lru or volatile-lru) rather than RESULT_CACHE_DISK_MB.
+    """
+
+    def __init__(self, client, memory_entries=CACHE_MEMORY_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.client = client
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def _key(self, key):
+        return f"{REDIS_KEY_PREFIX}result:{key}"
+
+    def _load(self, key):
+        try:
+            data = self.client.get(self._key(key))
+        except Exception as e:
+            logger.warning(f"Could not read result cache entry: {str(e)}")
+            return None
+        return json.loads(data) if data is not None else None
+
+    def _store(self, key, entry):
+        try:
+            self.client.set(self._key(key), json.dumps(entry), ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Could not write result cache entry: {str(e)}")
+
+    def _discard(self, key):
+        pass  # Expired entries are dropped by Redis
+
+
+def create_result_cache(backend=STORAGE_BACKEND):
+    """
+    Create the result cache configured for this deployment
+
+    Args:
+        backend (str): Storage backend; "redis" shares the second tier between hosts
+
+    Returns:
+        ResultCache: Cache instance
+    """
+    if backend == "redis":
+        return RedisResultCache(get_redis())
+    return ResultCache()
+
+
+# Shared cache used by the Gemini client
+result_cache = create_result_cache()
@@ -0,0 +1,96 @@
+import logging
+import os
+import re
+
+from .compression import count_tokens, compress_text
+from .pdf_processor import PAGE_BREAK
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of tokens of document text sent in a single prompt
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 8000))
+# Documents needing to shrink by no more than this ratio are compressed into a
+# single prompt instead of being split into several
+COMPRESSION_MIN_RATIO = float(os.environ.get("COMPRESSION_MIN_RATIO", 0.5))
+
+# Blank lines separate sections/paragraphs in extracted text
+SECTION_BREAK = re.compile(r"\n\s*\n")
+
+
+def _split_oversized(block, max_tokens):
+    """Split a block that is too long on section, then line, then word boundaries"""
+    for pattern, separator in ((SECTION_BREAK, "\n\n"), (re.compile(r"\n"), "\n"), (re.compile(r"\s+"), " ")):
+        parts = [part for part in pattern.split(block) if part.strip()]
+        if len(parts) > 1:
+            return _pack(parts, max_tokens, separator)
+    # A single huge "word": split it by characters, roughly at the token budget
+    return [block[i:i + max_tokens * 4] for i in range(0, len(block), max_tokens * 4)]
+
+
+def _pack(blocks, max_tokens, separator):
+    """Greedily pack consecutive blocks into chunks of at most max_tokens"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for block in blocks:
+        block_tokens = count_tokens(block)
+        if block_tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_oversized(block, max_tokens))
+            continue
+
+        if current and current_tokens + block_tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += block_tokens
+
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_into_chunks(text, max_tokens=PROMPT_TOKEN_BUDGET):
+    """
+    Split extracted PDF text into chunks that each fit in one prompt
+
+    Whole pages are kept together where possible; pages that are too long are
+    split on section boundaries (blank lines), then on line boundaries.
+
+    Args:
+        text (str): Text extracted from the PDF
+        max_tokens (int): Maximum number of tokens in a chunk
+
+    Returns:
+        list: Chunks of text, in document order
+    """
+    pages = [page for page in text.split(PAGE_BREAK) if page.strip()]
+    return _pack(pages, max_tokens, "\n")
+
+
+def fit_to_budget(text, max_tokens=PROMPT_TOKEN_BUDGET):
+    """
+    Fit document text to the prompt budget
+
+    Text within the budget is returned unchanged. Text that only needs to
+    shrink a little is compressed to its most informative sentences, which
+    costs one model call instead of several; anything longer is split into
+    chunks.
+
+    Args:
+        text (str): Text extracted from the PDF
+        max_tokens (int): Token budget of one prompt
+
+    Returns:
+        list: Pieces of text, each within the budget, in document order
+    """
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [text]
+    if tokens * COMPRESSION_MIN_RATIO <= max_tokens:
+        return [compress_text(text, max_tokens)]
+    chunks = split_into_chunks(text, max_tokens)
+    logger.info(f"Split {tokens} tokens into {len(chunks)} chunks")
+    return chunks
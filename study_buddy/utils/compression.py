@@ -0,0 +1,169 @@
+import logging
+import re
+
+import numpy as np
+
+from .metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Approximates a subword tokenizer: runs of up to 7 letters or 3 digits, and
+# every other non-space character (punctuation, symbols, CJK) count as one token
+TOKEN_PATTERN = re.compile(r"[A-Za-z]{1,7}|\d{1,3}|[^\sA-Za-z\d]")
+
+PARAGRAPH_BREAK = re.compile(r"\s*(?:\f|\n\s*\n)\s*")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[A-Z0-9])")
+TERM_PATTERN = re.compile(r"[a-z][a-z0-9]{2,}")
+
+# Sentences longer than this are split on line breaks (tables, lists, headings)
+MAX_SENTENCE_TOKENS = 120
+# Vocabulary size of the TF-IDF model
+MAX_FEATURES = 2048
+# Above this many sentences the n x n similarity graph is too large; sentences
+# are then scored by similarity to the document centroid instead of TextRank
+MAX_TEXTRANK_SENTENCES = 2000
+DAMPING = 0.85
+ITERATIONS = 30
+
+STOP_WORDS = frozenset("""
+    about above after again against all also and any are because been before being below between both but can could
+    did does doing down during each few for from further had has have having her here hers herself him himself his how
+    into its itself just more most not now off once only other our ours out over own same she should some such than
+    that the their theirs them then there these they this those through too under until very was were what when where
+    which while who whom why will with would you your yours
+""".split())
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a piece of text locally, without calling the API
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Approximate number of model tokens
+    """
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def split_sentences(text):
+    """
+    Split text into sentences, grouped by paragraph
+
+    Args:
+        text (str): Text extracted from the PDF
+
+    Returns:
+        list: (paragraph index, sentence) pairs, in document order
+    """
+    sentences = []
+    for index, paragraph in enumerate(PARAGRAPH_BREAK.split(text)):
+        for sentence in SENTENCE_END.split(paragraph):
+            if count_tokens(sentence) > MAX_SENTENCE_TOKENS:
+                parts = sentence.split("\n")
+            else:
+                parts = [sentence]
+            sentences.extend((index, part.strip()) for part in parts if part.strip())
+    return sentences
+
+
+def _tfidf_matrix(sentences):
+    """Build L2-normalised TF-IDF vectors (one row per sentence) over the most frequent terms"""
+    term_lists = [[term for term in TERM_PATTERN.findall(sentence.lower()) if term not in STOP_WORDS]
+                  for sentence in sentences]
+
+    document_frequency = {}
+    for terms in term_lists:
+        for term in set(terms):
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    vocabulary = sorted(document_frequency, key=document_frequency.get, reverse=True)[:MAX_FEATURES]
+    columns = {term: column for column, term in enumerate(vocabulary)}
+
+    counts = np.zeros((len(sentences), len(vocabulary)), dtype=np.float32)
+    for row, terms in enumerate(term_lists):
+        for term in terms:
+            column = columns.get(term)
+            if column is not None:
+                counts[row, column] += 1
+
+    frequencies = np.array([document_frequency[term] for term in vocabulary], dtype=np.float32)
+    idf = np.log((1 + len(sentences)) / (1 + frequencies)) + 1
+    matrix = np.log1p(counts) * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def score_sentences(sentences):
+    """
+    Score how informative each sentence is
+
+    Sentences are ranked with TextRank: PageRank over a graph whose edges are
+    the cosine similarities of their TF-IDF vectors, so sentences that share
+    vocabulary with many others (the document's main topics) score highest.
+
+    Args:
+        sentences (list): Sentence strings
+
+    Returns:
+        numpy.ndarray: One score per sentence
+    """
+    matrix = _tfidf_matrix(sentences)
+    if len(sentences) > MAX_TEXTRANK_SENTENCES:
+        return matrix @ matrix.mean(axis=0)
+
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, 0)
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    # Sentences with no neighbours link evenly to every sentence
+    transition = np.where(row_sums > 0, similarity / np.where(row_sums == 0, 1, row_sums), 1.0 / len(sentences))
+
+    scores = np.full(len(sentences), 1.0 / len(sentences), dtype=np.float32)
+    for _ in range(ITERATIONS):
+        scores = (1 - DAMPING) / len(sentences) + DAMPING * (transition.T @ scores)
+    return scores
+
+
+def compress_text(text, max_tokens):
+    """
+    Shorten text to a token budget by keeping its most informative sentences
+
+    Args:
+        text (str): Text extracted from the PDF
+        max_tokens (int): Token budget
+
+    Returns:
+        str: The selected sentences in their original order, paragraphs separated by blank lines
+    """
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+
+    with span("compress"):
+        sentences = split_sentences(text)
+        if not sentences:
+            return text
+        scores = score_sentences([sentence for _, sentence in sentences])
+    lengths = [count_tokens(sentence) for _, sentence in sentences]
+
+    keep = []
+    remaining = max_tokens
+    for index in np.argsort(-scores, kind="stable"):
+        if lengths[index] <= remaining:
+            keep.append(index)
+            remaining -= lengths[index]
+
+    paragraphs = []
+    previous = None
+    for index in sorted(keep):
+        paragraph, sentence = sentences[index]
+        if paragraph == previous:
+            paragraphs[-1].append(sentence)
+        else:
+            paragraphs.append([sentence])
+            previous = paragraph
+    compressed = "\n\n".join(" ".join(paragraph) for paragraph in paragraphs)
+
+    logger.info(f"Compressed text from {total} to {count_tokens(compressed)} tokens "
+                f"({len(keep)} of {len(sentences)} sentences)")
+    return compressed
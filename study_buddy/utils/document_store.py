@@ -0,0 +1,328 @@
+import hashlib
+import json
+import logging
+import secrets
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from ..models import db, utcnow, Batch, BatchFile, Document, DocumentIndex, DocumentReference, Page, StudyGuide, Quiz
+from .metrics import span
+from .passage_index import PassageIndex
+
+logger = logging.getLogger(__name__)
+
+
+def find_document(content_hash):
+    """
+    Look up an uploaded document by the hash of its bytes
+
+    Args:
+        content_hash (str): Hex SHA-256 of the uploaded PDF
+
+    Returns:
+        Document: The stored document, or None if it has not been uploaded
+    """
+    return Document.query.filter_by(content_hash=content_hash).one_or_none()
+
+
+def add_document(content_hash, extracted):
+    """
+    Store the extracted text and page index of a new upload
+
+    Args:
+        content_hash (str): Hex SHA-256 of the uploaded PDF
+        extracted (ExtractedDocument): Extracted text and page offsets
+
+    Returns:
+        Document: The stored document, or the one stored meanwhile by a concurrent identical upload
+    """
+    document = Document(content_hash=content_hash, text=extracted.text, ref_count=0)
+    ends = extracted.page_offsets[1:] + [len(extracted.text)]
+    document.pages = [
+        Page(number=number, start_offset=start, end_offset=end)
+        for number, (start, end) in enumerate(zip(extracted.page_offsets, ends), 1)
+    ]
+    with span("passage_index"):
+        document.passage_index = DocumentIndex(
+            data=PassageIndex.build(extracted.text, extracted.page_offsets).to_bytes()
+        )
+    db.session.add(document)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existing = find_document(content_hash)
+        if existing is None:
+            raise
+        return existing
+    return document
+
+
+def get_document(document_id):
+    return db.session.get(Document, document_id)
+
+
+def get_passage_index(document):
+    """
+    Load a document's passage index, building it for documents stored before indexing existed
+
+    Args:
+        document (Document): Stored document
+
+    Returns:
+        PassageIndex: Index of the document's passages
+    """
+    record = db.session.get(DocumentIndex, document.id)
+    if record is not None:
+        return PassageIndex.from_bytes(record.data)
+
+    index = PassageIndex.build(document.text, document.page_offsets)
+    db.session.add(DocumentIndex(document_id=document.id, data=index.to_bytes()))
+    db.session.commit()
+    return index
+
+
+def acquire_document(document_id):
+    """
+    Take a reference to a document on behalf of a session
+
+    Args:
+        document_id (int): Document ID
+    """
+    db.session.execute(
+        db.update(Document).where(Document.id == document_id)
+        .values(ref_count=Document.ref_count + 1, last_used_at=utcnow())
+    )
+    db.session.commit()
+
+
+def add_reference(document_id):
+    """
+    Take a reference to a document on behalf of an API upload
+
+    Args:
+        document_id (int): Document ID
+
+    Returns:
+        str: Token needed to release the reference (see drop_reference)
+    """
+    token = secrets.token_urlsafe(32)
+    db.session.add(DocumentReference(id=hashlib.sha256(token.encode()).hexdigest(), document_id=document_id))
+    acquire_document(document_id)
+    return token
+
+
+def drop_reference(document_id, token):
+    """
+    Forget an API upload's reference to a document; release_document must then be called
+
+    Args:
+        document_id (int): Document ID
+        token (str): Token returned by add_reference
+
+    Returns:
+        bool: Whether the token held a reference to the document (only the first call with it succeeds)
+    """
+    result = db.session.execute(
+        db.delete(DocumentReference)
+        .where(DocumentReference.id == hashlib.sha256(token.encode()).hexdigest(),
+               DocumentReference.document_id == document_id)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _touch_document(document_id):
+    db.session.execute(db.update(Document).where(Document.id == document_id).values(last_used_at=utcnow()))
+
+
+def release_document(document_id):
+    """
+    Drop a session's reference to a document, deleting it once unreferenced
+
+    Args:
+        document_id (int): Document ID
+
+    Returns:
+        str: Content hash of the deleted document, or None if it is still referenced
+    """
+    db.session.execute(
+        db.update(Document).where(Document.id == document_id).values(ref_count=Document.ref_count - 1)
+    )
+    document = db.session.get(Document, document_id, populate_existing=True)
+    if document is None or document.ref_count > 0:
+        db.session.commit()
+        return None
+
+    content_hash = document.content_hash
+    db.session.delete(document)
+    db.session.commit()
+    logger.info(f"Deleted unreferenced document {content_hash[:12]}")
+    return content_hash
+
+
+def save_study_guide(document_id, markdown, study_guide_id=None):
+    """
+    Store a generated study guide
+
+    Args:
+        document_id (int): Document the guide was generated from
+        markdown (str): Study guide in Markdown format
+        study_guide_id (str): ID to store it under (a new one is generated if omitted)
+
+    Returns:
+        str: Study guide ID
+    """
+    study_guide = StudyGuide(id=study_guide_id or str(uuid.uuid4()), document_id=document_id, markdown=markdown)
+    db.session.merge(study_guide)
+    _touch_document(document_id)
+    db.session.commit()
+    return study_guide.id
+
+
+def get_study_guide(study_guide_id):
+    return db.session.get(StudyGuide, study_guide_id)
+
+
+def save_quiz(document_id, num_questions, questions, quiz_id=None):
+    """
+    Store a generated quiz
+
+    Args:
+        document_id (int): Document the quiz was generated from
+        num_questions (int): Number of questions requested
+        questions (list): Quiz questions
+        quiz_id (str): ID to store it under (a new one is generated if omitted)
+
+    Returns:
+        str: Quiz ID
+    """
+    quiz = Quiz(id=quiz_id or str(uuid.uuid4()), document_id=document_id,
+                num_questions=num_questions, questions=json.dumps(questions))
+    db.session.merge(quiz)
+    _touch_document(document_id)
+    db.session.commit()
+    return quiz.id
+
+
+def get_quiz(quiz_id):
+    return db.session.get(Quiz, quiz_id)
+
+
+def append_quiz_questions(quiz_id, questions):
+    """
+    Add questions to the end of a stored quiz
+
+    Args:
+        quiz_id (str): Quiz ID
+        questions (list): New quiz questions
+    """
+    quiz = db.session.get(Quiz, quiz_id)
+    quiz.questions = json.dumps(json.loads(quiz.questions) + questions)
+    quiz.num_questions += len(questions)
+    _touch_document(quiz.document_id)
+    db.session.commit()
+
+
+def delete_artifacts(study_guide_id=None, quiz_id=None):
+    """
+    Delete a session's study guide and quiz
+
+    Args:
+        study_guide_id (str): Study guide ID
+        quiz_id (str): Quiz ID
+    """
+    if study_guide_id:
+        db.session.execute(db.delete(StudyGuide).where(StudyGuide.id == study_guide_id))
+    if quiz_id:
+        db.session.execute(db.delete(Quiz).where(Quiz.id == quiz_id))
+    db.session.commit()
+
+
+def delete_unused_documents(unused_since):
+    """
+    Delete documents, with their study guides and quizzes, not used since a given time
+
+    Documents still referenced by a session are deleted too: their sessions
+    have expired without being cleared.
+
+    Args:
+        unused_since (datetime): Cutoff for the last upload of, or generation from, a document
+
+    Returns:
+        tuple: Content hashes of the deleted documents, and IDs of their study guides and quizzes
+    """
+    last_used = db.func.coalesce(Document.last_used_at, Document.created_at)
+    documents = Document.query.filter(last_used < unused_since).all()
+    content_hashes = [document.content_hash for document in documents]
+    artifact_ids = [artifact.id for document in documents for artifact in document.study_guides + document.quizzes]
+    for document in documents:
+        db.session.delete(document)
+    db.session.commit()
+    if documents:
+        logger.info(f"Deleted {len(documents)} unused documents")
+    return content_hashes, artifact_ids
+
+
+def count_documents():
+    return db.session.scalar(db.select(db.func.count()).select_from(Document))
+
+
+def create_batch(num_questions, files):
+    """
+    Store a new batch of uploaded PDFs
+
+    Args:
+        num_questions (int): Number of quiz questions to generate per PDF
+        files (list): (file name, content hash or None, error or None) of each uploaded file;
+            files with an error are stored as failed
+
+    Returns:
+        str: Batch ID
+    """
+    batch = Batch(id=str(uuid.uuid4()), num_questions=num_questions)
+    batch.files = [
+        BatchFile(position=position, filename=filename, content_hash=content_hash,
+                  status='failed' if error else 'queued', error=error)
+        for position, (filename, content_hash, error) in enumerate(files, 1)
+    ]
+    db.session.add(batch)
+    db.session.commit()
+    return batch.id
+
+
+def get_batch(batch_id):
+    return db.session.get(Batch, batch_id)
+
+
+def update_batch(batch_id, **fields):
+    """Set fields of a batch (e.g. its job ID or archive)"""
+    db.session.execute(db.update(Batch).where(Batch.id == batch_id).values(**fields))
+    db.session.commit()
+
+
+def update_batch_file(file_id, **fields):
+    """Set fields of one file of a batch (e.g. its status and error)"""
+    db.session.execute(db.update(BatchFile).where(BatchFile.id == file_id).values(**fields))
+    db.session.commit()
+
+
+def delete_old_batches(created_before):
+    """
+    Delete batches created before a given time, releasing their references to their documents
+
+    Args:
+        created_before (datetime): Cutoff for the creation of a batch
+
+    Returns:
+        tuple: IDs of the deleted batches, and content hashes of the documents deleted with them
+    """
+    batches = Batch.query.filter(Batch.created_at < created_before).all()
+    batch_ids = [batch.id for batch in batches]
+    document_ids = [file.document_id for batch in batches for file in batch.files if file.document_id]
+    for batch in batches:
+        db.session.delete(batch)
+    db.session.commit()
+    removed_hashes = [content_hash for content_hash in map(release_document, document_ids) if content_hash]
+    return batch_ids, removed_hashes
@@ -1,35 +1,397 @@
 import os
+import re
 import json
-import google.generativeai as genai
+import asyncio
+import bisect
+import functools
+import threading
+import time
 import logging
-from dotenv import load_dotenv  # Add this import
-
-# Load environment variables from .env file
-load_dotenv()  # Add this line
+from concurrent.futures import ThreadPoolExecutor
+from .cache import make_cache_key, result_cache
+from .chunking import PROMPT_TOKEN_BUDGET, fit_to_budget
+from .compression import count_tokens, compress_text
+from .metrics import STAGE_SECONDS, span, record_model_call, lazy_import
+from .rate_limit import TokenBucket, AdaptiveConcurrencyLimiter, backoff_delay
+from .singleflight import create_single_flight
 
 logger = logging.getLogger(__name__)
 
-# Initialize the Gemini API
+# The Gemini SDK is configured when the model is first used (see GeminiClient.model)
 API_KEY = os.environ.get("GEMINI_API_KEY")
 if not API_KEY:
     logger.warning("GEMINI_API_KEY not found in environment variables")
 
-genai.configure(api_key=API_KEY)
+MODEL_NAME = 'gemini-2.0-flash'
+
+# Bump these whenever the corresponding prompt changes so cached results are not reused
+STUDY_GUIDE_PROMPT_VERSION = "3"
+QUIZ_PROMPT_VERSION = "4"
+
+# Maximum number of concurrent model calls made for a single large document
+GENERATION_CONCURRENCY = int(os.environ.get("GENERATION_CONCURRENCY", 4))
+
+# Attempts made per chunk to get the requested number of valid quiz questions
+QUIZ_MAX_ATTEMPTS = int(os.environ.get("QUIZ_MAX_ATTEMPTS", 3))
+
+# Quota of this process (0 disables the limit); defaults match the free tier of gemini-2.0-flash
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", 15))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", 1000000))
+# Bounds of the adaptive limit on concurrent model calls across all requests
+GEMINI_MIN_CONCURRENCY = int(os.environ.get("GEMINI_MIN_CONCURRENCY", 1))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 16))
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", 5))
+GEMINI_BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", 1.0))
+GEMINI_BACKOFF_MAX = float(os.environ.get("GEMINI_BACKOFF_MAX", 32.0))
+
+@functools.cache
+def overload_errors():
+    """Errors signalling that we are sending more than the API will accept"""
+    google_exceptions = lazy_import("google.api_core.exceptions")
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable,
+    )
+
+@functools.cache
+def transient_errors():
+    """Errors worth retrying"""
+    google_exceptions = lazy_import("google.api_core.exceptions")
+    return overload_errors() + (
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.GatewayTimeout,
+        ConnectionError,
+        TimeoutError,
+    )
+
+class GeminiClient:
+    """
+    Shared access to the Gemini model
+    
+    The model (and its transport) is created once and reused. Every call goes
+    through a requests-per-minute and a tokens-per-minute token bucket and an
+    adaptive concurrency limit, and transient errors (429/5xx) are retried
+    with jittered exponential backoff, so bursts of work queue up instead of
+    failing on quota errors.
+    """
+    
+    def __init__(self, model_name, rpm=GEMINI_RPM, tpm=GEMINI_TPM,
+                 min_concurrency=GEMINI_MIN_CONCURRENCY, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                 max_retries=GEMINI_MAX_RETRIES, backoff_base=GEMINI_BACKOFF_BASE, backoff_max=GEMINI_BACKOFF_MAX):
+        self.model_name = model_name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial=GENERATION_CONCURRENCY, minimum=min_concurrency, maximum=max_concurrency
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._model = None
+        self._lock = threading.Lock()
+    
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        # Importing the SDK takes about a second, so it is left until the first call
+                        genai = lazy_import("google.generativeai")
+                        genai.configure(api_key=API_KEY)
+                        self._model = genai.GenerativeModel(self.model_name)
+                    except Exception as e:
+                        logger.error(f"Error initializing Gemini model: {str(e)}")
+                        raise Exception(f"Failed to initialize Gemini model: {str(e)}")
+        return self._model
+    
+    def _reserve(self, prompt):
+        """Seconds to wait before the rate limits allow this prompt to be sent"""
+        return max(self.requests.reserve(1), self.tokens.reserve(count_tokens(prompt)))
+    
+    @staticmethod
+    def _record_success(mode, prompt, text, usage):
+        """Count a successful call, preferring the token counts reported by the API"""
+        input_tokens = getattr(usage, "prompt_token_count", None) or count_tokens(prompt)
+        output_tokens = getattr(usage, "candidates_token_count", None) or count_tokens(text)
+        record_model_call(mode, "success", input_tokens, output_tokens)
+    
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before retrying after error, or None if it should not be retried"""
+        if not isinstance(error, transient_errors()) or attempt >= self.max_retries:
+            return None
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+        logger.warning(f"Gemini call failed ({error}), retrying in {delay:.1f}s")
+        return delay
+    
+    def generate(self, prompt, generation_config=None):
+        """
+        Generate a response, waiting for quota and retrying transient errors
+        
+        Args:
+            prompt (str): Prompt to send to the model
+            generation_config (GenerationConfig): Optional generation settings (e.g. a response schema)
+            
+        Returns:
+            str: Response text
+        """
+        attempt = 0
+        while True:
+            with span("gemini_wait"):
+                time.sleep(self._reserve(prompt))
+                started = self.concurrency.acquire()
+            try:
+                with span("gemini_call"):
+                    response = self.model.generate_content(prompt, generation_config=generation_config)
+                    text = response.text
+            except Exception as e:
+                self.concurrency.release(started, overloaded=isinstance(e, overload_errors()), succeeded=False)
+                delay = self._retry_delay(e, attempt)
+                record_model_call("generate", "error" if delay is None else "retry")
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.concurrency.release(started)
+            self._record_success("generate", prompt, text, getattr(response, "usage_metadata", None))
+            return text
+    
+    def stream(self, prompt, generation_config=None):
+        """
+        Stream a response; errors are only retried before the first chunk arrives
+        
+        Args:
+            prompt (str): Prompt to send to the model
+            generation_config (GenerationConfig): Optional generation settings (e.g. a response schema)
+            
+        Yields:
+            str: Chunks of the response text, in order
+        """
+        attempt = 0
+        while True:
+            with span("gemini_wait"):
+                time.sleep(self._reserve(prompt))
+                started = self.concurrency.acquire()
+            streaming = False
+            chunks = []
+            usage = None
+            call_started = time.perf_counter()
+            try:
+                for chunk in self.model.generate_content(prompt, generation_config=generation_config, stream=True):
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    if chunk.text:
+                        streaming = True
+                        chunks.append(chunk.text)
+                        yield chunk.text
+            except GeneratorExit:
+                self.concurrency.release(started, succeeded=False)
+                record_model_call("stream", "abandoned")
+                raise
+            except Exception as e:
+                self.concurrency.release(started, overloaded=isinstance(e, overload_errors()), succeeded=False)
+                delay = None if streaming else self._retry_delay(e, attempt)
+                record_model_call("stream", "error" if delay is None else "retry")
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.concurrency.release(started)
+            # Time to the last chunk, including time the consumer took between chunks
+            STAGE_SECONDS.labels("gemini_stream").observe(time.perf_counter() - call_started)
+            self._record_success("stream", prompt, "".join(chunks), usage)
+            return
+    
+    async def generate_async(self, prompt, generation_config=None):
+        """
+        Generate a response without blocking the event loop
+        
+        Args:
+            prompt (str): Prompt to send to the model
+            generation_config (GenerationConfig): Optional generation settings (e.g. a response schema)
+            
+        Returns:
+            str: Response text
+        """
+        attempt = 0
+        while True:
+            with span("gemini_wait"):
+                await asyncio.sleep(self._reserve(prompt))
+                started = await self.concurrency.acquire_async()
+            try:
+                with span("gemini_call"):
+                    response = await self.model.generate_content_async(prompt, generation_config=generation_config)
+                    text = response.text
+            except BaseException as e:
+                self.concurrency.release(started, overloaded=isinstance(e, overload_errors()), succeeded=False)
+                delay = self._retry_delay(e, attempt) if isinstance(e, Exception) else None
+                record_model_call("async", "error" if delay is None else "retry")
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.concurrency.release(started)
+            self._record_success("async", prompt, text, getattr(response, "usage_metadata", None))
+            return text
+
+# Shared by every request in this process
+client = GeminiClient(MODEL_NAME)
+
+# Identical generations requested concurrently (e.g. a class uploading the same
+# handout) are run once and shared
+flight = create_single_flight()
 
 def get_gemini_model():
     """
     Get the Gemini model for text generation
     
     Returns:
-        Model: Gemini model instance
+        Model: Shared Gemini model instance
     """
-    try:
-        # Use the Gemini model for text generation
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        return model
-    except Exception as e:
-        logger.error(f"Error initializing Gemini model: {str(e)}")
-        raise Exception(f"Failed to initialize Gemini model: {str(e)}")
+    return client.model
+
+def _map_concurrently(fn, items):
+    """
+    Apply fn to every item using a bounded thread pool
+    
+    Args:
+        fn (callable): Function making one model call
+        items (list): Inputs, one per call
+        
+    Returns:
+        list: Results in the same order as items
+    """
+    if len(items) == 1:
+        return [fn(items[0])]
+    with ThreadPoolExecutor(max_workers=min(GENERATION_CONCURRENCY, len(items))) as executor:
+        return list(executor.map(fn, items))
+
+async def _map_concurrently_async(fn, items):
+    """
+    Await fn for every item, with at most GENERATION_CONCURRENCY calls in flight
+    
+    Args:
+        fn (callable): Coroutine function making one model call
+        items (list): Inputs, one per call
+        
+    Returns:
+        list: Results in the same order as items
+    """
+    semaphore = asyncio.Semaphore(GENERATION_CONCURRENCY)
+    
+    async def bounded(item):
+        async with semaphore:
+            return await fn(item)
+    
+    return await asyncio.gather(*(bounded(item) for item in items))
+
+def _build_summary_prompt(chunk, part, total):
+    """Build the prompt extracting study notes from one part of a long document"""
+    prompt = f"""
+    You are preparing notes that will later be merged into a study reviewer.
+    The following is part {part} of {total} of a longer document.
+    
+    Content:
+    {chunk}
+    
+    Write detailed study notes in Markdown covering everything important in this part:
+    - Key terms with their definitions, exactly as used in the text
+    - Core principles and mechanisms
+    - Short examples, comparisons and code/syntax examples (if applicable)
+    
+    Use headings and bullet points. Do not add an introduction or conclusion.
+    """
+    return prompt
+
+def _summarize_chunk(chunk, part, total):
+    """Extract study notes from one part of a long document"""
+    return client.generate(_build_summary_prompt(chunk, part, total))
+
+def _condense_for_study_guide(text):
+    """
+    Map-reduce a long document down to content that fits in a single prompt
+    
+    Text slightly over the budget is compressed; longer text is split and each
+    chunk is summarised concurrently. If the combined notes are still too long
+    they are condensed again until they fit.
+    
+    Args:
+        text (str): Text extracted from the PDF
+        
+    Returns:
+        str: Text within the prompt budget covering the whole document
+    """
+    while True:
+        chunks = fit_to_budget(text)
+        if len(chunks) == 1:
+            return chunks[0]
+        logger.info(f"Summarising {len(chunks)} chunks")
+        notes = _map_concurrently(
+            lambda item: _summarize_chunk(item[1], item[0], len(chunks)),
+            list(enumerate(chunks, 1)),
+        )
+        text = "\n\n".join(notes)
+
+def build_study_guide_prompt(text):
+    """
+    Build the study guide prompt for the given text
+    
+    Args:
+        text (str): Text extracted from the PDF
+        
+    Returns:
+        str: Prompt to send to the model
+    """
+    # Callers fit long documents to the budget first; this only guards against oversized input
+    if count_tokens(text) > PROMPT_TOKEN_BUDGET:
+        text = compress_text(text, PROMPT_TOKEN_BUDGET)
+        logger.warning("Text compressed to fit within the prompt token budget")
+    
+    prompt = f"""
+    Goal: Design and generate a comprehensive study reviewer on a specified topic.
+    
+    Topic/Content{text}
+    
+    Target Audience Level: Beginner/Student/College Level
+
+    Content Requirements:
+
+    - Define Key Terms: Clearly define all essential terms and concepts related to the topic. Define the terms exactly as they are used in the text.
+    - Provide Examples: Include short, relevant examples to illustrate concepts.
+    - Explain Core Principles: Detail the fundamental ideas and mechanisms of the topic.
+    - Include Comparisons/Contrasts (if applicable): Use tables or bullet points to compare related concepts.
+    - Code/Syntax Examples (if applicable): Provide code snippets or syntax examples using proper formatting and highlighting if the topic involves programming or specific syntax.
+    - Real-World Applications (if applicable): Briefly mention how the topic is used in practice.
+    - Compile a Glossary: Create a dedicated section at the very end listing key terms and their definitions.
+
+    Formatting Guidelines:
+
+    - Use Clear Headings: Structure the reviewer with main headings and subheadings (e.g., using Markdown #, ##, ###).
+    - Use Bullet Points: Ensure liberal use of bullet points (-) for lists, facts, definitions, and key points within sections.
+    -Use Tables: Create tables for comparisons or structured information when appropriate, using standard Markdown syntax for proper rendering.
+    - Format Code: Use code blocks (```language) for any code examples.
+    - Use LaTeX (Optional): Use LaTeX formatting ($...$ or $$...$$) ONLY for mathematical or scientific notation where appropriate, NOT for regular text.
+
+    Style & Tone:
+
+    - Concise: Be direct and to the point, avoiding unnecessary jargon unless defined.
+    - Educational: Focus on explaining concepts clearly for the specified audience level.
+    - Friendly & Academic: Maintain a helpful yet formal and knowledgeable tone.
+    - Structured: Organize the information logically, like a study guide.
+
+    Output Format:
+
+    - Provide the output cleanly formatted in Markdown for easy rendering into HTML.
+    - Make sure every component is properly rendered in Markdown.
+    - Avoid conversational filler at the beginning or end; go straight into the reviewer content.
+
+    Request: Generate the comprehensive reviewer based on the topic, level, content, formatting, and style guidelines provided above.
+    """
+    return prompt
 
 def generate_study_guide(text):
     """
@@ -41,125 +403,468 @@ def generate_study_guide(text):
     Returns:
         str: Generated study guide in Markdown format
     """
+    cache_key = make_cache_key("study_guide", STUDY_GUIDE_PROMPT_VERSION, MODEL_NAME, text)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving study guide from result cache")
+        return cached
+    
     try:
-        model = get_gemini_model()
+        def run():
+            prompt = build_study_guide_prompt(_condense_for_study_guide(text))
+            
+            study_guide = client.generate(prompt)  # Gemini outputs Markdown-like content
+            
+            result_cache.set(cache_key, study_guide)
+            return study_guide
         
-        # Truncate text if too long (Gemini has input token limits)
-        if len(text) > 30000:  # Approximate limit to stay within Gemini's token count
-            text = text[:30000]
-            logger.warning("Text truncated to fit within Gemini's token limit")
+        return flight.do(cache_key, run, lambda: result_cache.get(cache_key))
+    
+    except Exception as e:
+        logger.error(f"Error generating study guide: {str(e)}")
+        raise Exception(f"Failed to generate study guide: {str(e)}")
+
+def stream_study_guide(text):
+    """
+    Generate a study guide using Gemini's streaming API
+    
+    Args:
+        text (str): Text extracted from the PDF
         
-        prompt = f"""
-        Goal: Design and generate a comprehensive study reviewer on a specified topic.
+    Yields:
+        str: Chunks of the study guide in Markdown format, in order
+    """
+    cache_key = make_cache_key("study_guide", STUDY_GUIDE_PROMPT_VERSION, MODEL_NAME, text)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving study guide from result cache")
+        yield cached
+        return
+    
+    try:
+        def run():
+            prompt = build_study_guide_prompt(_condense_for_study_guide(text))
+            
+            chunks = []
+            for chunk in client.stream(prompt):
+                chunks.append(chunk)
+                yield chunk
+            
+            # Only cache complete responses
+            result_cache.set(cache_key, "".join(chunks))
         
-        Topic/Content{text}
+        yield from flight.do_stream(cache_key, run, lambda: result_cache.get(cache_key))
+    
+    except Exception as e:
+        logger.error(f"Error streaming study guide: {str(e)}")
+        raise Exception(f"Failed to generate study guide: {str(e)}")
+
+# Structured output schema of quiz responses: a JSON array of questions
+QUIZ_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "options": {"type": "array", "items": {"type": "string"}},
+            "answer": {"type": "string"},
+        },
+        "required": ["question", "options", "answer"],
+    },
+}
+
+# A plain dict, which the SDK accepts in place of a GenerationConfig, so it need not be imported here
+QUIZ_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": QUIZ_SCHEMA}
+
+def build_quiz_prompt(text, num_questions, exclude=()):
+    """
+    Build the quiz prompt for the given text
+    
+    Args:
+        text (str): Text extracted from the PDF
+        num_questions (int): Number of questions to generate
+        exclude (list): Questions already asked, which must not be repeated
         
-        Target Audience Level: Beginner/Student/College Level
+    Returns:
+        str: Prompt to send to the model
+    """
+    prompt = f"""
+    Create a multiple-choice quiz with {num_questions} questions based on the following content:
+    
+    {text}
+    
+    Return the quiz as a JSON array of questions, each with:
+    - "question": the question text
+    - "options": exactly 4 distinct options
+    - "answer": the correct option, copied verbatim from "options"
+    
+    Make sure questions test key concepts and important information from the content.
+    Ensure each question has 4 options and exactly one correct answer.
+    The questions should vary in difficulty level.
+    """
+    if exclude:
+        asked = "\n".join(f"    - {question}" for question in exclude)
+        prompt += f"""
+    Do not repeat or rephrase any of these questions, which have already been asked:
+{asked}
+    """
+    return prompt
 
-        Content Requirements:
+def iter_json_objects(chunks):
+    """
+    Incrementally parse the objects of a streamed JSON array
+    
+    Each top-level object is decoded as soon as its closing brace arrives, so
+    questions can be used before the response is complete and a malformed
+    question only loses itself rather than the whole response.
+    
+    Args:
+        chunks (iterable): Pieces of the response text, in order
+        
+    Yields:
+        The decoded object, or None for an object that is not valid JSON
+    """
+    buffer = []
+    depth = 0
+    in_string = False
+    escaped = False
+    for chunk in chunks:
+        for char in chunk:
+            if depth:
+                buffer.append(char)
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                if depth == 0:
+                    buffer = ["{"]
+                depth += 1
+            elif char == "}" and depth:
+                depth -= 1
+                if depth == 0:
+                    try:
+                        yield json.loads("".join(buffer))
+                    except json.JSONDecodeError:
+                        yield None
 
-        - Define Key Terms: Clearly define all essential terms and concepts related to the topic. Define the terms exactly as they are used in the text.
-        - Provide Examples: Include short, relevant examples to illustrate concepts.
-        - Explain Core Principles: Detail the fundamental ideas and mechanisms of the topic.
-        - Include Comparisons/Contrasts (if applicable): Use tables or bullet points to compare related concepts.
-        - Code/Syntax Examples (if applicable): Provide code snippets or syntax examples using proper formatting and highlighting if the topic involves programming or specific syntax.
-        - Real-World Applications (if applicable): Briefly mention how the topic is used in practice.
-        - Compile a Glossary: Create a dedicated section at the very end listing key terms and their definitions.
+def validate_question(question):
+    """
+    Check one quiz question and normalise it
+    
+    Args:
+        question: Decoded question object
+        
+    Returns:
+        dict: The question with stripped text and an answer matching one of its
+        options, or None if it is unusable
+    """
+    if not isinstance(question, dict):
+        return None
+    text = question.get("question")
+    options = question.get("options")
+    answer = question.get("answer")
+    if not isinstance(text, str) or not text.strip() or not isinstance(options, list) or not isinstance(answer, str):
+        return None
+    
+    options = [option.strip() for option in options if isinstance(option, str) and option.strip()]
+    if len(options) < 2 or len(set(options)) != len(options):
+        return None
+    
+    answer = answer.strip()
+    if answer not in options:
+        matches = [option for option in options if option.lower() == answer.lower()]
+        if len(matches) != 1:
+            return None
+        answer = matches[0]
+    return {"question": text.strip(), "options": options, "answer": answer}
 
-        Formatting Guidelines:
+def _plan_quiz(chunks, num_questions):
+    """
+    Spread a quiz's questions over the chunks of a document
+    
+    The questions are placed at even intervals through the text, so each
+    chunk gets a share in proportion to its length and no more than
+    num_questions chunks are asked at all. Each chunk asked gets one spare
+    question to absorb duplicates.
+    
+    Args:
+        chunks (list): Pieces of the document, in order (see fit_to_budget)
+        num_questions (int): Questions of the quiz
+        
+    Returns:
+        list: (chunk, number of questions to ask of it) pairs, in document order
+    """
+    if len(chunks) == 1:
+        return [(chunks[0], num_questions)]
+    ends = []
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        ends.append(total)
+    counts = [0] * len(chunks)
+    for i in range(num_questions):
+        counts[bisect.bisect_right(ends, (i + 0.5) * total / num_questions)] += 1
+    return [(chunk, count + 1) for chunk, count in zip(chunks, counts) if count]
+
+def _question_key(question):
+    """Normalise question text so near-identical questions compare equal"""
+    return re.sub(r"[^a-z0-9]+", " ", question["question"].lower()).strip()
+
+class QuizCollector:
+    """
+    Gathers valid, distinct questions for one chunk over several attempts
+    
+    Only the questions still missing after an attempt (because the response
+    was cut short, or some questions were invalid or repeated) are requested
+    again. Questions in exclude (e.g. those already in the quiz) are never
+    accepted.
+    """
+    
+    def __init__(self, chunk, count, exclude=()):
+        self.chunk = chunk
+        self.count = count
+        self.exclude = list(exclude)
+        self.questions = []
+        self.seen = {_question_key({"question": question}) for question in self.exclude}
+        self.invalid = 0
+        self.attempts = 0
+    
+    @property
+    def missing(self):
+        return self.count - len(self.questions)
+    
+    def next_prompt(self):
+        """Prompt requesting the missing questions, or None when done or out of attempts"""
+        if self.missing <= 0 or self.attempts >= QUIZ_MAX_ATTEMPTS:
+            return None
+        if self.attempts:
+            logger.info(f"Re-requesting {self.missing} missing quiz questions")
+        self.attempts += 1
+        asked = self.exclude + [question["question"] for question in self.questions]
+        return build_quiz_prompt(self.chunk, self.missing, exclude=asked)
+    
+    def feed(self, chunks):
+        """
+        Parse a response as it arrives
+        
+        Args:
+            chunks (iterable): Pieces of the response text, in order
+            
+        Yields:
+            dict: Each new valid question, as soon as it is complete
+        """
+        for question in iter_json_objects(chunks):
+            question = validate_question(question)
+            if question is None:
+                self.invalid += 1
+                continue
+            key = _question_key(question)
+            if key in self.seen or self.missing <= 0:
+                continue
+            self.seen.add(key)
+            self.questions.append(question)
+            yield question
 
-        - Use Clear Headings: Structure the reviewer with main headings and subheadings (e.g., using Markdown #, ##, ###).
-        - Use Bullet Points: Ensure liberal use of bullet points (-) for lists, facts, definitions, and key points within sections.
-        -Use Tables: Create tables for comparisons or structured information when appropriate, using standard Markdown syntax for proper rendering.
-        - Format Code: Use code blocks (```language) for any code examples.
-        - Use LaTeX (Optional): Use LaTeX formatting ($...$ or $$...$$) ONLY for mathematical or scientific notation where appropriate, NOT for regular text.
+def _generate_chunk_questions(chunk, count, on_question=None, exclude=()):
+    """Stream questions for one chunk, re-requesting any that are missing"""
+    collector = QuizCollector(chunk, count, exclude)
+    while True:
+        prompt = collector.next_prompt()
+        if prompt is None:
+            break
+        for question in collector.feed(client.stream(prompt, generation_config=QUIZ_GENERATION_CONFIG)):
+            if on_question is not None:
+                on_question(question)
+    if collector.invalid:
+        logger.warning(f"Dropped {collector.invalid} invalid quiz questions")
+    return collector.questions
 
-        Style & Tone:
+async def _generate_chunk_questions_async(chunk, count, exclude=()):
+    """Generate questions for one chunk, re-requesting any that are missing"""
+    collector = QuizCollector(chunk, count, exclude)
+    while True:
+        prompt = collector.next_prompt()
+        if prompt is None:
+            break
+        response_text = await client.generate_async(prompt, generation_config=QUIZ_GENERATION_CONFIG)
+        for _ in collector.feed([response_text]):
+            pass
+    if collector.invalid:
+        logger.warning(f"Dropped {collector.invalid} invalid quiz questions")
+    return collector.questions
 
-        - Concise: Be direct and to the point, avoiding unnecessary jargon unless defined.
-        - Educational: Focus on explaining concepts clearly for the specified audience level.
-        - Friendly & Academic: Maintain a helpful yet formal and knowledgeable tone.
-        - Structured: Organize the information logically, like a study guide.
+def _finish_quiz(question_lists, num_questions):
+    """Merge the per-chunk questions, failing only if none are usable"""
+    quiz_data = merge_quiz_questions(question_lists, num_questions)
+    if not quiz_data:
+        raise Exception("Failed to generate a valid quiz. Please try again.")
+    if len(quiz_data) < num_questions:
+        logger.warning(f"Only {len(quiz_data)} of {num_questions} quiz questions could be generated")
+    return quiz_data
 
-        Output Format:
+def merge_quiz_questions(question_lists, num_questions):
+    """
+    Merge per-chunk quizzes into one, dropping duplicate questions
+    
+    When there are more questions than needed, questions are picked evenly
+    across the document so the quiz covers all of it.
+    
+    Args:
+        question_lists (list): Lists of questions, in document order
+        num_questions (int): Number of questions wanted
+        
+    Returns:
+        list: Merged quiz questions
+    """
+    seen = set()
+    questions = []
+    for question_list in question_lists:
+        for question in question_list:
+            key = _question_key(question)
+            if key in seen:
+                continue
+            seen.add(key)
+            questions.append(question)
+    
+    if len(questions) <= num_questions:
+        return questions
+    step = len(questions) / num_questions
+    return [questions[int(i * step)] for i in range(num_questions)]
 
-        - Provide the output cleanly formatted in Markdown for easy rendering into HTML.
-        - Make sure every component is properly rendered in Markdown.
-        - Avoid conversational filler at the beginning or end; go straight into the reviewer content.
+def generate_quiz(text, num_questions=5, on_question=None, exclude=()):
+    """
+    Generate a quiz from the given text using Gemini API
+    
+    The model is constrained to the quiz JSON schema and its response is
+    parsed while it streams, so each question is available as soon as it is
+    complete.
+    
+    Args:
+        text (str): Text extracted from the PDF
+        num_questions (int): Number of questions to generate
+        on_question (callable): Called with each valid question as it arrives
+        exclude (list): Questions already asked, which must not be repeated
+        
+    Returns:
+        str: Generated quiz in JSON format
+    """
+    cache_key = make_cache_key("quiz", QUIZ_PROMPT_VERSION, MODEL_NAME, text,
+                               num_questions=num_questions, exclude=list(exclude))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving quiz from result cache")
+        return cached
+    
+    try:
+        def run():
+            chunks = fit_to_budget(text)
+            plan = _plan_quiz(chunks, num_questions)
+            
+            def generate_for_chunk(item):
+                chunk, count = item
+                return _generate_chunk_questions(chunk, count, on_question, exclude)
+            
+            if len(chunks) > 1:
+                logger.info(f"Generating quiz questions from {len(plan)} of {len(chunks)} chunks")
+            quiz_data = _finish_quiz(_map_concurrently(generate_for_chunk, plan), num_questions)
+            
+            quiz_text = json.dumps(quiz_data)
+            result_cache.set(cache_key, quiz_text)
+            return quiz_text
+        
+        # Callers coalesced with another request only see on_question calls for
+        # that request's questions, and get the finished quiz
+        return flight.do(cache_key, run, lambda: result_cache.get(cache_key))
+    
+    except Exception as e:
+        logger.error(f"Error generating quiz: {str(e)}")
+        raise Exception(f"Failed to generate quiz: {str(e)}")
 
-        Request: Generate the comprehensive reviewer based on the topic, level, content, formatting, and style guidelines provided above.
-        """
+async def generate_study_guide_async(text):
+    """
+    Generate a study guide without blocking the event loop (async serving mode)
+    
+    Args:
+        text (str): Text extracted from the PDF
         
-        response = model.generate_content(prompt)
-        study_guide = response.text  # Gemini outputs Markdown-like content
+    Returns:
+        str: Generated study guide in Markdown format
+    """
+    cache_key = make_cache_key("study_guide", STUDY_GUIDE_PROMPT_VERSION, MODEL_NAME, text)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving study guide from result cache")
+        return cached
+    
+    try:
+        async def run():
+            content = text
+            # Compress or map-reduce long documents down to content that fits in a single prompt
+            while True:
+                chunks = fit_to_budget(content)
+                if len(chunks) == 1:
+                    content = chunks[0]
+                    break
+                logger.info(f"Summarising {len(chunks)} chunks")
+                
+                async def summarize(item):
+                    part, chunk = item
+                    return await client.generate_async(_build_summary_prompt(chunk, part, len(chunks)))
+                
+                content = "\n\n".join(await _map_concurrently_async(summarize, list(enumerate(chunks, 1))))
+            
+            study_guide = await client.generate_async(build_study_guide_prompt(content))
+            
+            result_cache.set(cache_key, study_guide)
+            return study_guide
         
-        return study_guide
+        return await flight.do_async(cache_key, run, lambda: result_cache.get(cache_key))
     
     except Exception as e:
         logger.error(f"Error generating study guide: {str(e)}")
         raise Exception(f"Failed to generate study guide: {str(e)}")
 
-def generate_quiz(text, num_questions=5):
+async def generate_quiz_async(text, num_questions=5, exclude=()):
     """
-    Generate a quiz from the given text using Gemini API
+    Generate a quiz without blocking the event loop (async serving mode)
     
     Args:
         text (str): Text extracted from the PDF
         num_questions (int): Number of questions to generate
+        exclude (list): Questions already asked, which must not be repeated
         
     Returns:
         str: Generated quiz in JSON format
     """
+    cache_key = make_cache_key("quiz", QUIZ_PROMPT_VERSION, MODEL_NAME, text,
+                               num_questions=num_questions, exclude=list(exclude))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving quiz from result cache")
+        return cached
+    
     try:
-        model = get_gemini_model()
-        
-        # Truncate text if too long (Gemini has input token limits)
-        if len(text) > 30000:  # Approximate limit to stay within Gemini's token count
-            text = text[:30000]
-            logger.warning("Text truncated to fit within Gemini's token limit")
-        
-        prompt = f"""
-        Create a multiple-choice quiz with {num_questions} questions based on the following content:
-        
-        {text}
-        
-        Return the quiz in the following JSON format:
-        [
-            {{
-                "question": "Question text here",
-                "options": ["Option A", "Option B", "Option C", "Option D"],
-                "answer": "The correct option (verbatim text of the answer)"
-            }},
-            // more questions...
-        ]
-        
-        Make sure questions test key concepts and important information from the content.
-        Ensure each question has 4 options and exactly one correct answer.
-        The questions should vary in difficulty level.
-        """
-        
-        response = model.generate_content(prompt)
-        quiz_text = response.text
-        
-        # Extract the JSON from the response
-        # Sometimes the model includes markdown code blocks or other text
-        if "```json" in quiz_text:
-            quiz_text = quiz_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in quiz_text:
-            quiz_text = quiz_text.split("```")[1].split("```")[0].strip()
-        
-        # Validate JSON format
-        try:
-            quiz_data = json.loads(quiz_text)
-            # Ensure it's a valid quiz format
-            for question in quiz_data:
-                if not all(key in question for key in ["question", "options", "answer"]):
-                    raise ValueError("Invalid quiz format")
+        async def run():
+            plan = _plan_quiz(fit_to_budget(text), num_questions)
+            
+            async def generate_for_chunk(item):
+                chunk, count = item
+                return await _generate_chunk_questions_async(chunk, count, exclude)
+            
+            quiz_data = _finish_quiz(await _map_concurrently_async(generate_for_chunk, plan), num_questions)
+            
+            quiz_text = json.dumps(quiz_data)
+            result_cache.set(cache_key, quiz_text)
             return quiz_text
-        except json.JSONDecodeError:
-            logger.error("Failed to parse JSON from Gemini response")
-            raise Exception("Failed to generate a valid quiz. Please try again.")
+        
+        return await flight.do_async(cache_key, run, lambda: result_cache.get(cache_key))
     
     except Exception as e:
         logger.error(f"Error generating quiz: {str(e)}")
-        raise Exception(f"Failed to generate quiz: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Failed to generate quiz: {str(e)}")
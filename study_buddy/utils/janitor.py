@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from . import document_store
+from .storage import BLOB_POLICIES
+from ..models import utcnow
+
+logger = logging.getLogger(__name__)
+
+# Janitor configuration (can be overridden with environment variables)
+JANITOR_INTERVAL_SECONDS = int(os.environ.get("JANITOR_INTERVAL", 600))
+DOCUMENT_TTL_SECONDS = int(os.environ.get("DOCUMENT_TTL", 7 * 24 * 3600))
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL", 24 * 3600))
+# Single-flight lock files of generations not requested for this long are deleted
+LOCK_TTL_SECONDS = 24 * 3600
+
+
+class StorageJanitor:
+    """
+    Background thread keeping stored state within its age and size limits
+
+    Every sweep, on each host:
+
+    - uploads and rendered artifacts unused for longer than their TTL are
+      deleted, then the least recently used ones until each namespace fits
+      its quota (see storage.BLOB_POLICIES);
+    - session files not written for SESSION_TTL, and stale single-flight lock
+      files, are deleted.
+
+    Once per sweep across all hosts, documents not uploaded or generated from
+    for DOCUMENT_TTL are deleted with their study guides, quizzes, upload and
+    artifacts, and so are batches older than DOCUMENT_TTL with their archives.
+
+    Every worker process runs a janitor thread, but each sweep is claimed by
+    one process only.
+    """
+
+    def __init__(self, app, blob_store, locks, session_dir=None, interval=JANITOR_INTERVAL_SECONDS):
+        self.app = app
+        self.blob_store = blob_store
+        self.locks = locks
+        self.session_dir = session_dir
+        self.interval = interval
+        self.last_sweep = None
+
+    def start(self):
+        threading.Thread(target=self._run, name="storage-janitor", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Storage sweep failed: {str(e)}")
+            time.sleep(self.interval)
+
+    def sweep(self, force=False):
+        """
+        Run one sweep, unless another process has run it within the interval
+
+        Args:
+            force (bool): Sweep even if another process swept recently
+
+        Returns:
+            dict: Number of files and documents deleted, or None if the sweep was skipped
+        """
+        removed = {}
+        if force or self.blob_store.claim("janitor-local", self.interval, local=True):
+            for namespace, (ttl_seconds, max_bytes) in BLOB_POLICIES.items():
+                removed[namespace] = self.blob_store.sweep(namespace, ttl_seconds, max_bytes)
+            if self.session_dir:
+                removed["sessions"] = self._sweep_sessions()
+            removed["locks"] = self.locks.sweep(LOCK_TTL_SECONDS)
+
+        if force or self.blob_store.claim("janitor", self.interval):
+            removed["documents"] = self._delete_unused_documents()
+            removed["batches"] = self._delete_old_batches()
+
+        if not removed:
+            return None
+        self.last_sweep = {"finished_at": time.time(), "removed": removed}
+        if any(removed.values()):
+            logger.info(f"Storage sweep removed {removed}")
+        return removed
+
+    def _sweep_sessions(self):
+        """Delete session files not written for SESSION_TTL"""
+        cutoff = time.time() - SESSION_TTL_SECONDS
+        removed = 0
+        with os.scandir(self.session_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def _delete_unused_documents(self):
+        with self.app.app_context():
+            content_hashes, artifact_ids = document_store.delete_unused_documents(
+                utcnow() - timedelta(seconds=DOCUMENT_TTL_SECONDS)
+            )
+        for content_hash in content_hashes:
+            self.blob_store.delete_owned("uploads", content_hash)
+        for artifact_id in artifact_ids:
+            self.blob_store.delete_owned("artifacts", artifact_id)
+        return len(content_hashes)
+
+    def _delete_old_batches(self):
+        with self.app.app_context():
+            batch_ids, content_hashes = document_store.delete_old_batches(
+                utcnow() - timedelta(seconds=DOCUMENT_TTL_SECONDS)
+            )
+        for content_hash in content_hashes:
+            self.blob_store.delete_owned("uploads", content_hash)
+        for batch_id in batch_ids:
+            self.blob_store.delete_owned("artifacts", batch_id)
+        return len(batch_ids)
+
+    def usage(self):
+        """
+        Current storage usage, for monitoring
+
+        Returns:
+            dict: Files and bytes stored on this host and the quota of each
+            namespace, the number of stored documents, and the last sweep's results
+        """
+        usage = {}
+        for namespace, (ttl_seconds, max_bytes) in BLOB_POLICIES.items():
+            usage[namespace] = dict(self.blob_store.usage(namespace), quota_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        if self.session_dir:
+            usage["sessions"] = {"files": sum(1 for _ in os.scandir(self.session_dir)),
+                                 "ttl_seconds": SESSION_TTL_SECONDS}
+        with self.app.app_context():
+            usage["documents"] = {"count": document_store.count_documents(), "ttl_seconds": DOCUMENT_TTL_SECONDS}
+        usage["last_sweep"] = self.last_sweep
+        return usage
@@ -0,0 +1,624 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import closing, nullcontext
+
+from .metrics import JOB_WAIT_SECONDS, span
+from .storage import REDIS_KEY_PREFIX, get_redis
+
+logger = logging.getLogger(__name__)
+
+# Job queue configuration (can be overridden with environment variables)
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "thread")  # "thread", "sqlite" or "redis"
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "study_buddy_jobs.sqlite3"))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION", 3600))
+# A running job of a shared queue whose worker process has not renewed its lease for this long
+# (killed by a timeout, a restart or the OOM killer) is failed
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE", 60))
+
+# Error of a job whose lease expired
+LEASE_EXPIRED_ERROR = "The worker running this job stopped. Please try again."
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Job priorities; lower values run first. Jobs of the same priority run in
+# order of rank: their submission time, unless submit() is given one (the
+# admission controller's fair-queueing order)
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 10
+
+
+class JobCancelled(Exception):
+    """Raised by a job's progress callable once the job has been cancelled"""
+
+
+# Registry of task functions, by name. Jobs refer to tasks by name so that
+# they can be picked up by any process sharing the queue.
+_tasks = {}
+
+
+def task(name):
+    """
+    Register a function as a background task
+
+    The function is called with the job's keyword arguments plus a
+    ``progress`` callable that accepts a short status message. Cancellation
+    is cooperative: once a running job is cancelled, its next ``progress``
+    call raises JobCancelled, so tasks should report progress before doing
+    anything with side effects. The return value must be JSON serialisable.
+
+    Args:
+        name (str): Name used to submit jobs for this task
+    """
+    def decorator(fn):
+        _tasks[name] = fn
+        return fn
+    return decorator
+
+
+def _run_task(app, name, kwargs, progress, created):
+    fn = _tasks.get(name)
+    if fn is None:
+        raise Exception(f"Unknown task: {name}")
+    JOB_WAIT_SECONDS.labels(name).observe(max(0.0, time.time() - created))
+    with span(f"job_{name}"), app.app_context() if app is not None else nullcontext():
+        return fn(progress=progress, **kwargs)
+
+
+class _WorkerPool:
+    """
+    Worker threads of a job backend
+
+    They are started separately from the backend, so that a process can
+    create the queue and then fork (gunicorn --preload) before any exist.
+
+    Backends shared between processes lease the jobs they claim: a thread
+    renews the leases of the jobs this process is running, and fails the
+    running jobs of any process that stopped renewing its own.
+    """
+
+    leased = False
+
+    def start(self, app=None):
+        """
+        Start this process's worker threads
+
+        Args:
+            app (Flask): App whose context tasks run in
+        """
+        self.app = app
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._running = set()  # Jobs this process is running, whose leases it renews
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"job-{i}", daemon=True).start()
+        if self.leased:
+            threading.Thread(target=self._keep_leases, name="job-leases", daemon=True).start()
+
+    def _keep_leases(self):
+        while True:
+            try:
+                self._renew_leases(list(self._running))
+                expired = self._expire_leases()
+                if expired:
+                    logger.warning(f"Failed {expired} job(s) whose worker stopped renewing their lease")
+            except Exception as e:
+                logger.warning(f"Could not renew job leases: {str(e)}")
+            time.sleep(JOB_LEASE_SECONDS / 3)
+
+
+class ThreadJobBackend(_WorkerPool):
+    """In-process job queue served by a pool of worker threads in priority order"""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self.app = None
+        self._jobs = {}
+        self._queue = []  # Heap of (priority, rank, sequence, job ID); stale entries are skipped
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def submit(self, name, priority=PRIORITY_HIGH, rank=None, **kwargs):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        rank = now if rank is None else rank
+        with self._lock:
+            self._prune(now)
+            self._jobs[job_id] = {
+                "id": job_id, "name": name, "status": QUEUED, "progress": None,
+                "result": None, "error": None, "created": now, "updated": now,
+                "priority": priority, "rank": rank, "cancel_requested": False, "kwargs": kwargs,
+            }
+            heapq.heappush(self._queue, (priority, rank, next(self._sequence), job_id))
+            self._available.notify()
+        return job_id
+
+    def promote(self, job_id, priority=PRIORITY_HIGH):
+        """Move a queued job ahead of lower-priority jobs"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == QUEUED and priority < job["priority"]:
+                job["priority"] = priority
+                heapq.heappush(self._queue, (priority, job["rank"], next(self._sequence), job_id))
+
+    def cancel(self, job_id):
+        """Cancel a job: queued jobs never run, running jobs stop at their next progress report"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] in (FINISHED, FAILED, CANCELLED):
+                return
+            if job["status"] == QUEUED:
+                job.update(status=CANCELLED, updated=time.time())
+            else:
+                job["cancel_requested"] = True
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated=time.time())
+
+    def _progress(self, job_id, message):
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["cancel_requested"]:
+                raise JobCancelled()
+            job.update(progress=message, updated=time.time())
+
+    def _next_job(self):
+        """Block until a queued job is available and mark it running"""
+        with self._lock:
+            while True:
+                while not self._queue:
+                    self._available.wait()
+                priority, _, _, job_id = heapq.heappop(self._queue)
+                job = self._jobs.get(job_id)
+                if job is not None and job["status"] == QUEUED and job["priority"] == priority:
+                    job.update(status=RUNNING, updated=time.time())
+                    return job_id, job["name"], job.pop("kwargs"), job["created"]
+
+    def _worker(self):
+        while True:
+            job_id, name, kwargs, created = self._next_job()
+            try:
+                result = _run_task(self.app, name, kwargs, lambda message: self._progress(job_id, message), created)
+                self._update(job_id, status=FINISHED, result=result)
+            except Exception as e:
+                if self._jobs[job_id]["cancel_requested"]:
+                    logger.info(f"Job {job_id} ({name}) cancelled")
+                    self._update(job_id, status=CANCELLED)
+                else:
+                    logger.error(f"Job {job_id} ({name}) failed: {str(e)}")
+                    self._update(job_id, status=FAILED, error=str(e))
+
+    def _prune(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] in (FINISHED, FAILED, CANCELLED) and now - job["updated"] > JOB_RETENTION_SECONDS]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def counts(self):
+        """Number of queued and running jobs"""
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+        return {QUEUED: statuses.count(QUEUED), RUNNING: statuses.count(RUNNING)}
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            job.pop("kwargs", None)
+            return job
+
+
+class SqliteJobBackend(_WorkerPool):
+    """
+    Job queue stored in a SQLite database shared by every worker process.
+
+    Each process runs its own pool of worker threads that claim queued jobs,
+    so a job submitted through one gunicorn worker can be executed and polled
+    through any other. A claimed job records its process and the time of its
+    last heartbeat.
+    """
+
+    POLL_INTERVAL = 0.5
+    leased = True
+
+    def __init__(self, db_path=JOB_DB_PATH, workers=JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self.app = None
+        self._wakeup = threading.Event()
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    rank REAL,
+                    claimed_by TEXT,
+                    heartbeat REAL
+                )
+            """)
+            # Queues created before priorities, cancellation, ranks and leases existed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "priority" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "cancel_requested" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+            if "rank" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN rank REAL")
+                conn.execute("UPDATE jobs SET rank = created")
+            if "claimed_by" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN claimed_by TEXT")
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            conn.execute("DROP INDEX IF EXISTS jobs_status")
+            conn.execute("DROP INDEX IF EXISTS jobs_queue")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_ranked_queue ON jobs (status, priority, rank)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, name, priority=PRIORITY_HIGH, rank=None, **kwargs):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, name, payload, status, created, updated, priority, rank)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, name, json.dumps(kwargs), QUEUED, now, now, priority, now if rank is None else rank),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated < ?",
+                (FINISHED, FAILED, CANCELLED, now - JOB_RETENTION_SECONDS),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def promote(self, job_id, priority=PRIORITY_HIGH):
+        """Move a queued job ahead of lower-priority jobs"""
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET priority = ? WHERE id = ? AND status = ? AND priority > ?",
+                         (priority, job_id, QUEUED, priority))
+
+    def cancel(self, job_id):
+        """Cancel a job: queued jobs never run, running jobs stop at their next progress report"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+                         (CANCELLED, now, job_id, QUEUED))
+            conn.execute("UPDATE jobs SET cancel_requested = 1, updated = ? WHERE id = ? AND status = ?",
+                         (now, job_id, RUNNING))
+
+    def _cancel_requested(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def _progress(self, job_id, message):
+        if self._cancel_requested(job_id):
+            raise JobCancelled()
+        self._update(job_id, progress=message)
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self, conn):
+        """Atomically move the first queued job to the running state"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, name, payload, created FROM jobs WHERE status = ? ORDER BY priority, rank LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute("UPDATE jobs SET status = ?, updated = ?, claimed_by = ?, heartbeat = ? WHERE id = ?",
+                             (RUNNING, now, self.worker_id, now, row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is not None:
+            self._running.add(row["id"])
+        return row
+
+    def _worker(self):
+        conn = self._connect()
+        while True:
+            try:
+                row = self._claim(conn)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not claim job: {str(e)}")
+                row = None
+
+            if row is None:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            job_id, name = row["id"], row["name"]
+            try:
+                result = _run_task(self.app, name, json.loads(row["payload"]),
+                                   lambda message: self._progress(job_id, message), row["created"])
+                self._update(job_id, status=FINISHED, result=json.dumps(result))
+            except Exception as e:
+                if self._cancel_requested(job_id):
+                    logger.info(f"Job {job_id} ({name}) cancelled")
+                    self._update(job_id, status=CANCELLED)
+                else:
+                    logger.error(f"Job {job_id} ({name}) failed: {str(e)}")
+                    self._update(job_id, status=FAILED, error=str(e))
+            finally:
+                self._running.discard(job_id)
+
+    def _renew_leases(self, job_ids):
+        if not job_ids:
+            return
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE jobs SET heartbeat = ? WHERE status = ? AND id IN ({', '.join('?' * len(job_ids))})",
+                         (time.time(), RUNNING, *job_ids))
+
+    def _expire_leases(self):
+        """Fail the running jobs whose lease expired, returning how many"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # Jobs claimed before leases existed have no heartbeat; their last update stands in for it
+            return conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status = ? AND COALESCE(heartbeat, updated) < ?",
+                (FAILED, LEASE_EXPIRED_ERROR, now, RUNNING, now - JOB_LEASE_SECONDS),
+            ).rowcount
+
+    def counts(self):
+        """Number of queued and running jobs"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs WHERE status IN (?, ?) GROUP BY status",
+                                (QUEUED, RUNNING)).fetchall()
+        counts = {QUEUED: 0, RUNNING: 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job.pop("payload")
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+
+class RedisJobBackend(_WorkerPool):
+    """
+    Job queue stored in Redis, shared by every worker process on every node.
+
+    Jobs are hashes; queued job IDs sit in a sorted set ordered by priority,
+    then rank. Claiming a job pops it from the set and cancelling
+    a queued job removes it, so exactly one of the two wins. Running job IDs
+    sit in a second sorted set scored by their last heartbeat; claiming a job
+    moves it from one set to the other in a single script.
+    """
+
+    POLL_INTERVAL = 0.5
+    leased = True
+
+    # KEYS: queue, leases; ARGV: job key prefix, now, worker ID
+    CLAIM_SCRIPT = """
+        local popped = redis.call('ZPOPMIN', KEYS[1])
+        if #popped == 0 then
+            return false
+        end
+        local job_id = popped[1]
+        local key = ARGV[1] .. job_id
+        redis.call('HSET', key, 'status', 'running', 'updated', ARGV[2], 'claimed_by', ARGV[3])
+        redis.call('ZADD', KEYS[2], ARGV[2], job_id)
+        local job = redis.call('HMGET', key, 'name', 'payload', 'created')
+        return {job_id, job[1], job[2], job[3]}
+    """
+
+    # KEYS: leases; ARGV: job key prefix, now, heartbeat deadline, error, retention
+    EXPIRE_SCRIPT = """
+        local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[3])
+        for _, job_id in ipairs(expired) do
+            redis.call('ZREM', KEYS[1], job_id)
+            local key = ARGV[1] .. job_id
+            if redis.call('HGET', key, 'status') == 'running' then
+                redis.call('HSET', key, 'status', 'failed', 'error', ARGV[4], 'updated', ARGV[2])
+                redis.call('EXPIRE', key, ARGV[5])
+            end
+        end
+        return #expired
+    """
+
+    def __init__(self, client, workers=JOB_WORKERS):
+        self.client = client
+        self.workers = workers
+        self.app = None
+        self._queue_key = f"{REDIS_KEY_PREFIX}jobs:queue"
+        self._leases_key = f"{REDIS_KEY_PREFIX}jobs:leases"
+        self._wakeup = threading.Event()
+        self._claim_script = client.register_script(self.CLAIM_SCRIPT)
+        self._expire_script = client.register_script(self.EXPIRE_SCRIPT)
+
+    def _key(self, job_id):
+        return f"{REDIS_KEY_PREFIX}jobs:{job_id}"
+
+    @staticmethod
+    def _score(priority, rank):
+        # Sorted set score: priority first, then rank
+        return priority * 1e10 + rank
+
+    def submit(self, name, priority=PRIORITY_HIGH, rank=None, **kwargs):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        rank = now if rank is None else rank
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(job_id), mapping={
+            "name": name, "payload": json.dumps(kwargs), "status": QUEUED,
+            "created": now, "updated": now, "priority": priority, "rank": rank, "cancel_requested": 0,
+        })
+        pipe.zadd(self._queue_key, {job_id: self._score(priority, rank)})
+        pipe.execute()
+        self._wakeup.set()
+        return job_id
+
+    def promote(self, job_id, priority=PRIORITY_HIGH):
+        """Move a queued job ahead of lower-priority jobs"""
+        created, current, rank = self.client.hmget(self._key(job_id), "created", "priority", "rank")
+        if created is None or int(current) <= priority:
+            return
+        # xx: only reorders the job if it has not been claimed meanwhile
+        rank = float(rank if rank is not None else created)
+        if self.client.zadd(self._queue_key, {job_id: self._score(priority, rank)}, xx=True, ch=True):
+            self.client.hset(self._key(job_id), "priority", priority)
+
+    def cancel(self, job_id):
+        """Cancel a job: queued jobs never run, running jobs stop at their next progress report"""
+        if self.client.zrem(self._queue_key, job_id):
+            self._update(job_id, status=CANCELLED)
+            return
+        status = self.client.hget(self._key(job_id), "status")
+        if status is not None and status.decode() in (QUEUED, RUNNING):
+            # Queued here means a worker has just claimed it
+            self._update(job_id, cancel_requested=1)
+
+    def _cancel_requested(self, job_id):
+        return self.client.hget(self._key(job_id), "cancel_requested") == b"1"
+
+    def _progress(self, job_id, message):
+        if self._cancel_requested(job_id):
+            raise JobCancelled()
+        self._update(job_id, progress=message)
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(job_id), mapping=fields)
+        if fields.get("status") in (FINISHED, FAILED, CANCELLED):
+            pipe.expire(self._key(job_id), JOB_RETENTION_SECONDS)
+        pipe.execute()
+
+    def _claim(self):
+        """Atomically pop the first queued job, mark it running and lease it"""
+        claimed = self._claim_script(keys=[self._queue_key, self._leases_key],
+                                     args=[self._key(""), time.time(), self.worker_id])
+        if not claimed:
+            return None
+        job_id, name, payload, created = claimed
+        job_id = job_id.decode()
+        self._running.add(job_id)
+        return job_id, name.decode(), json.loads(payload), float(created)
+
+    def _worker(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                logger.warning(f"Could not claim job: {str(e)}")
+                claimed = None
+
+            if claimed is None:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            job_id, name, kwargs, created = claimed
+            try:
+                result = _run_task(self.app, name, kwargs, lambda message: self._progress(job_id, message), created)
+                self._update(job_id, status=FINISHED, result=json.dumps(result))
+            except Exception as e:
+                if self._cancel_requested(job_id):
+                    logger.info(f"Job {job_id} ({name}) cancelled")
+                    self._update(job_id, status=CANCELLED)
+                else:
+                    logger.error(f"Job {job_id} ({name}) failed: {str(e)}")
+                    self._update(job_id, status=FAILED, error=str(e))
+            finally:
+                self._running.discard(job_id)
+                self.client.zrem(self._leases_key, job_id)
+
+    def _renew_leases(self, job_ids):
+        if not job_ids:
+            return
+        now = time.time()
+        # xx: a lease that already expired is not renewed
+        self.client.zadd(self._leases_key, {job_id: now for job_id in job_ids}, xx=True)
+
+    def _expire_leases(self):
+        """Fail the running jobs whose lease expired, returning how many"""
+        now = time.time()
+        return self._expire_script(keys=[self._leases_key],
+                                   args=[self._key(""), now, now - JOB_LEASE_SECONDS, LEASE_EXPIRED_ERROR,
+                                         JOB_RETENTION_SECONDS])
+
+    def counts(self):
+        """Number of queued and running jobs, across every node"""
+        return {QUEUED: self.client.zcard(self._queue_key), RUNNING: self.client.zcard(self._leases_key)}
+
+    def get(self, job_id):
+        fields = self.client.hgetall(self._key(job_id))
+        if not fields:
+            return None
+        job = {key.decode(): value.decode() for key, value in fields.items()}
+        job.pop("payload")
+        job["id"] = job_id
+        job.setdefault("progress", None)
+        job.setdefault("error", None)
+        job["result"] = json.loads(job["result"]) if "result" in job else None
+        job["created"] = float(job["created"])
+        job["updated"] = float(job["updated"])
+        job["priority"] = int(job["priority"])
+        job["rank"] = float(job.get("rank", job["created"]))
+        job["cancel_requested"] = job["cancel_requested"] == "1"
+        return job
+
+
+def create_job_queue(backend=JOB_BACKEND):
+    """
+    Create the job queue configured for this deployment
+
+    Args:
+        backend (str): "thread" for an in-process pool, "sqlite" for a queue shared between
+            processes on one host, "redis" for a queue shared between hosts
+
+    Returns:
+        Job queue backend instance; jobs only run in processes that call its start()
+    """
+    if backend == "thread":
+        return ThreadJobBackend()
+    if backend == "sqlite":
+        return SqliteJobBackend()
+    if backend == "redis":
+        return RedisJobBackend(get_redis())
+    raise ValueError(f"Unknown job backend: {backend}")
@@ -0,0 +1,246 @@
+import cProfile
+import importlib.util
+import io
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Profiling configuration (can be overridden with environment variables)
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "0") == "1"  # Allow ?profile=1 on any request
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "study_buddy_profiles"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+REQUEST_SECONDS = Histogram(
+    "study_buddy_request_seconds", "HTTP request latency",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "study_buddy_stage_seconds", "Time spent in each pipeline stage (upload, extraction, model calls, rendering, ...)",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+MODEL_CALLS = Counter(
+    "study_buddy_model_calls", "Gemini calls, by mode (generate, stream, async) and outcome",
+    ["mode", "outcome"],
+)
+MODEL_TOKENS = Histogram(
+    "study_buddy_model_tokens", "Tokens per successful Gemini call, by direction (input or output)",
+    ["direction"], buckets=TOKEN_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "study_buddy_result_cache_lookups", "Result cache lookups, by result (memory_hit, disk_hit, miss)",
+    ["result"],
+)
+CACHE_EVICTIONS = Counter("study_buddy_result_cache_evictions", "Entries evicted from the result cache's shared tier")
+COALESCED_CALLS = Counter(
+    "study_buddy_singleflight_coalesced", "Generations served by an identical call already in flight in this process",
+)
+ADMISSION_DECISIONS = Counter(
+    "study_buddy_admission_decisions", "Generation requests admitted or refused, by outcome (admitted, or the limit hit)",
+    ["outcome"],
+)
+JOB_WAIT_SECONDS = Histogram(
+    "study_buddy_job_wait_seconds", "Time background jobs spend queued before a worker starts them",
+    ["task"], buckets=LATENCY_BUCKETS,
+)
+
+# Stages timed during the current request, for its Server-Timing header (a context variable, so the
+# phases of an async request run on different threads still add to the same list)
+_spans = ContextVar("request_spans", default=None)
+
+# Gauges computed when metrics are scraped
+_gauges = []
+
+# Seconds spent importing the app and each module it imports on first use, by module
+IMPORT_SECONDS = {}
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a pipeline stage
+
+    The duration is recorded in the stage histogram and, when the stage runs
+    within a request, in that request's Server-Timing header.
+
+    Args:
+        stage (str): Stage name (e.g. "pdf_extract")
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def start_request():
+    """Start collecting the spans of the request handled in this context"""
+    _spans.set([])
+
+
+def finish_request():
+    """
+    Stop collecting spans for this context's request
+
+    Returns:
+        str: Server-Timing header value, or "" if no stage was timed
+    """
+    spans = _spans.get() or []
+    _spans.set(None)
+    totals = {}
+    for stage, elapsed in spans:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items())
+
+
+def record_model_call(mode, outcome, input_tokens=None, output_tokens=None):
+    """
+    Count a Gemini call and its tokens
+
+    Args:
+        mode (str): "generate", "stream" or "async"
+        outcome (str): "success", "retry", "error" or "abandoned" (a stream closed by its consumer)
+        input_tokens (int): Prompt tokens of a successful call
+        output_tokens (int): Response tokens of a successful call
+    """
+    MODEL_CALLS.labels(mode, outcome).inc()
+    if input_tokens is not None:
+        MODEL_TOKENS.labels("input").observe(input_tokens)
+    if output_tokens is not None:
+        MODEL_TOKENS.labels("output").observe(output_tokens)
+
+
+def gauge(name, documentation, labels, collect):
+    """
+    Register a gauge computed when metrics are scraped (e.g. queue depth)
+
+    Args:
+        name (str): Metric name
+        documentation (str): Help text
+        labels (list): Label names
+        collect (callable): Returns a dict mapping tuples of label values to values
+    """
+    _gauges.append((name, documentation, labels, collect))
+
+
+def lazy_import(name, package=None):
+    """
+    Import a module on first use, recording how long the import took
+
+    Heavy dependencies needed by only some requests (the PDF exporter, Markdown,
+    the Gemini SDK) are imported through this, so starting a worker does not
+    pay for them. The times are logged and exported as study_buddy_import_seconds.
+
+    Args:
+        name (str): Module name, relative to package if it starts with a dot
+        package (str): Package a relative name is resolved against
+
+    Returns:
+        module: The imported module
+    """
+    name = importlib.util.resolve_name(name, package)
+    if name in sys.modules:
+        # Waits for the import to finish if another thread is still running it
+        return importlib.import_module(name)
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - start
+    if IMPORT_SECONDS.setdefault(name, elapsed) == elapsed:
+        logger.info(f"Imported {name} in {elapsed * 1000:.0f}ms")
+    return module
+
+
+def record_import(name, seconds):
+    """Record how long importing a module took, for modules timed by the caller (e.g. the app itself)"""
+    IMPORT_SECONDS[name] = seconds
+    logger.info(f"Imported {name} in {seconds * 1000:.0f}ms")
+
+
+gauge("study_buddy_import_seconds", "Seconds spent importing the app and the modules it loads on first use (this process)",
+      ["module"], lambda: {(name,): seconds for name, seconds in IMPORT_SECONDS.items()})
+
+
+class _GaugeCollector:
+    def collect(self):
+        for name, documentation, labels, collect in _gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Could not collect {name}: {str(e)}")
+                continue
+            family = GaugeMetricFamily(name, documentation, labels=labels)
+            for label_values, value in values.items():
+                family.add_metric(list(label_values), value)
+            yield family
+
+
+def render_metrics():
+    """
+    Render every metric in the Prometheus text format
+
+    Counters and histograms cover every worker process when
+    PROMETHEUS_MULTIPROC_DIR is set (see deploy/gunicorn.conf.py), otherwise
+    only this process. Scrape-time gauges are computed by this process.
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    gauges = CollectorRegistry(auto_describe=False)
+    gauges.register(_GaugeCollector())
+    return generate_latest(registry) + generate_latest(gauges), CONTENT_TYPE_LATEST
+
+
+def start_profile():
+    """Start profiling the current request, if profiling is enabled"""
+    if not PROFILE_REQUESTS:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def finish_profile(profiler, name):
+    """
+    Stop a request's profiler and save its statistics
+
+    The file can be opened with pstats or snakeviz; the most expensive calls
+    are also logged.
+
+    Args:
+        profiler (cProfile.Profile): Profiler returned by start_profile
+        name (str): Name of the profiled request (e.g. its endpoint)
+
+    Returns:
+        str: Path of the saved profile
+    """
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(20)
+    logger.info(f"Profile of {name} saved to {path}\n{summary.getvalue()}")
+    return path
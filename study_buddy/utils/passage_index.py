@@ -0,0 +1,204 @@
+import io
+import logging
+import os
+import re
+
+import numpy as np
+
+from .compression import TERM_PATTERN, STOP_WORDS, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Target size of one indexed passage; pages longer than this are split on paragraph boundaries
+PASSAGE_TOKENS = int(os.environ.get("PASSAGE_TOKENS", 300))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def _terms(text):
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOP_WORDS]
+
+
+def _split_page(text, start, end):
+    """Split one page into passages of roughly PASSAGE_TOKENS, returning (start, end) offsets"""
+    boundaries = [start] + [match.end() + start for match in PARAGRAPH_BREAK.finditer(text[start:end])] + [end]
+    passages = []
+    passage_start = start
+    passage_tokens = 0
+    for paragraph_start, paragraph_end in zip(boundaries, boundaries[1:]):
+        tokens = count_tokens(text[paragraph_start:paragraph_end])
+        if passage_tokens and passage_tokens + tokens > PASSAGE_TOKENS:
+            passages.append((passage_start, paragraph_start))
+            passage_start, passage_tokens = paragraph_start, 0
+        passage_tokens += tokens
+    if text[passage_start:end].strip():
+        passages.append((passage_start, end))
+    return passages
+
+
+class PassageIndex:
+    """
+    BM25 index over the passages of one document
+
+    The index is stored as flat NumPy arrays: per-passage offsets, page
+    numbers and lengths, and term-major postings (``term_indptr`` delimits
+    each term's run of passage IDs and term frequencies). Passage text is not
+    stored; it is sliced from the document text by offset.
+    """
+
+    ARRAYS = ("starts", "ends", "pages", "lengths", "tokens", "term_indptr", "postings", "frequencies")
+
+    def __init__(self, vocabulary, starts, ends, pages, lengths, tokens, term_indptr, postings, frequencies):
+        self.vocabulary = vocabulary
+        self.term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+        self.starts = starts
+        self.ends = ends
+        self.pages = pages
+        self.lengths = lengths
+        self.tokens = tokens
+        self.term_indptr = term_indptr
+        self.postings = postings
+        self.frequencies = frequencies
+
+        document_frequency = np.diff(term_indptr).astype(np.float32)
+        self.idf = np.log(1 + (len(starts) - document_frequency + 0.5) / (document_frequency + 0.5))
+        average_length = lengths.mean() if len(lengths) else 1.0
+        self.length_norm = K1 * (1 - B + B * lengths / max(average_length, 1.0))
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def build(cls, text, page_offsets):
+        """
+        Index a document's passages
+
+        Args:
+            text (str): Text extracted from the PDF
+            page_offsets (list): Start offset of each page in text
+
+        Returns:
+            PassageIndex: Index of the document
+        """
+        spans, pages = [], []
+        ends = list(page_offsets[1:]) + [len(text)]
+        for page, (start, end) in enumerate(zip(page_offsets, ends), 1):
+            for span in _split_page(text, start, end):
+                spans.append(span)
+                pages.append(page)
+
+        postings = {}
+        lengths = []
+        for passage_id, (start, end) in enumerate(spans):
+            terms = _terms(text[start:end])
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((passage_id, count))
+
+        vocabulary = sorted(postings)
+        term_indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        term_indptr[1:] = np.cumsum([len(postings[term]) for term in vocabulary])
+        flat = [entry for term in vocabulary for entry in postings[term]]
+        return cls(
+            vocabulary,
+            starts=np.array([start for start, _ in spans], dtype=np.int64),
+            ends=np.array([end for _, end in spans], dtype=np.int64),
+            pages=np.array(pages, dtype=np.int32),
+            lengths=np.array(lengths, dtype=np.float32),
+            tokens=np.array([count_tokens(text[start:end]) for start, end in spans], dtype=np.int32),
+            term_indptr=term_indptr,
+            postings=np.array([passage_id for passage_id, _ in flat], dtype=np.int32),
+            frequencies=np.array([count for _, count in flat], dtype=np.float32),
+        )
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, vocabulary=np.array(self.vocabulary, dtype=str),
+                            **{name: getattr(self, name) for name in self.ARRAYS})
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(arrays["vocabulary"].tolist(), **{name: arrays[name] for name in cls.ARRAYS})
+
+    def score(self, query):
+        """
+        BM25 score of every passage for a query
+
+        Args:
+            query (str): Topic or question text
+
+        Returns:
+            numpy.ndarray: One score per passage
+        """
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(_terms(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            run = slice(self.term_indptr[term_id], self.term_indptr[term_id + 1])
+            passage_ids = self.postings[run]
+            frequencies = self.frequencies[run]
+            scores[passage_ids] += self.idf[term_id] * frequencies * (K1 + 1) / (frequencies + self.length_norm[passage_ids])
+        return scores
+
+    def in_pages(self, first_page=None, last_page=None):
+        """Mask of the passages within a page range (inclusive, 1-based)"""
+        mask = np.ones(len(self), dtype=bool)
+        if first_page:
+            mask &= self.pages >= first_page
+        if last_page:
+            mask &= self.pages <= last_page
+        return mask
+
+    def select(self, text, max_tokens, topic=None, covered=(), first_page=None, last_page=None):
+        """
+        Pick the passages to send to the model, within a token budget
+
+        With a topic, the passages most relevant to it are chosen. With
+        questions already covered, the passages they match least are chosen,
+        so new questions come from parts of the document not yet asked about.
+        Otherwise the whole page range is returned, and the caller fits it to
+        the budget.
+
+        Args:
+            text (str): Text extracted from the PDF
+            max_tokens (int): Token budget
+            topic (str): Topic to focus on
+            covered (list): Questions already asked
+            first_page (int): First page to use (1-based)
+            last_page (int): Last page to use
+
+        Returns:
+            str: The chosen passages in document order, or "" if none match
+        """
+        candidates = np.flatnonzero(self.in_pages(first_page, last_page))
+        if topic:
+            scores = self.score(topic)[candidates]
+            order = candidates[np.argsort(-scores, kind="stable")][:np.count_nonzero(scores > 0)]
+            if not len(order):
+                # No passage mentions the topic; use the start of the range instead
+                order = candidates
+        elif covered:
+            coverage = np.zeros(len(self), dtype=np.float32)
+            for question in covered:
+                coverage = np.maximum(coverage, self.score(question))
+            order = candidates[np.argsort(coverage[candidates], kind="stable")]
+        else:
+            return "\n\n".join(text[self.starts[i]:self.ends[i]].strip() for i in candidates)
+
+        chosen = []
+        remaining = max_tokens
+        for passage_id in order:
+            if self.tokens[passage_id] <= remaining:
+                chosen.append(passage_id)
+                remaining -= self.tokens[passage_id]
+        return "\n\n".join(text[self.starts[i]:self.ends[i]].strip() for i in sorted(chosen))
@@ -0,0 +1,275 @@
+import io
+import logging
+from xml.sax.saxutils import escape
+
+import markdown
+from bs4 import BeautifulSoup, NavigableString, Tag
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, XPreformatted
+
+from .metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Styles are built once, when the module is imported
+_sample_styles = getSampleStyleSheet()
+
+TITLE_STYLE = ParagraphStyle(name="GuideTitle", parent=_sample_styles["Heading1"], alignment=1)  # Center alignment
+
+NORMAL_STYLE = ParagraphStyle(
+    name="GuideNormal",
+    parent=_sample_styles["Normal"],
+    fontName="Helvetica",
+    fontSize=11,
+    leading=14,
+    spaceAfter=6
+)
+
+HEADING_STYLES = {
+    f"h{level}": ParagraphStyle(
+        name=f"GuideHeading{level}",
+        fontName="Helvetica-Bold",
+        fontSize=size,
+        leading=size + 4,
+        spaceBefore=6,
+        spaceAfter=10
+    )
+    for level, size in zip(range(1, 7), (14, 12, 12, 11, 11, 11))
+}
+
+# Indentation added per level of list nesting
+LIST_INDENT = 15
+MAX_LIST_DEPTH = 6
+
+BULLET_STYLES = [
+    ParagraphStyle(
+        name=f"GuideBullet{depth}",
+        parent=NORMAL_STYLE,
+        spaceAfter=2,
+        leftIndent=LIST_INDENT * (depth + 1) + 10,
+        bulletIndent=LIST_INDENT * (depth + 1),
+        bulletFontName="Helvetica",
+        bulletFontSize=11
+    )
+    for depth in range(MAX_LIST_DEPTH)
+]
+
+CODE_STYLE = ParagraphStyle(
+    name="GuideCode",
+    fontName="Courier",
+    fontSize=10,
+    leading=12,
+    backColor="#f0f0f0",
+    leftIndent=10,
+    spaceAfter=6
+)
+
+TABLE_CELL_STYLE = ParagraphStyle(name="GuideTableCell", parent=NORMAL_STYLE, fontSize=10, leading=12, spaceAfter=0)
+
+QUESTION_STYLE = ParagraphStyle(
+    name="Question",
+    fontName="Helvetica-Bold",
+    fontSize=12,
+    leading=16,
+    spaceAfter=6,
+    textColor=colors.darkblue
+)
+
+OPTION_STYLE = ParagraphStyle(
+    name="Option",
+    fontName="Helvetica",
+    fontSize=11,
+    leading=14,
+    leftIndent=20
+)
+
+ANSWER_STYLE = ParagraphStyle(
+    name="Answer",
+    fontName="Helvetica-Bold",
+    fontSize=11,
+    leading=14,
+    leftIndent=10,
+    textColor=colors.darkgreen
+)
+
+TABLE_STYLE = TableStyle([
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),  # Add gridlines
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),  # Header background
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),  # Vertically align all cells
+])
+
+# Inline HTML tags and the ReportLab paragraph markup they map to
+INLINE_MARKUP = {
+    'strong': ('<b>', '</b>'),
+    'b': ('<b>', '</b>'),
+    'em': ('<i>', '</i>'),
+    'i': ('<i>', '</i>'),
+    'code': ('<font face="Courier">', '</font>'),
+}
+
+
+def _inline(element):
+    """Convert the inline content of an element to ReportLab paragraph markup"""
+    parts = []
+    for child in element.children:
+        if isinstance(child, NavigableString):
+            parts.append(escape(str(child)))
+        elif isinstance(child, Tag):
+            if child.name in ('ul', 'ol'):
+                continue  # Nested lists are rendered as separate flowables
+            if child.name == 'br':
+                parts.append('<br/>')
+                continue
+            start, end = INLINE_MARKUP.get(child.name, ('', ''))
+            parts.append(start + _inline(child) + end)
+    return ''.join(parts).strip()
+
+
+def _render_list(element, story, depth):
+    """Render a (possibly nested) list, visiting every item exactly once"""
+    ordered = element.name == 'ol'
+    style = BULLET_STYLES[min(depth, MAX_LIST_DEPTH - 1)]
+    number = 0
+    for item in element.find_all('li', recursive=False):
+        number += 1
+        text = _inline(item)
+        if text:
+            story.append(Paragraph(text, style, bulletText=f"{number}." if ordered else "•"))
+        for child in item.find_all(['ul', 'ol'], recursive=False):
+            _render_list(child, story, depth + 1)
+
+
+def _render_table(element, story):
+    table_data = []
+    for row in element.find_all('tr'):
+        table_data.append([Paragraph(_inline(cell), TABLE_CELL_STYLE) for cell in row.find_all(['th', 'td'])])
+    if not table_data:
+        return
+    table = Table(table_data, hAlign='LEFT')
+    table.setStyle(TABLE_STYLE)
+    story.append(table)
+    story.append(Spacer(1, 0.1 * inch))
+
+
+def _render_block(element, story):
+    """Render one block-level element and its children"""
+    if isinstance(element, NavigableString):
+        text = escape(str(element)).strip()
+        if text:
+            story.append(Paragraph(text, NORMAL_STYLE))
+        return
+
+    name = element.name
+    if name in HEADING_STYLES:
+        story.append(Paragraph(_inline(element), HEADING_STYLES[name]))
+    elif name == 'p':
+        text = _inline(element)
+        if text:
+            story.append(Paragraph(text, NORMAL_STYLE))
+    elif name in ('ul', 'ol'):
+        _render_list(element, story, 0)
+        story.append(Spacer(1, 0.05 * inch))
+    elif name == 'pre':
+        story.append(XPreformatted(escape(element.get_text().rstrip()), CODE_STYLE))
+    elif name == 'table':
+        _render_table(element, story)
+    elif name == 'hr':
+        story.append(Spacer(1, 0.2 * inch))
+    else:
+        # Containers such as blockquote or div: render their children in order
+        for child in element.children:
+            _render_block(child, story)
+
+
+def markdown_to_flowables(markdown_text):
+    """
+    Convert Markdown to ReportLab flowables in a single pass over the document tree
+
+    Args:
+        markdown_text (str): Markdown content
+
+    Returns:
+        list: Flowables for a SimpleDocTemplate story
+    """
+    with span("pdf_markdown_parse"):
+        html = markdown.markdown(markdown_text, extensions=['tables', 'fenced_code'])
+        soup = BeautifulSoup(html, 'html.parser')
+    with span("pdf_flowables"):
+        story = []
+        for element in soup.children:
+            _render_block(element, story)
+    return story
+
+
+def build_pdf(story):
+    """
+    Lay out a story as a letter-sized PDF
+
+    Args:
+        story (list): Flowables to render
+
+    Returns:
+        bytes: PDF document
+    """
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=letter,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=72
+    )
+    with span("pdf_build"):
+        doc.build(story)
+    return buffer.getvalue()
+
+
+def render_study_guide_pdf(markdown_text, title):
+    """
+    Render a study guide as a PDF
+
+    Args:
+        markdown_text (str): Study guide in Markdown format
+        title (str): Title shown at the top of the first page
+
+    Returns:
+        bytes: PDF document
+    """
+    story = [Paragraph(escape(title), TITLE_STYLE), Spacer(1, 0.25 * inch)]
+    story.extend(markdown_to_flowables(markdown_text))
+    return build_pdf(story)
+
+
+def render_quiz_pdf(quiz_data, title):
+    """
+    Render a quiz, with its answers, as a PDF
+
+    Args:
+        quiz_data (list): Quiz questions
+        title (str): Title shown at the top of the first page
+
+    Returns:
+        bytes: PDF document
+    """
+    story = [Paragraph(escape(title), TITLE_STYLE), Spacer(1, 0.25 * inch)]
+
+    # Format the quiz questions
+    for i, question in enumerate(quiz_data, 1):
+        # Add the question
+        story.append(Paragraph(escape(f"Question {i}: {question['question']}"), QUESTION_STYLE))
+        story.append(Spacer(1, 0.1 * inch))
+
+        # Add the options
+        for j, option in enumerate(question['options'], 1):
+            story.append(Paragraph(escape(f"{j}. {option}"), OPTION_STYLE))
+
+        # Add the answer
+        story.append(Spacer(1, 0.1 * inch))
+        story.append(Paragraph(escape(f"Answer: {question['answer']}"), ANSWER_STYLE))
+        story.append(Spacer(1, 0.25 * inch))
+
+    return build_pdf(story)
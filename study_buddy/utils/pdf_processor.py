@@ -1,38 +1,169 @@
 import PyPDF2
 import logging
+import os
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from .metrics import span
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(pdf_path):
+# Separator inserted between pages so later stages can split on page boundaries
+PAGE_BREAK = "\f"
+
+# Extraction configuration (can be overridden with environment variables)
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", os.cpu_count() or 1))
+EXTRACTION_PAGES_PER_TASK = int(os.environ.get("EXTRACTION_PAGES_PER_TASK", 16))
+EXTRACTION_MAX_CHARS = int(os.environ.get("EXTRACTION_MAX_CHARS", 0))  # 0 means no limit
+
+# Documents with fewer pages are extracted in-process; a pool is not worth it
+PARALLEL_MIN_PAGES = 2 * EXTRACTION_PAGES_PER_TASK
+
+# Text of a PDF plus the offset in the text at which each page starts
+ExtractedDocument = namedtuple("ExtractedDocument", ["text", "page_offsets"])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Create the shared extraction process pool on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+        return _pool
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """Extract the text of pages [start, stop) (runs in a worker process)"""
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[page_num].extract_text() or "" for page_num in range(start, stop)]
+
+
+def iter_page_texts(pdf_path, max_chars=EXTRACTION_MAX_CHARS, in_pool=False):
+    """
+    Extract page texts from a PDF, in order, as they become available
+
+    Large documents are split into page ranges that are extracted in a
+    process pool; only a few ranges are in flight at once so that stopping
+    early does not waste work.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        max_chars (int): Stop once this many characters have been extracted (0 for no limit)
+        in_pool (bool): Use the process pool for small documents too, so documents
+            extracted from several threads at once (e.g. a batch) run in parallel
+
+    Yields:
+        str: Text of each page
+    """
+    with open(pdf_path, 'rb') as file:
+        num_pages = len(PyPDF2.PdfReader(file).pages)
+
+    collected = 0
+
+    if (num_pages < PARALLEL_MIN_PAGES and not in_pool) or EXTRACTION_WORKERS <= 1:
+        with open(pdf_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for page in pdf_reader.pages:
+                page_text = page.extract_text() or ""
+                yield page_text
+                collected += len(page_text)
+                if max_chars and collected >= max_chars:
+                    return
+        return
+
+    pool = _get_pool()
+    ranges = deque((start, min(start + EXTRACTION_PAGES_PER_TASK, num_pages))
+                   for start in range(0, num_pages, EXTRACTION_PAGES_PER_TASK))
+    pending = deque()
+    try:
+        while ranges or pending:
+            # Keep every worker busy, plus one range queued ahead
+            while ranges and len(pending) <= EXTRACTION_WORKERS:
+                start, stop = ranges.popleft()
+                pending.append(pool.submit(_extract_page_range, pdf_path, start, stop))
+
+            for page_text in pending.popleft().result():
+                yield page_text
+                collected += len(page_text)
+                if max_chars and collected >= max_chars:
+                    logger.info(f"Stopped extraction early after {collected} characters")
+                    return
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_pages(pdf_path, max_chars=EXTRACTION_MAX_CHARS, in_pool=False):
+    """
+    Extract text from a PDF file along with the offset of every page
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        max_chars (int): Stop once this many characters have been extracted (0 for no limit)
+        in_pool (bool): Extract small documents in the process pool too (see iter_page_texts)
+
+    Returns:
+        ExtractedDocument: Text (pages separated by PAGE_BREAK) and page start offsets
+    """
+    pieces = []
+    page_offsets = []
+    offset = 0
+    for page_text in iter_page_texts(pdf_path, max_chars, in_pool):
+        if pieces:
+            pieces.append(PAGE_BREAK)
+            offset += len(PAGE_BREAK)
+        page_offsets.append(offset)
+        pieces.append(page_text)
+        pieces.append("\n")
+        offset += len(page_text) + 1
+    return ExtractedDocument("".join(pieces), page_offsets)
+
+
+def extract_text_from_pdf(pdf_path, max_chars=EXTRACTION_MAX_CHARS):
     """
     Extract text from a PDF file
-    
+
     Args:
         pdf_path (str): Path to the PDF file
-        
+        max_chars (int): Stop once this many characters have been extracted (0 for no limit)
+
     Returns:
         str: Extracted text from the PDF
     """
+    document = extract_document(pdf_path, max_chars)
+    return document.text if document else None
+
+
+def extract_document(pdf_path, max_chars=EXTRACTION_MAX_CHARS, in_pool=False):
+    """
+    Extract text and page offsets from a PDF file
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        max_chars (int): Stop once this many characters have been extracted (0 for no limit)
+        in_pool (bool): Extract small documents in the process pool too (see iter_page_texts)
+
+    Returns:
+        ExtractedDocument: Extracted text and page offsets, or None if there is no text
+    """
     try:
-        text = ""
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            
-            # Check if the PDF is empty
-            if len(pdf_reader.pages) == 0:
-                logger.warning("Empty PDF file")
-                return None
-            
-            # Extract text from each page
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n"
-            
-            if not text.strip():
-                logger.warning("No text extracted from PDF (could be scanned or image-based PDF)")
-                return None
-                
-            return text
+        with span("pdf_extract"):
+            document = extract_pages(pdf_path, max_chars, in_pool)
+
+        # Check if the PDF is empty
+        if not document.page_offsets:
+            logger.warning("Empty PDF file")
+            return None
+
+        if not document.text.strip():
+            logger.warning("No text extracted from PDF (could be scanned or image-based PDF)")
+            return None
+
+        return document
     except Exception as e:
         logger.error(f"Error extracting text from PDF: {str(e)}")
         raise Exception(f"Failed to extract text: {str(e)}")
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per-minute rate
+
+    Callers reserve tokens up front and then wait for the returned delay, so
+    the same bucket can be shared by threads and coroutines. The balance may
+    go negative, which queues later callers behind earlier ones.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """
+        Take tokens from the bucket
+
+        Args:
+            amount (float): Tokens needed
+
+        Returns:
+            float: Seconds to wait before the tokens are available
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def delay(self, amount=1):
+        """
+        Seconds reserve(amount) would wait now, without taking any tokens
+
+        Args:
+            amount (float): Tokens needed
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            tokens = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return max(0.0, (amount - tokens) / self.rate)
+
+    def try_reserve(self, amount=1):
+        """
+        Take tokens only if they are available now
+
+        An amount larger than the bucket is taken once the bucket is full,
+        leaving it in debt, so that large requests are slowed down rather
+        than refused forever.
+
+        Args:
+            amount (float): Tokens needed
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they will be available
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            needed = min(amount, self.capacity)
+            if self._tokens < needed:
+                return (needed - self._tokens) / self.rate
+            self._tokens -= amount
+            return 0.0
+
+    @property
+    def full(self):
+        """Whether the bucket has refilled completely"""
+        return self.delay(self.capacity) == 0.0
+
+
+class _Waiter:
+    def __init__(self, future=None):
+        self.future = future
+        self.event = threading.Event() if future is None else None
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.future.get_loop().call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Concurrency limit tuned by additive-increase / multiplicative-decrease
+
+    Every success raises the limit by roughly one slot per window of calls;
+    an overload signal (429 or 503) halves it. Calls that started before the
+    last decrease belong to the old window, so their failures are ignored and
+    a burst of rejections only halves the limit once. Waiting threads and
+    coroutines are served in FIFO order.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64, decrease_factor=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        """Number of callers waiting for a slot"""
+        return len(self._waiters)
+
+    def _try_acquire(self, waiter):
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _wake_waiters(self):
+        # Called with the lock held
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._waiters.popleft().wake()
+
+    def acquire(self):
+        """
+        Block the calling thread until a slot is free
+
+        Returns:
+            float: Time the slot was granted, to pass back to release()
+        """
+        waiter = _Waiter()
+        if not self._try_acquire(waiter):
+            waiter.event.wait()
+        return time.monotonic()
+
+    async def acquire_async(self):
+        """
+        Wait, without blocking the event loop, until a slot is free
+
+        Returns:
+            float: Time the slot was granted, to pass back to release()
+        """
+        waiter = _Waiter(asyncio.get_running_loop().create_future())
+        if self._try_acquire(waiter):
+            return time.monotonic()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    # The slot was handed over just as we were cancelled
+                    self.in_flight -= 1
+                    self._wake_waiters()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+        return time.monotonic()
+
+    def release(self, started, overloaded=False, succeeded=True):
+        """
+        Return a slot and adjust the limit
+
+        Args:
+            started (float): Value returned by acquire()
+            overloaded (bool): The call was rejected for exceeding quota or capacity
+            succeeded (bool): The call completed successfully
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if overloaded:
+                if started >= self._last_decrease:
+                    self._last_decrease = time.monotonic()
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    logger.warning(f"Overload signalled, concurrency limit lowered to {int(self.limit)}")
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._wake_waiters()
+
+
+def backoff_delay(attempt, base, cap):
+    """
+    Exponential backoff with full jitter
+
+    Args:
+        attempt (int): Number of the retry, starting at 0
+        base (float): Delay ceiling of the first retry, in seconds
+        cap (float): Maximum delay ceiling, in seconds
+
+    Returns:
+        float: Seconds to wait before retrying
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
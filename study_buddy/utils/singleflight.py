@@ -0,0 +1,414 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .metrics import COALESCED_CALLS
+from .storage import REDIS_KEY_PREFIX, get_redis
+
+logger = logging.getLogger(__name__)
+
+# Lock shared between worker processes: "file" (a lock file per key), "redis" (shared between hosts)
+# or "none" (this process only)
+SINGLEFLIGHT_LOCK = os.environ.get("SINGLEFLIGHT_LOCK", "file")
+SINGLEFLIGHT_LOCK_DIR = os.environ.get("SINGLEFLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "study_buddy_locks"))
+# Redis locks expire after this many seconds, so a crashed worker cannot hold one forever
+SINGLEFLIGHT_LOCK_TIMEOUT = int(os.environ.get("SINGLEFLIGHT_LOCK_TIMEOUT", 600))
+
+
+class GenerationFailed(Exception):
+    """A coalesced call failed in another worker process while this one was waiting for it"""
+
+
+class FileLocks:
+    """
+    Cross-process locks backed by lock files
+
+    The leader of a call also records its failure next to the lock, so
+    processes that were waiting on the same call see the error instead of
+    repeating it.
+    """
+
+    def __init__(self, lock_dir=SINGLEFLIGHT_LOCK_DIR):
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def _path(self, key, suffix):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.lock_dir, name + suffix)
+
+    def acquire(self, key):
+        """Block until the lock for key is held, returning a handle for release()"""
+        handle = open(self._path(key, ".lock"), "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        handle.seek(0)
+                        msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue  # LK_LOCK gives up after ten seconds; keep waiting
+        except BaseException:
+            handle.close()
+            raise
+        os.utime(handle.name)  # Last use, for sweep()
+        return handle
+
+    def release(self, handle):
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        handle.close()
+
+    def record_error(self, key, message):
+        path = self._path(key, ".error")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"failed_at": time.time(), "message": message}, f)
+        os.replace(path + ".tmp", path)
+
+    def error_since(self, key, since):
+        """The message of a failure recorded after since, if any"""
+        try:
+            with open(self._path(key, ".error"), "r", encoding="utf-8") as f:
+                error = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return error["message"] if error["failed_at"] >= since else None
+
+    def sweep(self, max_age):
+        """
+        Delete the lock and error files of calls not made for max_age seconds
+
+        Returns:
+            int: Number of files deleted
+        """
+        now = time.time()
+        removed = 0
+        with os.scandir(self.lock_dir) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime <= max_age:
+                        continue
+                except OSError:
+                    continue
+                if entry.name.endswith(".lock"):
+                    # Only delete locks nobody holds; a waiter on a deleted file would lead alone
+                    with open(entry.path, "a+b") as handle:
+                        try:
+                            if fcntl is not None:
+                                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                            else:
+                                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                        except OSError:
+                            continue
+                        os.remove(entry.path)
+                else:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        continue
+                removed += 1
+        return removed
+
+
+class RedisLocks:
+    """
+    Cross-host locks held in Redis
+
+    A lock expires after SINGLEFLIGHT_LOCK_TIMEOUT seconds; a generation
+    taking longer than that may be repeated by another host. Failure times
+    are compared across hosts, so their clocks should be synchronised.
+    """
+
+    def __init__(self, client, timeout=SINGLEFLIGHT_LOCK_TIMEOUT):
+        self.client = client
+        self.timeout = timeout
+
+    def _key(self, key, kind):
+        return f"{REDIS_KEY_PREFIX}singleflight:{kind}:{key}"
+
+    def acquire(self, key):
+        lock = self.client.lock(self._key(key, "lock"), timeout=self.timeout, sleep=0.1)
+        lock.acquire()
+        return lock
+
+    def release(self, handle):
+        from redis.exceptions import LockError
+        try:
+            handle.release()
+        except LockError:
+            logger.warning("Single-flight lock expired before its generation finished")
+
+    def record_error(self, key, message):
+        self.client.set(self._key(key, "error"), json.dumps({"failed_at": time.time(), "message": message}),
+                        ex=self.timeout)
+
+    def error_since(self, key, since):
+        """The message of a failure recorded after since, if any"""
+        data = self.client.get(self._key(key, "error"))
+        if data is None:
+            return None
+        error = json.loads(data)
+        return error["message"] if error["failed_at"] >= since else None
+
+    def sweep(self, max_age):
+        return 0  # Locks and errors expire in Redis
+
+
+class LocalLocks:
+    """No cross-process coordination; calls are only coalesced within this process"""
+
+    def acquire(self, key):
+        return None
+
+    def release(self, handle):
+        pass
+
+    def record_error(self, key, message):
+        pass
+
+    def error_since(self, key, since):
+        return None
+
+    def sweep(self, max_age):
+        return 0
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.futures = {}  # Event loop -> future its coroutines wait on; None once the call is done
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one
+
+    Within a process, the first caller runs the call and every other caller
+    waits for its result, or its exception. Across processes, the leaders
+    take a per-key lock and first look up the result (normally in the result
+    cache) that another process may have produced meanwhile. A call is
+    forgotten as soon as it finishes, so a failure only reaches the callers
+    that were waiting for it and the next request tries again.
+    """
+
+    def __init__(self, locks):
+        self.locks = locks
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Get the in-flight call for key, and whether the caller has to run it"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                COALESCED_CALLS.inc()
+                return call, False
+            call = self._calls[key] = _Call()
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        call.result, call.error = result, error
+        with self._lock:
+            del self._calls[key]
+            futures, call.futures = call.futures, None
+        call.done.set()
+        for loop, future in futures.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # The loop was closed
+
+    def _fail(self, key, call, error):
+        # Interruptions (e.g. the consumer closing a stream) must not leave waiters hanging either
+        if not isinstance(error, Exception):
+            error = GenerationFailed("Generation was interrupted")
+        self._finish(key, call, error=error)
+
+    async def _wait_async(self, call):
+        """Wait for a call to finish without holding a thread"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if call.futures is None:
+                return
+            future = call.futures.get(loop)
+            if future is None:
+                future = call.futures[loop] = loop.create_future()
+        # Shared by the loop's waiters, so one of them being cancelled must not cancel the others
+        await asyncio.shield(future)
+
+    @staticmethod
+    def _outcome(call):
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _check(self, key, lookup, waiting_since):
+        """Result produced by another process while we waited for the lock, or its error"""
+        result = lookup()
+        if result is not None:
+            logger.info("Reusing a result generated by another worker")
+            return result
+        message = self.locks.error_since(key, waiting_since)
+        if message is not None:
+            raise GenerationFailed(message)
+        return None
+
+    def do(self, key, fn, lookup):
+        """
+        Run fn once for all concurrent callers with the same key
+
+        Args:
+            key (str): Identifies the call (e.g. the result cache key)
+            fn (callable): Produces the result (and stores it where lookup finds it)
+            lookup (callable): Returns the stored result, or None
+
+        Returns:
+            The result of fn, or of the call it was coalesced with
+        """
+        call, leader = self._join(key)
+        if not leader:
+            call.done.wait()
+            return self._outcome(call)
+
+        waiting_since = time.time()
+        handle = self.locks.acquire(key)
+        try:
+            result = self._check(key, lookup, waiting_since)
+            if result is None:
+                try:
+                    result = fn()
+                except Exception as e:
+                    self.locks.record_error(key, str(e))
+                    raise
+        except BaseException as e:
+            self._fail(key, call, e)
+            raise
+        finally:
+            self.locks.release(handle)
+        self._finish(key, call, result=result)
+        return result
+
+    async def do_async(self, key, fn, lookup):
+        """
+        Await fn once for all concurrent callers with the same key
+
+        Same as do(), for coroutine functions. Callers coalesced with an
+        in-flight call wait on a future of their event loop; only the leader
+        takes a thread, to acquire the cross-process lock.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            await self._wait_async(call)
+            return self._outcome(call)
+
+        waiting_since = time.time()
+        acquiring = asyncio.get_running_loop().run_in_executor(None, self.locks.acquire, key)
+        try:
+            handle = await asyncio.shield(acquiring)
+        except BaseException as e:
+            # If we were cancelled, release the lock as soon as the thread gets it
+            acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or self.locks.release(f.result()))
+            self._fail(key, call, e)
+            raise
+        try:
+            result = self._check(key, lookup, waiting_since)
+            if result is None:
+                try:
+                    result = await fn()
+                except Exception as e:
+                    self.locks.record_error(key, str(e))
+                    raise
+        except BaseException as e:
+            self._fail(key, call, e)
+            raise
+        finally:
+            self.locks.release(handle)
+        self._finish(key, call, result=result)
+        return result
+
+    def do_stream(self, key, fn, lookup):
+        """
+        Stream fn once for all concurrent callers with the same key
+
+        The leader yields the chunks as they arrive; callers coalesced with it
+        receive the complete result as a single chunk once it is done.
+
+        Args:
+            key (str): Identifies the call
+            fn (callable): Returns an iterator of string chunks
+            lookup (callable): Returns the stored result, or None
+
+        Yields:
+            str: Chunks of the result
+        """
+        call, leader = self._join(key)
+        if not leader:
+            call.done.wait()
+            yield self._outcome(call)
+            return
+
+        waiting_since = time.time()
+        handle = self.locks.acquire(key)
+        try:
+            result = self._check(key, lookup, waiting_since)
+            if result is not None:
+                yield result
+            else:
+                chunks = []
+                try:
+                    for chunk in fn():
+                        chunks.append(chunk)
+                        yield chunk
+                except Exception as e:
+                    self.locks.record_error(key, str(e))
+                    raise
+                result = "".join(chunks)
+        except BaseException as e:
+            self._fail(key, call, e)
+            raise
+        finally:
+            self.locks.release(handle)
+        self._finish(key, call, result=result)
+
+
+def create_single_flight(lock=SINGLEFLIGHT_LOCK):
+    """
+    Create the request coalescer configured for this deployment
+
+    Args:
+        lock (str): "file" to coalesce across worker processes on this host, "redis" across hosts,
+            "none" for this process only
+
+    Returns:
+        SingleFlight: Coalescer instance
+    """
+    if lock == "file":
+        return SingleFlight(FileLocks())
+    if lock == "redis":
+        return SingleFlight(RedisLocks(get_redis()))
+    if lock == "none":
+        return SingleFlight(LocalLocks())
+    raise ValueError(f"Unknown single-flight lock: {lock}")
@@ -0,0 +1,281 @@
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Shared state configuration (can be overridden with environment variables)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "filesystem")  # "filesystem" or "redis"
+STORAGE_DIR = os.environ.get("STORAGE_DIR", os.path.join(tempfile.gettempdir(), "study_buddy"))
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# Age and size limits of stored blobs, enforced by the storage janitor (see utils.janitor)
+UPLOAD_TTL_SECONDS = int(os.environ.get("UPLOAD_TTL", 24 * 3600))
+UPLOAD_QUOTA_BYTES = int(os.environ.get("UPLOAD_QUOTA_MB", 1024)) * 1024 * 1024
+ARTIFACT_TTL_SECONDS = int(os.environ.get("ARTIFACT_TTL", 7 * 24 * 3600))
+ARTIFACT_QUOTA_BYTES = int(os.environ.get("ARTIFACT_QUOTA_MB", 512)) * 1024 * 1024
+
+# (TTL in seconds, quota in bytes) of each blob namespace
+BLOB_POLICIES = {
+    "uploads": (UPLOAD_TTL_SECONDS, UPLOAD_QUOTA_BYTES),
+    "artifacts": (ARTIFACT_TTL_SECONDS, ARTIFACT_QUOTA_BYTES),
+}
+
+# Temporary files older than this were abandoned by a crashed writer
+ABANDONED_TEMP_SECONDS = 3600
+
+# Prefix of every key this app writes to Redis
+REDIS_KEY_PREFIX = "study_buddy:"
+
+_redis = None
+
+
+def get_redis():
+    """
+    Get the Redis client shared by the Redis-backed stores of this process
+
+    Any server speaking the Redis protocol (Redis, Valkey, KeyDB, ...) can be
+    used. The redis package is only imported when a Redis backend is selected.
+
+    Returns:
+        redis.Redis: Client with its own connection pool
+    """
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+
+class FileBlobStore:
+    """
+    Blobs stored as files, one directory per namespace
+
+    The root directory is shared by every worker process on the host. To
+    share blobs between hosts, point it at a volume mounted on all of them
+    (NFS, EFS, ...).
+
+    Blob names start with the ID of their owner followed by "_" or "." (e.g.
+    "<quiz id>_<hash>.pdf", "<content hash>.pdf"), so everything an owner
+    stored can be deleted with it. Reads touch the file's modification time,
+    which the janitor uses for TTL and least-recently-used eviction.
+    """
+
+    def __init__(self, root=STORAGE_DIR):
+        self.root = root
+
+    def _directory(self, namespace):
+        directory = os.path.join(self.root, namespace)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def temp_file(self, namespace):
+        """
+        Create a temporary file to write a new blob into
+
+        Returns:
+            tuple: (file descriptor, path) of the temporary file
+        """
+        return tempfile.mkstemp(dir=self._directory(namespace), suffix=".part")
+
+    def put_file(self, namespace, name, path):
+        """
+        Store a finished temporary file as a blob, replacing any blob of the same name
+
+        Args:
+            namespace (str): Kind of blob (e.g. "uploads")
+            name (str): Blob name
+            path (str): Path returned by temp_file; the file is moved into the store
+        """
+        os.replace(path, os.path.join(self._directory(namespace), name))
+
+    def local_path(self, namespace, name):
+        """
+        Get a path on this host to read a blob from
+
+        Returns:
+            str: Path of the blob, or None if it is not stored
+        """
+        path = os.path.join(self._directory(namespace), name)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def delete(self, namespace, name):
+        self._delete_local(namespace, name)
+
+    def _delete_local(self, namespace, name):
+        """Delete this host's file of a blob"""
+        try:
+            os.remove(os.path.join(self._directory(namespace), name))
+        except FileNotFoundError:
+            pass
+
+    def delete_owned(self, namespace, owner):
+        """Delete every blob of a namespace stored by an owner"""
+        for name, _ in self._files(namespace):
+            if name.startswith((f"{owner}_", f"{owner}.")):
+                self.delete(namespace, name)
+
+    def _files(self, namespace):
+        """(name, stat) of the local files of a namespace, including temporary ones"""
+        with os.scandir(self._directory(namespace)) as entries:
+            for entry in entries:
+                try:
+                    yield entry.name, entry.stat()
+                except OSError:
+                    continue
+
+    def usage(self, namespace):
+        """
+        Measure the local files of a namespace
+
+        Returns:
+            dict: Number of files and their total size in bytes
+        """
+        sizes = [stat.st_size for _, stat in self._files(namespace)]
+        return {"files": len(sizes), "bytes": sum(sizes)}
+
+    def sweep(self, namespace, ttl_seconds, max_bytes):
+        """
+        Enforce a namespace's age and size limits on this host
+
+        Blobs unused for longer than the TTL and abandoned temporary files
+        are deleted first, then the least recently used blobs until the
+        namespace fits its quota.
+
+        Args:
+            namespace (str): Kind of blob
+            ttl_seconds (int): Maximum time since a blob was last stored or read
+            max_bytes (int): Quota of the namespace
+
+        Returns:
+            int: Number of files deleted
+        """
+        now = time.time()
+        removed = 0
+        blobs = []
+        total = 0
+        for name, stat in self._files(namespace):
+            age = now - stat.st_mtime
+            if name.endswith(".part"):
+                expired = age > ABANDONED_TEMP_SECONDS
+            else:
+                expired = age > ttl_seconds
+            if expired:
+                self._delete_local(namespace, name)
+                removed += 1
+            elif not name.endswith(".part"):
+                blobs.append((stat.st_mtime, stat.st_size, name))
+                total += stat.st_size
+
+        blobs.sort()
+        for _, size, name in blobs:
+            if total <= max_bytes:
+                break
+            self._delete_local(namespace, name)
+            total -= size
+            removed += 1
+        return removed
+
+    def claim(self, name, interval, local=False):
+        """
+        Claim a periodic task (e.g. a janitor sweep) on behalf of this process
+
+        Args:
+            name (str): Task name
+            interval (int): Seconds between runs
+            local (bool): Whether the task concerns this host only, rather than every host sharing the store
+
+        Returns:
+            bool: False if another process ran it less than interval seconds ago
+        """
+        path = os.path.join(self.root, f".{name}")
+        try:
+            if time.time() - os.stat(path).st_mtime < interval:
+                return False
+        except FileNotFoundError:
+            os.makedirs(self.root, exist_ok=True)
+        with open(path, "a"):
+            os.utime(path)
+        return True
+
+
+class RedisBlobStore(FileBlobStore):
+    """
+    Blobs stored in Redis, shared by every node
+
+    Readers need a file (for PDF extraction and send_file), so each node keeps
+    the blobs it has used in its local directory. Blob names must identify
+    their content (e.g. include a content hash): a local copy is never
+    checked against Redis again. Blobs expire from Redis after their
+    namespace's TTL, counted from when they were last stored or read; the
+    janitor only sweeps this node's copies, like those of FileBlobStore.
+    """
+
+    def __init__(self, client, root=STORAGE_DIR):
+        super().__init__(root)
+        self.client = client
+
+    def _key(self, namespace, name):
+        return f"{REDIS_KEY_PREFIX}blob:{namespace}:{name}"
+
+    def put_file(self, namespace, name, path):
+        ttl_seconds, _ = BLOB_POLICIES.get(namespace, (None, None))
+        with open(path, "rb") as f:
+            self.client.set(self._key(namespace, name), f.read(), ex=ttl_seconds)
+        super().put_file(namespace, name, path)
+
+    def local_path(self, namespace, name):
+        ttl_seconds, _ = BLOB_POLICIES.get(namespace, (None, None))
+        path = super().local_path(namespace, name)
+        if path is not None:
+            if ttl_seconds:
+                self.client.expire(self._key(namespace, name), ttl_seconds)
+            return path
+
+        key = self._key(namespace, name)
+        data = self.client.getex(key, ex=ttl_seconds) if ttl_seconds else self.client.get(key)
+        if data is None:
+            return None
+        logger.debug(f"Fetched {namespace}/{name} from Redis")
+        fd, tmp_path = self.temp_file(namespace)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        super().put_file(namespace, name, tmp_path)
+        return super().local_path(namespace, name)
+
+    def delete(self, namespace, name):
+        self.client.delete(self._key(namespace, name))
+        super().delete(namespace, name)
+
+    def delete_owned(self, namespace, owner):
+        for pattern in (f"{owner}_*", f"{owner}.*"):
+            for key in self.client.scan_iter(match=self._key(namespace, pattern)):
+                self.client.delete(key)
+        super().delete_owned(namespace, owner)
+
+    def claim(self, name, interval, local=False):
+        if local:
+            return super().claim(name, interval)
+        return bool(self.client.set(f"{REDIS_KEY_PREFIX}claim:{name}", 1, nx=True, ex=interval))
+
+
+def create_blob_store(backend=STORAGE_BACKEND):
+    """
+    Create the blob store configured for this deployment
+
+    Args:
+        backend (str): "filesystem" for a (possibly network-mounted) directory, "redis" for a Redis server
+
+    Returns:
+        Blob store instance
+    """
+    if backend == "filesystem":
+        return FileBlobStore()
+    if backend == "redis":
+        return RedisBlobStore(get_redis())
+    raise ValueError(f"Unknown storage backend: {backend}")
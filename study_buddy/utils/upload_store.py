@@ -0,0 +1,74 @@
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks read from the upload stream while hashing
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadStore:
+    """
+    Content-addressed store for uploaded PDFs.
+
+    Files are named by the SHA-256 of their bytes, so identical uploads share
+    one copy. The extracted text and reference count of each upload live in
+    the document store (see models.Document); the files themselves live in
+    the shared blob store, so any worker can read them.
+    """
+
+    NAMESPACE = "uploads"
+
+    def __init__(self, store):
+        self.store = store
+
+    def pdf_path(self, digest):
+        """Local path of a stored upload, or None if it is not stored"""
+        return self.store.local_path(self.NAMESPACE, f"{digest}.pdf")
+
+    def save(self, stream):
+        """
+        Hash an upload while writing it to disk
+
+        If a file with the same content is already stored, the new copy is
+        discarded.
+
+        Args:
+            stream: File-like object with the uploaded bytes
+
+        Returns:
+            str: Hex SHA-256 digest identifying the upload
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = self.store.temp_file(self.NAMESPACE)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    block = stream.read(READ_BLOCK_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+                    f.write(block)
+
+            digest = digest.hexdigest()
+            if self.pdf_path(digest) is not None:
+                logger.info(f"Upload {digest[:12]} already stored, reusing it")
+            else:
+                self.store.put_file(self.NAMESPACE, f"{digest}.pdf", tmp_path)
+            return digest
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def remove(self, digest):
+        """
+        Delete a stored upload
+
+        Args:
+            digest (str): Upload digest
+        """
+        try:
+            self.store.delete(self.NAMESPACE, f"{digest}.pdf")
+        except Exception as e:
+            logger.warning(f"Could not remove upload {digest[:12]}: {str(e)}")
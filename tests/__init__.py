@@ -0,0 +1,13 @@
+"""
+Behaviour tests of the app, run offline from the repository root:
+
+    python -m unittest discover -s tests -t .
+
+The app reads its configuration at import time, so every store is pointed at
+a scratch directory here, before any test module imports study_buddy.
+"""
+import tempfile
+
+from benchmarks.common import isolate_environment
+
+isolate_environment(tempfile.mkdtemp(prefix="study_buddy_tests_"))
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from study_buddy.utils import admission
+from study_buddy.utils.admission import (
+    ADMISSION_SESSION_CONCURRENCY,
+    ADMISSION_SESSION_TPM,
+    AdmissionController,
+    AdmissionRejected,
+    MemoryAdmissionState,
+    RedisAdmissionState,
+    SqliteAdmissionState,
+    create_admission_state,
+)
+from study_buddy.utils.gemini_client import GeminiClient
+from study_buddy.utils.jobs import RedisJobBackend, SqliteJobBackend, ThreadJobBackend
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+CLIENTS = ["session:a", "ip:10.0.0.1"]
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.jobs = ThreadJobBackend()  # Never started, so submitted jobs stay queued
+        self.gemini = GeminiClient("test", rpm=15, tpm=1000000)
+        self.controller = self.make_controller(MemoryAdmissionState())
+
+    def make_controller(self, state):
+        return AdmissionController(self.jobs, self.gemini, enabled=True, state=state)
+
+    def fill_session(self, controller=None):
+        controller = controller or self.controller
+        return [controller.admit(CLIENTS, 100) for _ in range(ADMISSION_SESSION_CONCURRENCY)]
+
+    def test_limits_generations_in_progress(self):
+        admitted = self.fill_session()
+        with self.assertRaises(AdmissionRejected) as rejected:
+            self.controller.admit(CLIENTS, 100)
+        self.assertEqual(rejected.exception.reason, "concurrency")
+
+        admitted[0].release()
+        self.controller.admit(CLIENTS, 100)
+
+    def test_attached_generation_counts_until_its_job_ends(self):
+        job_ids = []
+        for generation in self.fill_session():
+            job_ids.append(self.jobs.submit("generate"))
+            generation.attach(job_ids[-1])
+        self.assertRaises(AdmissionRejected, self.controller.admit, CLIENTS, 100)
+
+        self.jobs.cancel(job_ids[0])
+        self.controller.admit(CLIENTS, 100)
+
+    def test_sessions_are_limited_separately(self):
+        self.fill_session()
+        self.controller.admit(["session:b", "ip:10.0.0.1"], 100)
+
+    def test_token_quota_refuses_without_charging(self):
+        self.controller.admit(CLIENTS, ADMISSION_SESSION_TPM - 1000).release()
+        with self.assertRaises(AdmissionRejected) as rejected:
+            self.controller.admit(CLIENTS, 5000)
+        self.assertEqual(rejected.exception.reason, "quota")
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        # The refused request took nothing, so a smaller one still fits
+        self.controller.admit(CLIENTS, 1000)
+
+    def test_speculative_generations_have_their_own_counters(self):
+        self.fill_session()
+        speculative = ["speculative:" + key for key in CLIENTS]
+        for _ in range(ADMISSION_SESSION_CONCURRENCY):
+            speculative_admission = self.controller.admit(speculative, 100)
+        self.assertRaises(AdmissionRejected, self.controller.admit, speculative, 100)
+        speculative_admission.release()
+        self.controller.admit(speculative, 100)
+
+    def test_ranks_are_spaced_by_the_binding_gemini_limit(self):
+        # One call per generation at 15 requests per minute: 4 seconds apart, whatever the tokens
+        first = self.controller.admit(["session:x"], 100)
+        second = self.controller.admit(["session:x"], 100)
+        self.assertAlmostEqual(second.rank - first.rank, 4.0, delta=0.1)
+
+        # A client of weight 2 gets ranks half as far apart
+        first = self.controller.admit(["session:y"], 100, weight=2)
+        second = self.controller.admit(["session:y"], 100, weight=2)
+        self.assertAlmostEqual(second.rank - first.rank, 2.0, delta=0.1)
+
+        # Once the token limit binds instead, ranks follow the tokens
+        gemini = GeminiClient("test", rpm=600, tpm=60000)
+        controller = AdmissionController(self.jobs, gemini, enabled=True, state=MemoryAdmissionState())
+        first = controller.admit(["session:z"], 3000)
+        second = controller.admit(["session:z"], 3000)
+        self.assertAlmostEqual(second.rank - first.rank, 3.0, delta=0.1)
+
+    def test_refuses_when_too_many_jobs_are_queued(self):
+        self.jobs.submit("generate")
+        with mock.patch.object(admission, "ADMISSION_MAX_QUEUED", 1):
+            with self.assertRaises(AdmissionRejected) as rejected:
+                self.controller.admit(["session:b"], 100)
+        self.assertEqual(rejected.exception.reason, "saturated")
+
+    def test_disabled_controller_admits_everything(self):
+        controller = AdmissionController(self.jobs, self.gemini, enabled=False, state=MemoryAdmissionState())
+        for _ in range(ADMISSION_SESSION_CONCURRENCY + 1):
+            controller.admit(CLIENTS, ADMISSION_SESSION_TPM * 2)
+
+    def check_shared_state(self, make_state):
+        """Two controllers standing in for two worker processes enforce one limit"""
+        first, second = self.make_controller(make_state()), self.make_controller(make_state())
+        admitted = self.fill_session(first)
+        self.assertRaises(AdmissionRejected, second.admit, CLIENTS, 100)
+        admitted[0].release()
+        second.admit(CLIENTS, 100)
+
+    def test_sqlite_state_is_shared_between_processes(self):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="study_buddy_admission_"), "jobs.sqlite3")
+        self.check_shared_state(lambda: SqliteAdmissionState(db_path))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_state_is_shared_between_processes(self):
+        server = fakeredis.FakeServer()
+        self.check_shared_state(lambda: RedisAdmissionState(fakeredis.FakeRedis(server=server)))
+
+
+class CreateAdmissionStateTest(unittest.TestCase):
+    def test_state_is_kept_with_the_job_queue(self):
+        self.assertIsInstance(create_admission_state(ThreadJobBackend()), MemoryAdmissionState)
+        db_path = os.path.join(tempfile.mkdtemp(prefix="study_buddy_admission_"), "jobs.sqlite3")
+        self.assertIsInstance(create_admission_state(SqliteJobBackend(db_path)), SqliteAdmissionState)
+        if fakeredis is not None:
+            self.assertIsInstance(create_admission_state(RedisJobBackend(fakeredis.FakeRedis())), RedisAdmissionState)
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.common import make_pdf
+from benchmarks.fake_gemini import FakeModel, install
+
+app = None
+
+
+def setUpModule():
+    global app
+    install(FakeModel(first_token_seconds=0, tokens_per_second=1000000, output_tokens=200))
+    from study_buddy.app import create_app
+    app = create_app()
+
+
+class ApiTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        # A PDF of its own, so no other test holds a reference to its document
+        self.pdf = make_pdf(os.path.join(tempfile.mkdtemp(prefix="study_buddy_pdf_"), "notes.pdf"), pages=2,
+                            seed=self.id())
+
+    def upload(self):
+        with open(self.pdf, "rb") as f:
+            response = self.client.post("/api/v1/documents", data=f.read(), content_type="application/pdf")
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()
+
+    def check_revalidation(self, url, immutable):
+        """Fetch url, then check a matching If-None-Match gets a 304 with the same caching headers"""
+        response = self.client.get(url)
+        response.close()
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        if immutable:
+            self.assertIn("immutable", response.headers["Cache-Control"])
+        else:
+            self.assertIn("no-cache", response.headers["Cache-Control"])
+
+        # Compressed responses carry the weak form of the ETag, which must match too
+        for sent in (etag, "W/" + etag):
+            revalidated = self.client.get(url, headers={"If-None-Match": sent})
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated.data, b"")
+            self.assertEqual(revalidated.headers["ETag"], etag)
+            self.assertEqual(revalidated.headers["Cache-Control"], response.headers["Cache-Control"])
+        other = self.client.get(url, headers={"If-None-Match": '"other"'})
+        other.close()
+        self.assertEqual(other.status_code, 200)
+        return etag
+
+
+class DocumentEtagTest(ApiTest):
+    def test_document_is_immutable(self):
+        document = self.upload()
+        self.check_revalidation(f"/api/v1/documents/{document['id']}", immutable=True)
+
+    def test_etag_changes_when_the_document_is_uploaded_again(self):
+        document = self.upload()
+        url = f"/api/v1/documents/{document['id']}"
+        etag = self.client.get(url).headers["ETag"]
+
+        deleted = self.client.delete(url, headers={"X-Document-Reference": document["reference"]})
+        self.assertEqual(deleted.status_code, 204)
+        uploaded = self.upload()
+        self.assertNotEqual(uploaded["created_at"], document["created_at"])
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.get_json()["created_at"], uploaded["created_at"])
+
+
+class GeneratedEtagTest(ApiTest):
+    def test_study_guide_formats_are_immutable(self):
+        document = self.upload()
+        response = self.client.post(f"/api/v1/documents/{document['id']}/study_guides?wait=true")
+        self.assertEqual(response.status_code, 201)
+        url = response.headers["Location"]
+
+        etags = {self.check_revalidation(url + suffix, immutable=True) for suffix in ("", "/markdown", "/html")}
+        self.assertEqual(len(etags), 3)
+
+    def test_quiz_is_revalidated(self):
+        document = self.upload()
+        response = self.client.post(f"/api/v1/documents/{document['id']}/quizzes",
+                                    json={"num_questions": 3, "wait": True})
+        self.assertEqual(response.status_code, 201)
+        url = response.headers["Location"]
+        etag = self.check_revalidation(url, immutable=False)
+
+        # A quiz that gained questions no longer matches
+        from study_buddy.utils import document_store
+        quiz_id = response.get_json()["id"]
+        with app.app_context():
+            document_store.append_quiz_questions(
+                quiz_id, [{"question": "Extra?", "options": ["Yes", "No"], "answer": "Yes"}])
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_job_status_is_not_cached(self):
+        document = self.upload()
+        response = self.client.post(f"/api/v1/documents/{document['id']}/study_guides")
+        self.assertEqual(response.status_code, 202)
+        status = self.client.get(response.headers["Location"])
+        self.assertIn("no-store", status.headers["Cache-Control"])
+        self.assertNotIn("ETag", status.headers)
+
+
+class RequestValidationTest(ApiTest):
+    def test_json_bodies_must_be_objects(self):
+        document = self.upload()
+        for path in ("study_guides", "quizzes"):
+            for body in ([1], 3, "wait"):
+                response = self.client.post(f"/api/v1/documents/{document['id']}/{path}", json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.get_json())
+
+    def test_num_questions_is_bounded(self):
+        document = self.upload()
+        for num_questions in (0, -3, 21, "many"):
+            response = self.client.post(f"/api/v1/documents/{document['id']}/quizzes",
+                                        json={"num_questions": num_questions})
+            self.assertEqual(response.status_code, 400, num_questions)
+
+    def test_unknown_document(self):
+        response = self.client.get(f"/api/v1/documents/{'0' * 64}")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json(), {"error": "Document not found"})
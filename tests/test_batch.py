@@ -0,0 +1,84 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from werkzeug.datastructures import FileStorage
+
+from study_buddy.utils import batch
+from study_buddy.utils.batch import save_batch_upload
+from study_buddy.utils.storage import FileBlobStore
+from study_buddy.utils.upload_store import UploadStore
+
+
+def pdf_bytes(n):
+    return b"%PDF-1.4\n" + f"document {n}\n".encode() * 100
+
+
+def zip_file(filename, members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return FileStorage(buffer, filename=filename)
+
+
+def pdf_file(filename, data):
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+
+class SaveBatchUploadTest(unittest.TestCase):
+    def setUp(self):
+        self.store = FileBlobStore(tempfile.mkdtemp(prefix="study_buddy_storage_"))
+        self.uploads = UploadStore(self.store)
+
+    def stored(self):
+        directory = os.path.join(self.store.root, UploadStore.NAMESPACE)
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def test_stores_pdfs_and_the_pdfs_inside_zips(self):
+        files = [
+            pdf_file("first.pdf", pdf_bytes(1)),
+            zip_file("notes.zip", {
+                "chapters/second.pdf": pdf_bytes(2),
+                "chapters/": b"",
+                "__MACOSX/chapters/._second.pdf": b"metadata",
+                "readme.txt": b"not a pdf",
+                "Third.PDF": pdf_bytes(3),
+            }),
+        ]
+        saved = save_batch_upload(files, self.uploads)
+        self.assertEqual(saved, [(name, hashlib.sha256(pdf_bytes(n)).hexdigest(), None)
+                                 for name, n in (("first.pdf", 1), ("second.pdf", 2), ("Third.PDF", 3))])
+        self.assertEqual(len(self.stored()), 3)
+
+    def test_unusable_files_are_reported_without_failing_the_batch(self):
+        files = [pdf_file("notes.txt", b"text"), pdf_file("broken.zip", b"not a zip"), pdf_file("ok.pdf", pdf_bytes(1))]
+        saved = save_batch_upload(files, self.uploads)
+        self.assertEqual([(name, error) for name, _, error in saved],
+                         [("notes.txt", "Not a PDF or zip file"), ("broken.zip", "Not a valid zip file"), ("ok.pdf", None)])
+
+    def test_too_many_pdfs_are_refused_before_storing_any(self):
+        files = [pdf_file("a.pdf", pdf_bytes(0)), zip_file("b.zip", {f"{n}.pdf": pdf_bytes(n) for n in range(1, 4)})]
+        with self.assertRaisesRegex(ValueError, "at most 3 PDFs"):
+            save_batch_upload(files, self.uploads, max_files=3)
+        self.assertEqual(self.stored(), [])
+
+    def test_zips_extracting_past_the_limit_are_refused_by_declared_size(self):
+        # Compresses to a few KB, but declares 2MB of content
+        files = [zip_file("bomb.zip", {f"{n}.pdf": b"\0" * (1024 * 1024) for n in range(2)})]
+        with self.assertRaisesRegex(ValueError, "at most 1MB"):
+            save_batch_upload(files, self.uploads, max_bytes=1024 * 1024)
+        self.assertEqual(self.stored(), [])
+
+    def test_oversized_pdf_inside_a_zip_is_reported(self):
+        files = [zip_file("b.zip", {"big.pdf": pdf_bytes(1) * 10, "small.pdf": pdf_bytes(2)})]
+        with mock.patch.object(batch, "MAX_PDF_BYTES", len(pdf_bytes(1)) * 5):
+            saved = save_batch_upload(files, self.uploads, max_bytes=len(pdf_bytes(2)))
+        self.assertEqual([(name, error) for name, _, error in saved],
+                         [("big.pdf", "File too large (maximum 16MB)"), ("small.pdf", None)])
+        self.assertEqual(len(self.stored()), 1)
@@ -0,0 +1,94 @@
+import random
+import unittest
+
+from study_buddy.utils.chunking import COMPRESSION_MIN_RATIO, fit_to_budget, split_into_chunks
+from study_buddy.utils.compression import compress_text, count_tokens, split_sentences
+from study_buddy.utils.pdf_processor import PAGE_BREAK
+
+WORDS = "cell membrane protein energy enzyme gene neuron signal tissue organ".split()
+
+
+def sentence(rng, words=10):
+    return " ".join(rng.choices(WORDS, k=words)).capitalize() + "."
+
+
+def page(rng, paragraphs=3, sentences=5):
+    return "\n\n".join(" ".join(sentence(rng) for _ in range(sentences)) for _ in range(paragraphs))
+
+
+class SplitIntoChunksTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.pages = [page(rng) for _ in range(10)]
+        self.text = PAGE_BREAK.join(self.pages)
+
+    def test_chunks_fit_the_budget_and_keep_pages_whole(self):
+        budget = count_tokens(self.pages[0]) * 3
+        chunks = split_into_chunks(self.text, budget)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(count_tokens(chunk) <= budget for chunk in chunks))
+        self.assertEqual("\n".join(chunks), "\n".join(self.pages))
+
+    def test_oversized_pages_are_split_on_sections(self):
+        budget = count_tokens(self.pages[0]) // 2
+        chunks = split_into_chunks(self.text, budget)
+        self.assertTrue(all(count_tokens(chunk) <= budget for chunk in chunks))
+        self.assertEqual(" ".join(chunks).split(), " ".join(self.pages).split())
+
+    def test_a_single_huge_word_is_split_by_characters(self):
+        chunks = split_into_chunks("x" * 1000, 10)
+        self.assertEqual("".join(chunks), "x" * 1000)
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+
+    def test_blank_pages_are_dropped(self):
+        self.assertEqual(split_into_chunks(f"one{PAGE_BREAK}  {PAGE_BREAK}two", 100), ["one\ntwo"])
+
+
+class FitToBudgetTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        self.text = PAGE_BREAK.join(page(rng) for _ in range(4))
+        self.tokens = count_tokens(self.text)
+
+    def test_text_within_the_budget_is_unchanged(self):
+        self.assertEqual(fit_to_budget(self.text, self.tokens), [self.text])
+
+    def test_text_slightly_over_the_budget_is_compressed(self):
+        budget = int(self.tokens * COMPRESSION_MIN_RATIO) + 1
+        pieces = fit_to_budget(self.text, budget)
+        self.assertEqual(len(pieces), 1)
+        self.assertLessEqual(count_tokens(pieces[0]), budget)
+
+    def test_text_far_over_the_budget_is_split(self):
+        budget = int(self.tokens * COMPRESSION_MIN_RATIO) - 1
+        pieces = fit_to_budget(self.text, budget)
+        self.assertGreater(len(pieces), 1)
+        self.assertTrue(all(count_tokens(piece) <= budget for piece in pieces))
+
+
+class CompressTextTest(unittest.TestCase):
+    def test_sentences_are_grouped_by_paragraph(self):
+        self.assertEqual(split_sentences("One here. Two there.\n\nThree!"),
+                         [(0, "One here."), (0, "Two there."), (1, "Three!")])
+
+    def test_keeps_whole_sentences_in_order_within_the_budget(self):
+        rng = random.Random(2)
+        text = page(rng, paragraphs=4)
+        sentences = [s for _, s in split_sentences(text)]
+        budget = count_tokens(text) // 2
+        compressed = compress_text(text, budget)
+        self.assertLessEqual(count_tokens(compressed), budget)
+        kept = [s for _, s in split_sentences(compressed)]
+        self.assertTrue(kept)
+        self.assertTrue(set(kept) <= set(sentences))
+        positions = [sentences.index(s) for s in kept]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_prefers_sentences_central_to_the_text(self):
+        text = ("Enzymes speed up reactions in the cell. Enzymes lower the energy a reaction in the cell needs. "
+                "The museum opens on Sundays. Each enzyme in the cell binds one substrate.")
+        compressed = compress_text(text, count_tokens(text) - count_tokens("The museum opens on Sundays."))
+        self.assertNotIn("museum", compressed)
+
+    def test_text_within_the_budget_is_unchanged(self):
+        self.assertEqual(compress_text("Short text.", 100), "Short text.")
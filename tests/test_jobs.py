@@ -0,0 +1,189 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from study_buddy.utils import jobs
+from study_buddy.utils.jobs import (
+    CANCELLED,
+    FAILED,
+    FINISHED,
+    LEASE_EXPIRED_ERROR,
+    PRIORITY_LOW,
+    QUEUED,
+    RUNNING,
+    RedisJobBackend,
+    SqliteJobBackend,
+    ThreadJobBackend,
+    task,
+)
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+ran = []
+release = threading.Event()
+
+
+@task("test_record")
+def record(progress, label):
+    progress(f"running {label}")
+    ran.append(label)
+    return {"label": label}
+
+
+@task("test_blocking")
+def blocking(progress):
+    progress("waiting")
+    release.wait(5)
+    progress("released")
+    return "done"
+
+
+@task("test_failing")
+def failing(progress):
+    raise ValueError("no quota")
+
+
+class JobBackendTests:
+    """Behaviour shared by every job backend; subclasses set make_backend()"""
+
+    def setUp(self):
+        ran.clear()
+        release.clear()
+        self.addCleanup(release.set)  # Lets the worker threads of each test finish
+        self.queue = self.make_backend()
+
+    def wait_for(self, job_id, statuses=(FINISHED, FAILED, CANCELLED)):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            job = self.queue.get(job_id)
+            if job["status"] in statuses:
+                return job
+            time.sleep(0.02)
+        self.fail(f"Job {job_id} is still {job['status']}")
+
+    def test_runs_jobs_and_keeps_their_results(self):
+        self.queue.start()
+        job = self.wait_for(self.queue.submit("test_record", label="a"))
+        self.assertEqual(job["status"], FINISHED)
+        self.assertEqual(job["result"], {"label": "a"})
+        self.assertEqual(job["progress"], "running a")
+
+    def test_records_failures(self):
+        self.queue.start()
+        with self.assertLogs(jobs.logger, "ERROR"):
+            job = self.wait_for(self.queue.submit("test_failing"))
+        self.assertEqual(job["status"], FAILED)
+        self.assertEqual(job["error"], "no quota")
+
+    def test_runs_by_priority_then_rank(self):
+        self.queue.submit("test_record", priority=PRIORITY_LOW, rank=1, label="low")
+        self.queue.submit("test_record", rank=3, label="late")
+        self.queue.submit("test_record", rank=2, label="early")
+        promoted = self.queue.submit("test_record", priority=PRIORITY_LOW, rank=0, label="promoted")
+        self.queue.promote(promoted)
+        self.queue.start()
+        self.wait_for(self.queue.submit("test_record", priority=PRIORITY_LOW, rank=4, label="last"))
+        self.assertEqual(ran, ["promoted", "early", "late", "low", "last"])
+
+    def test_counts_queued_and_running_jobs(self):
+        self.queue.submit("test_record", label="a")
+        self.assertEqual(self.queue.counts(), {QUEUED: 1, RUNNING: 0})
+        self.queue.start()
+        job_id = self.queue.submit("test_blocking")
+        self.wait_for(job_id, (RUNNING,))
+        self.assertEqual(self.queue.counts(), {QUEUED: 0, RUNNING: 1})
+
+    def test_cancelled_queued_job_never_runs(self):
+        job_id = self.queue.submit("test_record", label="cancelled")
+        self.queue.cancel(job_id)
+        self.queue.start()
+        self.wait_for(self.queue.submit("test_record", label="next"))
+        self.assertEqual(self.queue.get(job_id)["status"], CANCELLED)
+        self.assertEqual(ran, ["next"])
+
+    def test_cancelled_running_job_stops_at_its_next_progress(self):
+        self.queue.start()
+        job_id = self.queue.submit("test_blocking")
+        self.wait_for(job_id, (RUNNING,))
+        self.queue.cancel(job_id)
+        release.set()
+        job = self.wait_for(job_id)
+        self.assertEqual(job["status"], CANCELLED)
+        self.assertIsNone(job["result"])
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.queue.get("missing"))
+
+
+class LeasedJobBackendTests(JobBackendTests):
+    """Backends shared between processes fail the jobs of a process that stopped"""
+
+    def claim_as_dead_process(self):
+        """Claim a job the way a worker process would, then never renew its lease"""
+        self.queue.worker_id = "dead-host:1"
+        self.queue._running = set()
+        job_id = self.queue.submit("test_record", label="orphan")
+        self.claim()
+        self.assertEqual(self.queue.get(job_id)["status"], RUNNING)
+        return job_id
+
+    def test_job_of_a_dead_process_fails_once_its_lease_expires(self):
+        job_id = self.claim_as_dead_process()
+        with mock.patch.object(jobs, "JOB_LEASE_SECONDS", 0.2):
+            self.assertEqual(self.queue._expire_leases(), 0)
+            time.sleep(0.3)
+            self.assertEqual(self.queue._expire_leases(), 1)
+        job = self.queue.get(job_id)
+        self.assertEqual(job["status"], FAILED)
+        self.assertEqual(job["error"], LEASE_EXPIRED_ERROR)
+        self.assertEqual(self.queue.counts()[RUNNING], 0)
+
+    def test_renewed_lease_does_not_expire(self):
+        job_id = self.claim_as_dead_process()
+        with mock.patch.object(jobs, "JOB_LEASE_SECONDS", 0.3):
+            for _ in range(3):
+                time.sleep(0.15)
+                self.queue._renew_leases([job_id])
+                self.assertEqual(self.queue._expire_leases(), 0)
+        self.assertEqual(self.queue.get(job_id)["status"], RUNNING)
+
+
+class ThreadJobBackendTest(JobBackendTests, unittest.TestCase):
+    def make_backend(self):
+        return ThreadJobBackend(workers=1)
+
+
+class SqliteJobBackendTest(LeasedJobBackendTests, unittest.TestCase):
+    def make_backend(self):
+        return SqliteJobBackend(os.path.join(tempfile.mkdtemp(prefix="study_buddy_jobs_"), "jobs.sqlite3"), workers=1)
+
+    def claim(self):
+        self.queue._claim(self.queue._connect())
+
+    def test_jobs_are_shared_between_processes(self):
+        other = SqliteJobBackend(self.queue.db_path, workers=1)
+        other.start()
+        job = self.wait_for(self.queue.submit("test_record", label="a"))
+        self.assertEqual(job["status"], FINISHED)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisJobBackendTest(LeasedJobBackendTests, unittest.TestCase):
+    def make_backend(self):
+        self.server = fakeredis.FakeServer()
+        return RedisJobBackend(fakeredis.FakeRedis(server=self.server), workers=1)
+
+    def claim(self):
+        self.queue._claim()
+
+    def test_jobs_are_shared_between_processes(self):
+        other = RedisJobBackend(fakeredis.FakeRedis(server=self.server), workers=1)
+        other.start()
+        job = self.wait_for(self.queue.submit("test_record", label="a"))
+        self.assertEqual(job["status"], FINISHED)
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from study_buddy.utils.compression import count_tokens
+from study_buddy.utils.passage_index import PASSAGE_TOKENS, PassageIndex
+
+PAGES = [
+    "Photosynthesis turns light into chemical energy inside chloroplasts.\n\nLeaves hold most chloroplasts.",
+    "The French Revolution began in 1789 with the storming of the Bastille.",
+    "Mitochondria release energy from glucose during cellular respiration.",
+    "Napoleon rose to power after the revolution and crowned himself emperor.",
+]
+
+
+def document(pages):
+    """Text and page offsets of a document, as extracted from a PDF"""
+    offsets, text = [], ""
+    for page in pages:
+        offsets.append(len(text))
+        text += page + "\n"
+    return text, offsets
+
+
+class PassageIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.text, self.offsets = document(PAGES)
+        self.index = PassageIndex.build(self.text, self.offsets)
+
+    def test_one_passage_per_short_page(self):
+        self.assertEqual(len(self.index), len(PAGES))
+        self.assertEqual(self.index.pages.tolist(), [1, 2, 3, 4])
+
+    def test_long_pages_are_split_on_paragraphs(self):
+        paragraph = " ".join(["chlorophyll absorbs red and blue light"] * 20)
+        page = "\n\n".join([paragraph] * 6)
+        index = PassageIndex.build(page, [0])
+        self.assertGreater(len(index), 1)
+        self.assertTrue(all(tokens <= PASSAGE_TOKENS for tokens in index.tokens))
+        self.assertEqual("".join(page[start:end] for start, end in zip(index.starts, index.ends)), page)
+
+    def test_scores_favour_passages_mentioning_the_query(self):
+        scores = self.index.score("revolution")
+        self.assertEqual(set(np.flatnonzero(scores)), {1, 3})
+        self.assertEqual(int(np.argmax(self.index.score("energy chloroplasts"))), 0)
+        self.assertFalse(self.index.score("quantum").any())
+
+    def test_topic_selects_relevant_passages_in_document_order(self):
+        selected = self.index.select(self.text, 1000, topic="revolution")
+        self.assertEqual(selected, f"{PAGES[1]}\n\n{PAGES[3]}")
+
+    def test_topic_without_matches_falls_back_to_the_page_range(self):
+        self.assertEqual(self.index.select(self.text, 1000, topic="quantum", first_page=3, last_page=3), PAGES[2])
+
+    def test_selection_fits_the_budget(self):
+        budget = count_tokens(PAGES[1])
+        self.assertEqual(self.index.select(self.text, budget, topic="revolution napoleon"), PAGES[3])
+
+    def test_covered_questions_steer_to_unasked_passages(self):
+        covered = ["What does photosynthesis turn light into?", "When did the French Revolution begin?"]
+        budget = count_tokens(PAGES[2]) + count_tokens(PAGES[3])
+        self.assertEqual(self.index.select(self.text, budget, covered=covered), f"{PAGES[2]}\n\n{PAGES[3]}")
+
+    def test_page_range_without_topic_returns_every_passage(self):
+        self.assertEqual(self.index.select(self.text, 1, first_page=2, last_page=3), f"{PAGES[1]}\n\n{PAGES[2]}")
+
+    def test_round_trips_through_bytes(self):
+        restored = PassageIndex.from_bytes(self.index.to_bytes())
+        self.assertEqual(restored.vocabulary, self.index.vocabulary)
+        np.testing.assert_array_equal(restored.score("energy"), self.index.score("energy"))
+        self.assertEqual(restored.select(self.text, 1000, topic="napoleon"), PAGES[3])
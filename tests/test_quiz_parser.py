@@ -0,0 +1,92 @@
+import json
+import unittest
+
+from study_buddy.utils.gemini_client import QuizCollector, _plan_quiz, iter_json_objects, validate_question
+
+
+def question(text, answer="A", options=("A", "B", "C", "D")):
+    return {"question": text, "options": list(options), "answer": answer}
+
+
+def pieces(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class IterJsonObjectsTest(unittest.TestCase):
+    def test_objects_are_decoded_whatever_the_chunk_boundaries(self):
+        questions = [question(f"Question {i}?") for i in range(5)]
+        text = json.dumps(questions, indent=2)
+        for size in (1, 3, 7, len(text)):
+            self.assertEqual(list(iter_json_objects(pieces(text, size))), questions)
+
+    def test_each_object_is_yielded_before_the_response_ends(self):
+        def chunks():
+            yield '[{"question": "First?", "options": ["A", "B"], "answer": "A"},'
+            raise AssertionError("Read past the first object")
+
+        parsed = iter_json_objects(chunks())
+        self.assertEqual(next(parsed)["question"], "First?")
+
+    def test_braces_and_escaped_quotes_in_strings_are_text(self):
+        tricky = question('Which of "}{" and \\" is a brace? {', answer="}", options=("}", "{"))
+        self.assertEqual(list(iter_json_objects(pieces(json.dumps([tricky]), 2))), [tricky])
+
+    def test_malformed_object_only_loses_itself(self):
+        text = '[{"question": "Good?", "options": ["A", "B"], "answer": "A"}, {"question": oops}, {"n": 1}]'
+        good = {"question": "Good?", "options": ["A", "B"], "answer": "A"}
+        self.assertEqual(list(iter_json_objects([text])), [good, None, {"n": 1}])
+
+    def test_truncated_response_yields_the_complete_objects(self):
+        text = json.dumps([question("Done?"), question("Cut short?")])
+        self.assertEqual(list(iter_json_objects([text[:-20]])), [question("Done?")])
+
+
+class ValidateQuestionTest(unittest.TestCase):
+    def test_text_and_options_are_stripped(self):
+        self.assertEqual(validate_question({"question": " Why? ", "options": [" A ", "B", ""], "answer": "A "}),
+                         {"question": "Why?", "options": ["A", "B"], "answer": "A"})
+
+    def test_answer_matches_an_option_regardless_of_case(self):
+        self.assertEqual(validate_question(question("Why?", answer="b"))["answer"], "B")
+
+    def test_unusable_questions_are_rejected(self):
+        for bad in (None, [], {"question": "Why?"}, question("", answer="A"), question("Why?", answer="E"),
+                    question("Why?", options=("A",)), question("Why?", options=("A", "A", "B")),
+                    question("Why?", answer="AB", options=("Ab", "aB"))):
+            self.assertIsNone(validate_question(bad), bad)
+
+
+class QuizCollectorTest(unittest.TestCase):
+    def test_keeps_distinct_valid_questions_up_to_the_count(self):
+        collector = QuizCollector("text", 2, exclude=["Already asked?"])
+        response = [question("Already asked?"), question("New?"), question("new ?"), {"question": 1},
+                    question("Another?"), question("One too many?")]
+        fed = list(collector.feed(pieces(json.dumps(response), 5)))
+        self.assertEqual([q["question"] for q in fed], ["New?", "Another?"])
+        self.assertEqual(collector.missing, 0)
+        self.assertEqual(collector.invalid, 1)
+        self.assertIsNone(collector.next_prompt())
+
+    def test_asks_again_for_the_missing_questions_only(self):
+        collector = QuizCollector("text", 3)
+        self.assertIn("with 3 questions", collector.next_prompt())
+        list(collector.feed([json.dumps([question("First?")])]))
+        prompt = collector.next_prompt()
+        self.assertIn("with 2 questions", prompt)
+        self.assertIn("First?", prompt)
+
+
+class PlanQuizTest(unittest.TestCase):
+    def test_single_chunk_gets_every_question(self):
+        self.assertEqual(_plan_quiz(["text"], 5), [("text", 5)])
+
+    def test_asks_at_most_num_questions_chunks(self):
+        chunks = [f"chunk {i} " * 50 for i in range(30)]
+        plan = _plan_quiz(chunks, 5)
+        self.assertEqual(len(plan), 5)
+        self.assertEqual(sum(count - 1 for _, count in plan), 5)
+        self.assertEqual([chunk for chunk, _ in plan], sorted((chunk for chunk, _ in plan), key=chunks.index))
+
+    def test_questions_follow_chunk_length(self):
+        plan = dict(_plan_quiz(["a" * 9000, "b" * 1000], 10))
+        self.assertEqual(plan, {"a" * 9000: 10, "b" * 1000: 2})
@@ -0,0 +1,203 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from study_buddy.utils.singleflight import FileLocks, GenerationFailed, LocalLocks, RedisLocks, SingleFlight
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class Generation:
+    """Counts its calls; each call waits until released, then returns (or raises) its result"""
+
+    def __init__(self, result="result", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.finish = threading.Event()
+        self.stored = None
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.finish.wait(5)
+        if self.error is not None:
+            raise self.error
+        self.stored = self.result
+        return self.result
+
+    def lookup(self):
+        return self.stored
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight(LocalLocks())
+
+    def run_concurrently(self, calls, fn):
+        """Start the calls, let fn finish once they are all waiting, and return their futures"""
+        with ThreadPoolExecutor(calls) as executor:
+            futures = [executor.submit(self.flight.do, "key", fn, fn.lookup) for _ in range(calls)]
+            fn.started.wait(5)
+            time.sleep(0.1)
+            fn.finish.set()
+        return futures
+
+    def test_concurrent_calls_run_once(self):
+        generation = Generation()
+        futures = self.run_concurrently(8, generation)
+        self.assertEqual([future.result() for future in futures], ["result"] * 8)
+        self.assertEqual(generation.calls, 1)
+
+    def test_failure_reaches_every_waiter_and_is_forgotten(self):
+        failing = Generation(error=ValueError("quota"))
+        futures = self.run_concurrently(4, failing)
+        for future in futures:
+            self.assertRaisesRegex(ValueError, "quota", future.result)
+        self.assertEqual(failing.calls, 1)
+
+        retry = Generation()
+        retry.finish.set()
+        self.assertEqual(self.flight.do("key", retry, retry.lookup), "result")
+
+    def test_different_keys_are_not_coalesced(self):
+        generation = Generation()
+        generation.finish.set()
+        self.flight.do("a", generation, lambda: None)
+        self.flight.do("b", generation, lambda: None)
+        self.assertEqual(generation.calls, 2)
+
+    def test_stream_followers_get_the_whole_result(self):
+        release = threading.Event()
+
+        def chunks():
+            yield "one "
+            release.wait(5)
+            yield "two"
+
+        leader = self.flight.do_stream("key", chunks, lambda: None)
+        self.assertEqual(next(leader), "one ")
+        with ThreadPoolExecutor(1) as executor:
+            follower = executor.submit(lambda: list(self.flight.do_stream("key", chunks, lambda: None)))
+            time.sleep(0.1)
+            release.set()
+            self.assertEqual(list(leader), ["two"])
+            self.assertEqual(follower.result(5), ["one two"])
+
+    def test_closed_stream_fails_its_followers(self):
+        leader = self.flight.do_stream("key", lambda: iter(["one ", "two"]), lambda: None)
+        next(leader)
+        with ThreadPoolExecutor(1) as executor:
+            follower = executor.submit(lambda: list(self.flight.do_stream("key", lambda: iter([]), lambda: None)))
+            time.sleep(0.1)
+            leader.close()
+            self.assertRaises(GenerationFailed, follower.result, 5)
+
+
+class DoAsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight(LocalLocks())
+
+    def test_waiters_do_not_hold_threads(self):
+        calls = 0
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def main():
+            # Far more waiters than executor threads
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+            return await asyncio.gather(*(self.flight.do_async("key", generate, lambda: None) for _ in range(200)))
+
+        self.assertEqual(asyncio.run(main()), ["result"] * 200)
+        self.assertEqual(calls, 1)
+
+    def test_cancelled_waiter_leaves_the_others_waiting(self):
+        async def generate():
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def main():
+            leader = asyncio.ensure_future(self.flight.do_async("key", generate, lambda: None))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(self.flight.do_async("key", generate, lambda: None)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            waiters[0].cancel()
+            return await asyncio.gather(leader, *waiters[1:])
+
+        self.assertEqual(asyncio.run(main()), ["result"] * 3)
+
+    def test_waits_on_a_call_led_by_a_thread(self):
+        generation = Generation()
+        with ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(self.flight.do, "key", generation, generation.lookup)
+            generation.started.wait(5)
+            threading.Timer(0.1, generation.finish.set).start()
+            self.assertEqual(asyncio.run(self.flight.do_async("key", None, generation.lookup)), "result")
+            self.assertEqual(leader.result(5), "result")
+        self.assertEqual(generation.calls, 1)
+
+
+class CrossProcessTest(unittest.TestCase):
+    """Two coalescers sharing locks stand in for two worker processes"""
+
+    def make_locks(self):
+        return FileLocks(tempfile.mkdtemp(prefix="study_buddy_locks_"))
+
+    def check_result_is_reused(self, locks):
+        first, second = SingleFlight(locks), SingleFlight(locks)
+        generation = Generation()
+        with ThreadPoolExecutor(2) as executor:
+            leader = executor.submit(first.do, "key", generation, generation.lookup)
+            generation.started.wait(5)
+            other = executor.submit(second.do, "key", generation, generation.lookup)
+            time.sleep(0.1)
+            generation.finish.set()
+            self.assertEqual(leader.result(5), "result")
+            self.assertEqual(other.result(5), "result")
+        self.assertEqual(generation.calls, 1)
+
+    def check_failure_is_shared(self, locks):
+        first, second = SingleFlight(locks), SingleFlight(locks)
+        generation = Generation(error=ValueError("quota"))
+        with ThreadPoolExecutor(2) as executor:
+            leader = executor.submit(first.do, "key", generation, generation.lookup)
+            generation.started.wait(5)
+            other = executor.submit(second.do, "key", generation, generation.lookup)
+            time.sleep(0.1)
+            generation.finish.set()
+            self.assertRaises(ValueError, leader.result, 5)
+            self.assertRaisesRegex(GenerationFailed, "quota", other.result, 5)
+        self.assertEqual(generation.calls, 1)
+
+    def test_file_locks_share_results(self):
+        self.check_result_is_reused(self.make_locks())
+
+    def test_file_locks_share_failures(self):
+        self.check_failure_is_shared(self.make_locks())
+
+    def test_file_locks_sweep_unused_files(self):
+        locks = self.make_locks()
+        locks.release(locks.acquire("key"))
+        locks.record_error("key", "failed")
+        held = locks.acquire("held")
+        self.assertEqual(locks.sweep(max_age=-1), 2)
+        locks.release(held)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_locks_share_results(self):
+        self.check_result_is_reused(RedisLocks(fakeredis.FakeRedis()))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_locks_share_failures(self):
+        self.check_failure_is_shared(RedisLocks(fakeredis.FakeRedis()))